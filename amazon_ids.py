@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+from sqlalchemy import tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from models import Book, AsinCache, EnrichmentJob
+
+logger = logging.getLogger(__name__)
+
+OPENLIBRARY_SEARCH_URL = "https://openlibrary.org/search.json"
+
+# Not-found answers are re-checked after this long; found ASINs never expire
+NEGATIVE_CACHE_TTL = timedelta(days=7)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Async token bucket: `rate` requests per second on average, bursts of up to
+# `capacity`
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# First ASIN found in an OpenLibrary search response, or None
+def extract_asin(data: dict) -> Optional[str]:
+    for doc in data.get("docs", []):
+        if doc.get("id_amazon"):
+            return doc["id_amazon"][0]
+        identifiers = doc.get("identifier") or {}
+        if isinstance(identifiers, dict):
+            for key in ("amazon", "asin"):
+                if identifiers.get(key):
+                    return identifiers[key][0]
+    return None
+
+
+def _cache_key(title: Optional[str], author: Optional[str]) -> Tuple[str, str]:
+    return (title or "", author or "")
+
+
+@dataclass
+class EnrichmentSettings:
+    base_url: str = OPENLIBRARY_SEARCH_URL
+    concurrency: int = 8
+    requests_per_second: float = 5.0
+    checkpoint_every: int = 100
+    timeout: float = 10.0
+    retries: int = 3
+    backoff: float = 0.5
+    negative_ttl: timedelta = NEGATIVE_CACHE_TTL
+
+
+class AsinFetcher:
+    def __init__(self, client: httpx.AsyncClient, settings: EnrichmentSettings):
+        self.client = client
+        self.settings = settings
+        self.bucket = TokenBucket(settings.requests_per_second)
+        self.semaphore = asyncio.Semaphore(settings.concurrency)
+
+    # Returns the ASIN or None if OpenLibrary has none; raises if the lookup
+    # itself keeps failing so the miss isn't cached
+    async def fetch(self, title: str, author: str) -> Optional[str]:
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                await self.bucket.acquire()
+                try:
+                    response = await self.client.get(
+                        self.settings.base_url, params={"title": title, "author": author}
+                    )
+                    if response.status_code not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return extract_asin(response.json())
+                    error = httpx.HTTPStatusError(
+                        f"HTTP {response.status_code}", request=response.request, response=response
+                    )
+                except httpx.TransportError as e:
+                    error = e
+            attempt += 1
+            if attempt > self.settings.retries:
+                raise error
+            await asyncio.sleep(self.settings.backoff * 2 ** (attempt - 1))
+
+
+# Walk the books without an Amazon ID in id order, resolving each page
+# concurrently (cache first, then OpenLibrary) and committing the results,
+# the cache entries and the job's cursor together as a checkpoint. A job that
+# was interrupted resumes after its last checkpoint.
+async def run_enrichment(session_factory: Callable[[], Session], job_id: int, settings: EnrichmentSettings):
+    limits = httpx.Limits(max_connections=settings.concurrency, max_keepalive_connections=settings.concurrency)
+    async with httpx.AsyncClient(timeout=settings.timeout, limits=limits) as client:
+        fetcher = AsinFetcher(client, settings)
+        with session_factory() as db:
+            job = db.get(EnrichmentJob, job_id)
+            job.status = "running"
+            job.error = None
+            db.commit()
+
+            try:
+                while True:
+                    books = (
+                        db.query(Book)
+                        .filter(Book.amazon_id.is_(None), Book.id > job.last_book_id)
+                        .order_by(Book.id)
+                        .limit(settings.checkpoint_every)
+                        .all()
+                    )
+                    if not books:
+                        break
+                    await _process_page(db, fetcher, job, books, settings)
+                    db.commit()
+            except Exception as e:
+                db.rollback()
+                job.status = "failed"
+                job.error = str(e)
+                job.finished_at = datetime.now()
+                db.commit()
+                raise
+
+            job.status = "done"
+            job.finished_at = datetime.now()
+            db.commit()
+
+
+async def _process_page(db: Session, fetcher: AsinFetcher, job: EnrichmentJob, books, settings: EnrichmentSettings):
+    keys = {_cache_key(book.title, book.authors) for book in books}
+    cached: Dict[Tuple[str, str], AsinCache] = {
+        (entry.title, entry.author): entry
+        for entry in db.query(AsinCache).filter(tuple_(AsinCache.title, AsinCache.author).in_(keys))
+    }
+    negative_cutoff = datetime.now() - settings.negative_ttl
+
+    lookups = {}
+    for key in keys:
+        entry = cached.get(key)
+        if entry is not None and (entry.asin is not None or entry.fetched_at > negative_cutoff):
+            continue
+        lookups[key] = asyncio.ensure_future(fetcher.fetch(*key))
+    if lookups:
+        await asyncio.wait(lookups.values())
+
+    for key, task in lookups.items():
+        if task.exception() is not None:
+            logger.warning("Amazon ID lookup failed for %s by %s: %s", key[0], key[1], task.exception())
+            continue
+        entry = cached.get(key)
+        if entry is None:
+            entry = AsinCache(title=key[0], author=key[1])
+            db.add(entry)
+            cached[key] = entry
+        entry.asin = task.result()
+        entry.fetched_at = datetime.now()
+
+    for book in books:
+        key = _cache_key(book.title, book.authors)
+        task = lookups.get(key)
+        if task is None:
+            job.cache_hits += 1
+        elif task.exception() is not None:
+            job.failures += 1
+        entry = cached.get(key)
+        if entry is not None and entry.asin and (task is None or task.exception() is None):
+            book.amazon_id = entry.asin
+            job.updated += 1
+        job.processed += 1
+    job.last_book_id = books[-1].id
+
+
+# Runs enrichment jobs on a background thread, one at a time per process
+class AmazonIdUpdater:
+    def __init__(self, settings: Optional[EnrichmentSettings] = None):
+        self.settings = settings or EnrichmentSettings()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # Resume the latest unfinished job, or create a new one. Returns the job id.
+    def start(self, bind: Engine) -> int:
+        session_factory = sessionmaker(bind=bind, expire_on_commit=False)
+        with self._lock:
+            with session_factory() as db:
+                job = (
+                    db.query(EnrichmentJob)
+                    .filter(EnrichmentJob.status.in_(("pending", "running", "failed")))
+                    .order_by(EnrichmentJob.id.desc())
+                    .first()
+                )
+                if job is None:
+                    job = EnrichmentJob(status="pending")
+                    db.add(job)
+                    db.commit()
+                job_id = job.id
+
+            if not self.running:
+                self._thread = threading.Thread(
+                    target=self._run, args=(session_factory, job_id), name="amazon-id-updater", daemon=True
+                )
+                self._thread.start()
+        return job_id
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, session_factory, job_id: int):
+        try:
+            asyncio.run(run_enrichment(session_factory, job_id, self.settings))
+        except Exception:
+            logger.exception("Amazon ID update job %s failed", job_id)
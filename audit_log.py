@@ -0,0 +1,251 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import AUDIT_LOG_FLUSH, AUDIT_LOG_RECORDS
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("never", "batch", "interval")
+LOG_FORMATS = ("text", "jsonl")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def format_jsonl(channel: str, record: dict) -> str:
+    return json.dumps({"channel": channel, **record}, default=_json_default, ensure_ascii=False) + "\n"
+
+
+# One open file plus its pending lines. Only the writer thread touches these.
+@dataclass
+class _LogFile:
+    path: str
+    max_bytes: int
+    backup_count: int
+    handle: Optional[object] = None
+    size: int = 0
+    pending: List[str] = field(default_factory=list)
+
+    def open(self):
+        self.handle = open(self.path, "a", encoding="utf-8")
+        self.size = self.handle.tell()
+
+    def rotate(self):
+        self.handle.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.open()
+
+    # Write the pending lines. If that fails they stay pending for the next
+    # flush, which reopens the file, so a failed write is retried rather than
+    # dropped (a line may then appear twice).
+    def flush(self, fsync: bool):
+        if not self.pending:
+            return
+        data = "".join(self.pending)
+        encoded = len(data.encode("utf-8"))
+        try:
+            if self.handle is None:
+                self.open()
+            if self.max_bytes and self.size and self.size + encoded > self.max_bytes:
+                self.rotate()
+            self.handle.write(data)
+            self.handle.flush()
+        except (OSError, ValueError):
+            self._drop_handle()
+            raise
+        self.pending.clear()
+        self.size += encoded
+        if fsync:
+            os.fsync(self.handle.fileno())
+
+    def _drop_handle(self):
+        try:
+            if self.handle is not None:
+                self.handle.close()
+        except (OSError, ValueError):
+            pass
+        self.handle = None
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+# Shared writer for the append-only audit logs. Request threads hand records to
+# write(), which only enqueues; a single background thread formats them,
+# batches them per file and flushes when a batch fills up or flush_interval
+# passes. Files stay open between batches and rotate by size.
+class AuditLogWriter:
+    def __init__(
+        self,
+        formats: Tuple[str, ...] = ("text",),
+        flush_interval: float = 1.0,
+        batch_size: int = 256,
+        fsync: str = "never",
+        fsync_interval: float = 5.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        queue_size: int = 10000,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        unknown = set(formats) - set(LOG_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown log formats: {sorted(unknown)}")
+
+        self.formats = tuple(formats)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._channels: Dict[str, Tuple[str, Callable[[dict], str]]] = {}
+        self._files: Dict[str, _LogFile] = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._last_fsync = time.monotonic()
+        atexit.register(self.close)
+
+    # Register a log channel. Text lines go to `path`, JSON lines to `path`
+    # with a .jsonl extension.
+    def register(self, channel: str, path: str, text_formatter: Callable[[dict], str]):
+        self._channels[channel] = (path, text_formatter)
+
+    def write(self, channel: str, record: dict):
+        if channel not in self._channels:
+            raise KeyError(f"Unknown audit log channel: {channel}")
+        self._ensure_started()
+        # Only blocks if the writer has fallen queue_size writes behind
+        self._queue.put((channel, [record]))
+
+    # Queue several records of one channel as a single item, e.g. everything a
+    # batch request changed
+    def write_many(self, channel: str, records: List[dict]):
+        if channel not in self._channels:
+            raise KeyError(f"Unknown audit log channel: {channel}")
+        if not records:
+            return
+        self._ensure_started()
+        self._queue.put((channel, list(records)))
+
+    # Writes queued but not yet picked up by the writer thread
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # Block until everything written so far is on disk (used by tests/shutdown)
+    def flush(self, timeout: Optional[float] = None):
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(("__flush__", done))
+        done.wait(timeout)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(("__stop__", None))
+        self._thread.join()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+
+    def _log_file(self, path: str) -> _LogFile:
+        log_file = self._files.get(path)
+        if log_file is None:
+            log_file = _LogFile(path, self.max_bytes, self.backup_count)
+            self._files[path] = log_file
+        return log_file
+
+    def _append(self, channel: str, record: dict) -> int:
+        path, text_formatter = self._channels[channel]
+        pending = 0
+        if "text" in self.formats:
+            log_file = self._log_file(path)
+            log_file.pending.append(text_formatter(record))
+            pending = max(pending, len(log_file.pending))
+        if "jsonl" in self.formats:
+            log_file = self._log_file(os.path.splitext(path)[0] + ".jsonl")
+            log_file.pending.append(format_jsonl(channel, record))
+            pending = max(pending, len(log_file.pending))
+        return pending
+
+    def _flush_all(self):
+        if not any(log_file.pending for log_file in self._files.values()):
+            return
+        now = time.monotonic()
+        fsync = self.fsync == "batch" or (
+            self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval
+        )
+        with AUDIT_LOG_FLUSH.time():
+            for log_file in self._files.values():
+                try:
+                    log_file.flush(fsync)
+                except (OSError, ValueError):
+                    logger.exception("Failed to write audit log %s, will retry", log_file.path)
+        if fsync:
+            self._last_fsync = now
+
+    def _run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                channel, records = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush_all()
+                deadline = None
+                continue
+
+            if channel == "__stop__":
+                self._flush_all()
+                for log_file in self._files.values():
+                    log_file.close()
+                return
+            if channel == "__flush__":
+                self._flush_all()
+                deadline = None
+                records.set()
+                continue
+
+            pending = 0
+            for record in records:
+                try:
+                    pending = self._append(channel, record)
+                except Exception:
+                    logger.exception("Dropping unformattable %s audit record", channel)
+                    continue
+                AUDIT_LOG_RECORDS.inc(channel)
+            if pending >= self.batch_size:
+                self._flush_all()
+                deadline = None
+            elif deadline is None:
+                deadline = time.monotonic() + self.flush_interval
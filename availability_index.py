@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from models import Book
+
+LOAD_CHUNK_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+
+# Availability of every book as two bitsets keyed by book id: one bit for "the
+# book exists" and one for "it is available", plus running counts. Each
+# bitset takes (largest book id) / 8 bytes however many books there are: 125
+# KB for a million books numbered from 1, but 2.8 MB for the sample catalog,
+# whose Goodreads ids go up to 22.5 million. Loaded at startup and kept
+# current by the endpoints that change availability in this process, so
+# counts don't need the database. Only the counts are served from it: the
+# search `available` filter reads books.available with the rows it returns.
+# Changes made elsewhere (other workers, scripts, direct SQL) are only picked
+# up by reloading once the data is older than `max_age` seconds:
+# refresh_in_background() starts a reload and returns at once, while
+# refresh_if_stale() waits for it.
+class AvailabilityIndex:
+    def __init__(self, max_age: float = 0.0, clock: Callable[[], float] = time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._reloading = threading.Lock()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._exists = bytearray()
+        self._available = bytearray()
+        self._total = 0
+        self._available_count = 0
+        self._loaded_at = 0.0
+        # Changes recorded while a load reads the table, replayed onto it
+        self._pending: Optional[List[Tuple[List[int], bool]]] = None
+        self.loaded = False
+
+    @property
+    def stale(self) -> bool:
+        return self.max_age > 0 and self.clock() - self._loaded_at >= self.max_age
+
+    # Reload if stale. Only one caller reloads; the others keep answering from
+    # the current data meanwhile.
+    def refresh_if_stale(self, bind: Engine) -> bool:
+        if not self.stale or not self._reloading.acquire(blocking=False):
+            return False
+        try:
+            if self.stale:
+                self.load(bind)
+                return True
+            return False
+        finally:
+            self._reloading.release()
+
+    # Start a reload on a background thread if stale and none is running.
+    # Readers keep getting the current data until it is swapped in.
+    def refresh_in_background(self, bind: Engine) -> bool:
+        if not self.stale or not self._reloading.acquire(blocking=False):
+            return False
+        self._reload_thread = threading.Thread(
+            target=self._reload, args=(bind,), name="availability-reload", daemon=True
+        )
+        self._reload_thread.start()
+        return True
+
+    def _reload(self, bind: Engine):
+        try:
+            if self.stale:
+                self.load(bind)
+        except Exception:
+            logger.exception("Failed to reload the availability index")
+        finally:
+            self._reloading.release()
+
+    def load(self, bind: Engine):
+        fresh = AvailabilityIndex()
+        fresh.loaded = True
+        with self._lock:
+            self._pending = []
+            started = self.clock()
+        try:
+            fresh._read(bind)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for book_ids, available in self._pending:
+                fresh._set(book_ids, available)
+            self._exists, self._available = fresh._exists, fresh._available
+            self._total, self._available_count = fresh._total, fresh._available_count
+            self._pending = None
+            self._loaded_at = started
+            self.loaded = True
+
+    def _read(self, bind: Engine):
+        exists = bytearray()
+        available = bytearray()
+        total = available_count = 0
+        with bind.connect() as connection:
+            result = connection.execution_options(yield_per=LOAD_CHUNK_SIZE).execute(
+                select(Book.id, Book.available)
+            )
+            for book_id, is_available in result:
+                _grow(exists, book_id)
+                _grow(available, book_id)
+                exists[book_id >> 3] |= 1 << (book_id & 7)
+                total += 1
+                if is_available:
+                    available[book_id >> 3] |= 1 << (book_id & 7)
+                    available_count += 1
+        self._exists, self._available = exists, available
+        self._total, self._available_count = total, available_count
+
+    def clear(self):
+        with self._lock:
+            self._exists, self._available = bytearray(), bytearray()
+            self._total = self._available_count = 0
+            self.loaded = False
+
+    # Record committed availability changes. Unknown ids are added, so books
+    # created after the load are tracked from their first change on.
+    def set(self, book_ids: Iterable[int], available: bool):
+        book_ids = list(book_ids)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((book_ids, available))
+            if self.loaded:
+                self._set(book_ids, available)
+
+    def _set(self, book_ids: List[int], available: bool):
+        for book_id in book_ids:
+            _grow(self._exists, book_id)
+            _grow(self._available, book_id)
+            byte, bit = book_id >> 3, 1 << (book_id & 7)
+            if not self._exists[byte] & bit:
+                self._exists[byte] |= bit
+                self._total += 1
+            elif bool(self._available[byte] & bit) == available:
+                continue
+            elif not available:
+                self._available_count -= 1
+            if available:
+                self._available[byte] |= bit
+                self._available_count += 1
+            else:
+                self._available[byte] &= ~bit
+
+    # True/False for a known book, `default` for one the index hasn't seen
+    def get(self, book_id: int, default: Optional[bool] = None) -> Optional[bool]:
+        byte, bit = book_id >> 3, 1 << (book_id & 7)
+        if byte >= len(self._exists) or not self._exists[byte] & bit:
+            return default
+        return bool(self._available[byte] & bit)
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    @property
+    def available_count(self) -> int:
+        return self._available_count
+
+
+def _grow(bits: bytearray, book_id: int):
+    needed = (book_id >> 3) + 1
+    if len(bits) < needed:
+        # Grow geometrically so ids arriving in order don't copy every time
+        bits.extend(bytes(max(needed - len(bits), len(bits) // 2)))
@@ -0,0 +1,2 @@
+# Benchmarks and load tests for the API. Run `python -m benchmarks --help`
+# from the repository root.
@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from benchmarks.seed import CATALOG_SIZES, catalog_counts, seeded_database
+from benchmarks.scenarios import SCENARIOS, Workload
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> dict:
+    output = os.path.abspath(args.output)
+    data_dir = os.path.abspath(args.data_dir)
+    books = CATALOG_SIZES.get(args.size) or int(args.size)
+    counts = catalog_counts(books)
+    db_path = seeded_database(data_dir, args.size, args.reseed)
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "size": args.size,
+            "catalog": counts,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+    }
+    # The app writes its log and report files relative to the working directory
+    os.chdir(data_dir)
+    if args.mode in ("micro", "all"):
+        from benchmarks.micro import run_micro
+        report["micro"] = run_micro(
+            db_path, Workload(books, counts["users"]), names, args.requests, args.warmup, args.cache,
+            args.micro_concurrency,
+        )
+        report["meta"]["micro"] = {
+            "requests": args.requests, "warmup": args.warmup, "cache": args.cache,
+            "concurrency": args.micro_concurrency,
+        }
+    if args.mode in ("contention", "all"):
+        from benchmarks.contention import run_contention
+        report["contention"] = run_contention(db_path, args.contention_threads, args.requests)
+        report["meta"]["contention"] = {"threads": args.contention_threads, "attempts": args.requests}
+    if args.mode in ("load", "all"):
+        from benchmarks.load import run_load
+        report["load"] = run_load(
+            db_path, data_dir, Workload(books, counts["users"]), args.concurrency, args.duration, args.workers
+        )
+        report["meta"]["load"] = {"concurrency": args.concurrency, "duration": args.duration, "workers": args.workers}
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nResults written to {output}")
+    return report
+
+
+def print_report(report: dict):
+    meta = report["meta"]
+    print(f"commit {meta['commit']}, {meta['catalog']['books']:,} books")
+    for mode in ("micro", "contention", "load"):
+        if mode not in report:
+            continue
+        print(f"\n{mode}")
+        for name, result in report[mode].items():
+            print(
+                f"  {name:>16}: {result['requests_per_second']:9.1f} req/s  p50 {result['p50_ms']:8.2f}  "
+                f"p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms  {result['statuses']}"
+            )
+
+
+# Side by side requests/s and p95 of two result files, e.g. before/after a change
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(f"{baseline['meta']['commit']} -> {candidate['meta']['commit']}")
+    for mode in ("micro", "contention", "load"):
+        common = [name for name in candidate.get(mode, {}) if name in baseline.get(mode, {})]
+        if not common:
+            continue
+        print(f"\n{mode}")
+        for name in common:
+            old, new = baseline[mode][name], candidate[mode][name]
+            rps_change = new["requests_per_second"] / old["requests_per_second"] if old["requests_per_second"] else 0
+            print(
+                f"  {name:>16}: {old['requests_per_second']:9.1f} -> {new['requests_per_second']:9.1f} req/s "
+                f"({rps_change:5.2f}x)  p95 {old['p95_ms']:8.2f} -> {new['p95_ms']:8.2f} ms"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="API benchmarks and load tests")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed a catalog and benchmark the API")
+    run_parser.add_argument("--size", default="10k", help=f"{', '.join(CATALOG_SIZES)} or a number of books")
+    run_parser.add_argument("--mode", choices=("micro", "contention", "load", "all"), default="all")
+    run_parser.add_argument("--scenarios", help="comma separated micro benchmarks (default: all)")
+    run_parser.add_argument("--requests", type=int, default=200,
+                            help="requests per micro benchmark, and copy claims in the contention benchmark")
+    run_parser.add_argument("--warmup", type=int, default=10)
+    run_parser.add_argument("--cache", action="store_true", help="leave the catalog cache on in micro benchmarks")
+    run_parser.add_argument("--micro-concurrency", type=int, default=1, help="micro benchmark requests in flight")
+    run_parser.add_argument("--contention-threads", type=int, default=8, help="threads racing for copies")
+    run_parser.add_argument("--concurrency", type=int, default=32, help="load test clients")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="load test seconds")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_parser.add_argument("--data-dir", default=".benchmarks", help="seeded databases and app output")
+    run_parser.add_argument("--reseed", action="store_true", help="recreate the seeded database")
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
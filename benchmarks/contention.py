@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from sqlalchemy.orm import sessionmaker
+
+from database import create_db_engine
+from inventory import add_copies, claim_copy, release_copies
+from models import Book
+from benchmarks.stats import summarize
+
+
+# Copy claim attempts per second with `threads` workers racing for the
+# `copies` copies of one new book in the seeded database at `db_path`. Each
+# worker has its own session and connection; an attempt claims a copy in one
+# transaction and, if it got one, puts it back in another, so the copies keep
+# changing hands. Statuses count claimed and lost attempts.
+def run_contention(db_path: str, threads: int = 8, attempts: int = 2000, copies: int = 4) -> Dict:
+    engine = create_db_engine(f"sqlite:///{db_path}", profile="production")
+    sessions = sessionmaker(bind=engine, expire_on_commit=False)
+    with sessions() as db:
+        book = Book(title="Contended Benchmark Book", authors="Benchmark", isbn=f"CONTENDED-{time.time_ns()}")
+        db.add(book)
+        db.flush()
+        if copies > 1:
+            add_copies(db, book.id, copies - 1)
+        db.commit()
+        book_id = book.id
+
+    barrier = threading.Barrier(threads)
+
+    def worker(count: int):
+        latencies = []
+        statuses = Counter()
+        with sessions() as db:
+            barrier.wait()
+            for _ in range(count):
+                start = time.perf_counter()
+                copy_id = claim_copy(db, book_id)
+                db.commit()
+                latencies.append(time.perf_counter() - start)
+                statuses["claimed" if copy_id is not None else "lost"] += 1
+                if copy_id is not None:
+                    release_copies(db, [(book_id, copy_id)])
+                    db.commit()
+        return latencies, statuses
+
+    shares = [attempts // threads + (i < attempts % threads) for i in range(threads)]
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(worker, shares))
+        elapsed = time.perf_counter() - started
+    finally:
+        engine.dispose()
+
+    latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+    statuses = sum((worker_statuses for _, worker_statuses in results), Counter())
+    return {"claim_copy": summarize(latencies, elapsed, statuses)}
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+import httpx
+
+from benchmarks.scenarios import SCENARIOS, LOAD_MIX, Workload
+from benchmarks.stats import summarize
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Start uvicorn serving main:app on the seeded database. Logs and report files
+# the app writes end up in `workdir`.
+def start_server(db_path: str, workdir: str, port: int, workers: int = 1) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env,
+    )
+
+
+def wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/books/available/count", timeout=1.0).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"uvicorn did not answer within {timeout:.0f}s")
+
+
+# `concurrency` clients send the LOAD_MIX requests back to back for `duration`
+# seconds. Results are per scenario plus "all".
+async def generate_load(base_url: str, workload: Workload, concurrency: int, duration: float,
+                        mix: Optional[Dict[str, int]] = None) -> Dict:
+    mix = mix or LOAD_MIX
+    names, weights = list(mix), list(mix.values())
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = workload.rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    status = (await SCENARIOS[name](client, workload)).status_code
+                except httpx.HTTPError:
+                    # Counted as status 0: no response at all
+                    status = 0
+                latencies[name].append(time.perf_counter() - start)
+                statuses[name][status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    results = {name: summarize(latencies[name], elapsed, statuses[name]) for name in names if latencies[name]}
+    results["all"] = summarize(
+        [latency for values in latencies.values() for latency in values],
+        elapsed,
+        sum(statuses.values(), Counter()),
+    )
+    return results
+
+
+def run_load(db_path: str, workdir: str, workload: Workload, concurrency: int = 32, duration: float = 30.0,
+             workers: int = 1) -> Dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(db_path, workdir, port, workers)
+    try:
+        wait_until_ready(base_url, server)
+        return asyncio.run(generate_load(base_url, workload, concurrency, duration))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
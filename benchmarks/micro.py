@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Dict, Iterable
+
+import httpx
+from fastapi import Depends, FastAPI, Query
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import create_db_engine, create_async_db_engine
+from main import (app, get_db, get_async_db, catalog_cache, availability_index, suggest_index, audit_log,
+                  BOOK_COLUMNS, filter_book_search, send_book_page, serialize_book)
+from search_index import search_index_enabled
+from benchmarks.scenarios import SCENARIOS, Workload
+from benchmarks.stats import summarize
+
+
+SYNC_PREFIX = "/_sync"
+
+
+# Search served from a sync `def` handler, which runs in Starlette's
+# threadpool, for comparison with the async endpoint
+def sync_search_app(get_sync_db) -> FastAPI:
+    sync_app = FastAPI()
+
+    @sync_app.get("/books/search")
+    def search_books_sync(query: str = Query(None), limit: int = Query(None), db: Session = Depends(get_sync_db)):
+        q = filter_book_search(db.query(*BOOK_COLUMNS), query, None, None, search_index_enabled(db.get_bind()))
+        if limit:
+            q = q.limit(limit)
+        return send_book_page([serialize_book(book) for book in q.all()], None)
+
+    return sync_app
+
+
+# The app, with the sync handlers under SYNC_PREFIX
+def with_sync_routes(sync_app: FastAPI):
+    async def dispatch(scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(SYNC_PREFIX + "/"):
+            scope = dict(scope, path=scope["path"][len(SYNC_PREFIX):])
+            await sync_app(scope, receive, send)
+        else:
+            await app(scope, receive, send)
+    return dispatch
+
+
+async def _run_scenarios(target, names: Iterable[str], workload: Workload, requests: int, warmup: int,
+                         concurrency: int) -> Dict:
+    results = {}
+    transport = httpx.ASGITransport(app=target)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in names:
+            scenario = SCENARIOS[name]
+            for _ in range(warmup):
+                await scenario(client, workload)
+
+            latencies = []
+            statuses = Counter()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await scenario(client, workload)
+                    latencies.append(time.perf_counter() - start)
+                    statuses[response.status_code] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(requests)))
+            results[name] = summarize(latencies, time.perf_counter() - started, statuses)
+    return results
+
+
+# Time each endpoint in-process against the seeded database at `db_path`,
+# one request at a time or `concurrency` in flight. The app runs through
+# httpx's ASGI transport, so the numbers leave out the network and the
+# server. The catalog cache is off unless `cache` is set, so catalog reads
+# reach the database.
+def run_micro(db_path: str, workload: Workload, names: Iterable[str], requests: int = 200,
+              warmup: int = 10, cache: bool = False, concurrency: int = 1) -> Dict:
+    url = f"sqlite:///{db_path}"
+    engine = create_db_engine(url, profile="production")
+    async_engine = create_async_db_engine(url, profile="production")
+    sessions = sessionmaker(bind=engine, expire_on_commit=False)
+    async_sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    def bench_db():
+        db = sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def bench_async_db():
+        async with async_sessions() as db:
+            yield db
+
+    overrides = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = bench_db
+    app.dependency_overrides[get_async_db] = bench_async_db
+    cache_enabled = catalog_cache.enabled
+    catalog_cache.enabled = cache
+    catalog_cache.invalidate()
+    # The ASGI transport doesn't run the lifespan hook that loads the indexes
+    availability_index.load(engine)
+    suggest_index.load(engine)
+    try:
+        target = with_sync_routes(sync_search_app(bench_db))
+        return asyncio.run(_run_scenarios(target, names, workload, requests, warmup, concurrency))
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(overrides)
+        catalog_cache.enabled = cache_enabled
+        catalog_cache.invalidate()
+        availability_index.clear()
+        suggest_index.clear()
+        audit_log.flush()
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
@@ -0,0 +1,127 @@
+import random
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict
+
+import httpx
+
+from benchmarks.seed import ADJECTIVES, NOUNS, book_author
+
+
+# What the request generators need to know about the seeded catalog, plus the
+# rentals they opened so later requests can return them
+@dataclass
+class Workload:
+    books: int
+    users: int
+    rng: random.Random = field(default_factory=lambda: random.Random(7))
+    open_rentals: deque = field(default_factory=deque)
+
+    def book_id(self) -> int:
+        return self.rng.randint(1, self.books)
+
+    def user_id(self) -> int:
+        return self.rng.randint(1, self.users)
+
+    def title_words(self) -> str:
+        return f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)}"
+
+    # Title words as typed so far: the last word cut short
+    def typed_prefix(self) -> str:
+        words = self.title_words()
+        return words[:self.rng.randint(len(words) - 4, len(words) - 1)]
+
+    # A title word with two neighbouring letters swapped
+    def misspelled_word(self) -> str:
+        word = self.rng.choice(NOUNS)
+        i = self.rng.randrange(len(word) - 1)
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+Scenario = Callable[[httpx.AsyncClient, Workload], Awaitable[httpx.Response]]
+
+
+async def books_page(client, workload):
+    return await client.get("/books", params={"limit": 100, "after_id": workload.rng.randint(0, workload.books)})
+
+# 1000-row pages, where serializing the rows is most of the work
+async def books_page_large(client, workload):
+    return await client.get("/books", params={"limit": 1000, "after_id": workload.rng.randint(0, workload.books)})
+
+async def search(client, workload):
+    return await client.get("/books/search", params={"query": workload.title_words(), "limit": 50})
+
+async def search_large(client, workload):
+    return await client.get("/books/search", params={"query": workload.rng.choice(NOUNS), "limit": 1000})
+
+# The same search served by a sync `def` handler (see benchmarks/micro.py),
+# to compare against the async endpoint; micro benchmarks only
+async def search_sync(client, workload):
+    return await client.get("/_sync/books/search", params={"query": workload.title_words(), "limit": 50})
+
+async def search_author(client, workload):
+    return await client.get("/books/search", params={"author": book_author(workload.book_id())})
+
+async def search_available(client, workload):
+    return await client.get(
+        "/books/search", params={"query": workload.title_words(), "available": "true", "limit": 50}
+    )
+
+async def autocomplete(client, workload):
+    return await client.get("/books/autocomplete", params={"query": workload.typed_prefix()})
+
+async def search_fuzzy(client, workload):
+    return await client.get("/books/search", params={"query": workload.misspelled_word(), "fuzzy": "true", "limit": 50})
+
+async def available_count(client, workload):
+    return await client.get("/books/available/count")
+
+async def wishlist(client, workload):
+    return await client.get(f"/wishlist/{workload.user_id()}")
+
+async def rent(client, workload):
+    response = await client.post("/rentals", json={"book_id": workload.book_id(), "user_id": workload.user_id()})
+    if response.status_code == 200:
+        workload.open_rentals.append(response.json()["id"])
+    return response
+
+async def return_book(client, workload):
+    if not workload.open_rentals:
+        await rent(client, workload)
+    if not workload.open_rentals:
+        return await client.patch("/rentals/0/return")
+    return await client.patch(f"/rentals/{workload.open_rentals.popleft()}/return")
+
+async def rental_report(client, workload):
+    return await client.get("/rental-report", params={"limit": 100})
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "books_page": books_page,
+    "books_page_large": books_page_large,
+    "search": search,
+    "search_large": search_large,
+    "search_sync": search_sync,
+    "search_author": search_author,
+    "search_available": search_available,
+    "autocomplete": autocomplete,
+    "search_fuzzy": search_fuzzy,
+    "available_count": available_count,
+    "wishlist": wishlist,
+    "rent": rent,
+    "return": return_book,
+    "rental_report": rental_report,
+}
+
+# Request mix of the load test: mostly catalog reads, some rentals
+LOAD_MIX = {
+    "books_page": 10,
+    "search": 35,
+    "search_author": 10,
+    "search_available": 10,
+    "available_count": 5,
+    "wishlist": 15,
+    "rent": 6,
+    "return": 6,
+    "rental_report": 3,
+}
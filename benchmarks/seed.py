@@ -0,0 +1,134 @@
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
+
+from database import create_db_engine
+from models import Base, Book, User, Rental, Wishlist
+from search_index import ensure_search_index
+from rental_stats import ensure_rental_stats
+from inventory import backfill_copies
+from migrations import apply_migrations
+
+# Catalog sizes by name; users, rentals and wishlist entries scale with them
+CATALOG_SIZES = {
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+}
+
+INSERT_CHUNK_SIZE = 10_000
+
+ADJECTIVES = ["Silent", "Hidden", "Lost", "Broken", "Golden", "Last", "Secret", "Crimson", "Distant", "Winter"]
+NOUNS = ["Garden", "River", "Kingdom", "Letter", "Island", "Machine", "Empire", "Mirror", "Forest", "Voyage"]
+FIRST_NAMES = ["Anna", "Jorge", "Mei", "Tom", "Amara", "Lars", "Priya", "Hugo", "Sofia", "Kenji"]
+LAST_NAMES = ["Ellis", "Moreau", "Tanaka", "Okafor", "Novak", "Reyes", "Lindqvist", "Haddad", "Walsh", "Iyer"]
+LANGUAGES = ["en", "en", "en", "fr", "de", "es"]
+
+
+def catalog_counts(books: int) -> Dict[str, int]:
+    return {
+        "books": books,
+        "users": max(10, books // 100),
+        "rentals": books // 10,
+        "wishlists": books // 5,
+    }
+
+
+def book_title(i: int) -> str:
+    return f"The {ADJECTIVES[i % 10]} {NOUNS[i // 10 % 10]} {i}"
+
+
+def book_author(i: int) -> str:
+    # About one author per 20 books
+    author = i // 20
+    return f"{FIRST_NAMES[author % 10]} {LAST_NAMES[author // 10 % 10]} {author}"
+
+
+def _insert(connection, table, rows):
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        connection.execute(table.insert(), rows[start:start + INSERT_CHUNK_SIZE])
+
+
+# Fill an empty database with a synthetic catalog of `books` books. Half of
+# the rentals are still open (their books unavailable), the rest returned.
+# The same seed always produces the same data.
+def seed_catalog(engine: Engine, books: int, seed: int = 42) -> Dict[str, int]:
+    rng = random.Random(seed)
+    counts = catalog_counts(books)
+    Base.metadata.create_all(bind=engine)
+    ensure_search_index(engine)
+    ensure_rental_stats(engine)
+
+    now = datetime.now()
+    rented = rng.sample(range(1, books + 1), counts["rentals"])
+    active = set(rented[: counts["rentals"] // 2])
+
+    with engine.begin() as connection:
+        for start in range(1, books + 1, INSERT_CHUNK_SIZE):
+            connection.execute(Book.__table__.insert(), [
+                {
+                    "id": i,
+                    "isbn": f"SYN{i:09d}",
+                    "title": book_title(i),
+                    "authors": book_author(i),
+                    "publication_year": 1900 + i % 125,
+                    "language": LANGUAGES[i % len(LANGUAGES)],
+                    "available": i not in active,
+                }
+                for i in range(start, min(start + INSERT_CHUNK_SIZE, books + 1))
+            ])
+
+        _insert(connection, User.__table__, [
+            {"id": i, "username": f"reader{i}"} for i in range(1, counts["users"] + 1)
+        ])
+
+        rentals = []
+        for book_id in rented:
+            rental_date = now - timedelta(days=rng.randint(1, 365))
+            returned = book_id not in active
+            rentals.append({
+                "book_id": book_id,
+                "user_id": rng.randint(1, counts["users"]),
+                "rental_date": rental_date,
+                "return_date": rental_date + timedelta(days=rng.randint(1, 30)) if returned else None,
+            })
+        _insert(connection, Rental.__table__, rentals)
+
+        wishlist = set()
+        while len(wishlist) < counts["wishlists"]:
+            wishlist.add((rng.randint(1, counts["users"]), rng.randint(1, books)))
+        _insert(connection, Wishlist.__table__, [
+            {"user_id": user_id, "book_id": book_id} for user_id, book_id in sorted(wishlist)
+        ])
+        # Match the open rentals to their books' copies
+        backfill_copies(connection)
+    return counts
+
+
+# Path of a seeded catalog database under `data_dir`, seeding it on first use
+def seeded_database(data_dir: str, size: str, reseed: bool = False) -> str:
+    books = CATALOG_SIZES[size] if size in CATALOG_SIZES else int(size)
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(data_dir, f"catalog-{size}.db"))
+    if reseed and os.path.exists(path):
+        os.remove(path)
+
+    url = f"sqlite:///{path}"
+    engine = create_db_engine(url, profile="production")
+    try:
+        Base.metadata.create_all(bind=engine)
+        # Databases seeded by older versions get the current indexes
+        apply_migrations(engine)
+        with engine.connect() as connection:
+            existing = connection.execute(func.count(Book.id).select()).scalar()
+        if existing == 0:
+            seed_catalog(engine, books)
+        elif existing != books:
+            raise ValueError(f"{path} holds {existing} books, expected {books}; pass --reseed")
+    finally:
+        engine.dispose()
+    return path
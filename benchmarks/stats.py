@@ -0,0 +1,25 @@
+import math
+from collections import Counter
+from typing import Dict, List
+
+
+# Nearest-rank percentile of an ascending list
+def percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+# Latencies are in seconds; the summary reports milliseconds
+def summarize(latencies: List[float], elapsed: float, statuses: Counter) -> Dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "requests_per_second": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
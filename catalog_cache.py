@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+DEFAULT_MAX_RESULTS = 1024
+DEFAULT_MAX_ROWS = 50000
+DEFAULT_TTL = 30.0
+# Availability overrides kept before the whole cache is reset
+DEFAULT_MAX_OVERRIDES = 100000
+
+
+@dataclass
+class CacheStats:
+    enabled: bool
+    hits: int
+    misses: int
+    results: int
+    rows: int
+    overrides: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# In-process LRU/TTL cache of serialized book rows and of the book ids (plus
+# next cursor) each catalog listing or search returned. Rows are shared
+# between results, so a book appears once however many searches return it.
+#
+# The catalog itself rarely changes, but `available` and the copy counts
+# change all the time, so every such change in this process is written
+# through to the cached rows with set_available_copies() (or
+# set_availability()). A result whose database read started before a
+# write is patched with the written value when it is stored, so a write is
+# never followed by a stale read. Other catalog changes (imports) call
+# invalidate(). Changes made outside this process show up once entries expire.
+class CatalogCache:
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_results: int = DEFAULT_MAX_RESULTS,
+        max_rows: int = DEFAULT_MAX_ROWS,
+        ttl: float = DEFAULT_TTL,
+        max_overrides: int = DEFAULT_MAX_OVERRIDES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.enabled = enabled
+        self.max_results = max_results
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.max_overrides = max_overrides
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._results: "OrderedDict[Hashable, Tuple[float, List[int], Optional[int]]]" = OrderedDict()
+        self._rows: "OrderedDict[int, Tuple[float, dict]]" = OrderedDict()
+        # book id -> (sequence number of the write, fields written)
+        self._overrides: Dict[int, Tuple[int, dict]] = {}
+        self._sequence = 0
+        # Results read before this sequence number are no longer stored
+        self._floor = 0
+
+    # Take this before querying the database and pass it to put()
+    @property
+    def generation(self) -> int:
+        return self._sequence
+
+    # The cached rows and next cursor for `key`, or None on a miss
+    def get(self, key: Hashable) -> Optional[Tuple[List[dict], Optional[int]]]:
+        if not self.enabled:
+            return None
+        now = self.clock()
+        with self._lock:
+            entry = self._results.get(key)
+            rows = None
+            if entry is not None and entry[0] > now:
+                rows = self._lookup_rows(entry[1], now)
+            if rows is None:
+                if entry is not None:
+                    del self._results[key]
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return rows, entry[2]
+
+    def put(self, key: Hashable, rows: List[dict], cursor: Optional[int], generation: int):
+        if not self.enabled:
+            return
+        expires = self.clock() + self.ttl
+        with self._lock:
+            if generation < self._floor:
+                return
+            for row in rows:
+                override = self._overrides.get(row["id"])
+                if override is not None and override[0] > generation and _differs(row, override[1]):
+                    row = dict(row, **override[1])
+                self._rows[row["id"]] = (expires, row)
+                self._rows.move_to_end(row["id"])
+            self._results[key] = (expires, [row["id"] for row in rows], cursor)
+            self._results.move_to_end(key)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    # Write-through hook for every committed availability change
+    def set_availability(self, book_ids: Iterable[int], available: bool):
+        self._write({book_id: {"available": available} for book_id in book_ids})
+
+    # Write-through hook for committed changes to the available copy counts
+    def set_available_copies(self, counts: Dict[int, int]):
+        self._write({
+            book_id: {"available": available_copies > 0, "available_copies": available_copies}
+            for book_id, available_copies in counts.items()
+        })
+
+    def _write(self, changes: Dict[int, dict]):
+        with self._lock:
+            self._sequence += 1
+            for book_id, fields in changes.items():
+                self._overrides[book_id] = (self._sequence, fields)
+                entry = self._rows.get(book_id)
+                if entry is not None and _differs(entry[1], fields):
+                    self._rows[book_id] = (entry[0], dict(entry[1], **fields))
+            if len(self._overrides) > self.max_overrides:
+                # Forget the overrides; reads still in flight won't be stored
+                self._overrides.clear()
+                self._floor = self._sequence
+
+    # Drop everything, e.g. after a catalog import
+    def invalidate(self):
+        with self._lock:
+            self._results.clear()
+            self._rows.clear()
+            self._overrides.clear()
+            self._sequence += 1
+            self._floor = self._sequence
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self.enabled, self.hits, self.misses, len(self._results), len(self._rows), len(self._overrides)
+            )
+
+    def _lookup_rows(self, book_ids: List[int], now: float) -> Optional[List[dict]]:
+        rows = []
+        for book_id in book_ids:
+            entry = self._rows.get(book_id)
+            if entry is None or entry[0] <= now:
+                return None
+            rows.append(entry[1])
+        return rows
+
+
+def _differs(row: dict, fields: dict) -> bool:
+    return any(row.get(name) != value for name, value in fields.items())
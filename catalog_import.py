@@ -0,0 +1,162 @@
+import csv
+import time
+from dataclasses import dataclass
+from itertools import islice
+from multiprocessing import Pool
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+
+from inventory import add_first_copies
+from models import Book
+
+DEFAULT_BATCH_SIZE = 1000
+
+# CSV header -> books column
+CSV_COLUMNS = {
+    "Id": "id",
+    "ISBN": "isbn",
+    "Authors": "authors",
+    "Publication Year": "publication_year",
+    "Title": "title",
+    "Language": "language",
+}
+
+# Catalog fields refreshed when a book already exists. Availability and the
+# Amazon ID belong to the library, not the catalog file, so they are kept.
+UPDATED_COLUMNS = ("isbn", "authors", "publication_year", "title", "language")
+
+
+@dataclass
+class ImportProgress:
+    chunk: int
+    chunk_rows: int
+    chunk_seconds: float
+    total_rows: int
+    elapsed_seconds: float
+
+    @property
+    def chunk_rate(self) -> float:
+        return self.chunk_rows / self.chunk_seconds if self.chunk_seconds else 0.0
+
+    @property
+    def overall_rate(self) -> float:
+        return self.total_rows / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+
+@dataclass
+class ImportResult:
+    rows: int
+    chunks: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _to_int(value: str) -> Optional[int]:
+    value = value.strip()
+    return int(value) if value else None
+
+
+# Turn raw CSV rows into books column dicts
+def convert_rows(header: List[str], rows: List[List[str]]) -> List[dict]:
+    positions = [(header.index(csv_name), column) for csv_name, column in CSV_COLUMNS.items()]
+    records = []
+    for row in rows:
+        record = {column: row[position] for position, column in positions}
+        record["id"] = int(record["id"])
+        record["publication_year"] = _to_int(record["publication_year"])
+        records.append(record)
+    return records
+
+
+def _convert_chunk(args):
+    return convert_rows(*args)
+
+
+def _raw_chunks(reader, batch_size: int) -> Iterator[List[List[str]]]:
+    while True:
+        chunk = list(islice(reader, batch_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Stream books.csv-style rows in chunks of batch_size. With workers > 1 the
+# rows of each chunk are converted in a process pool while the next chunk is
+# read.
+def read_book_chunks(csvfile: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                     workers: int = 1) -> Iterator[List[dict]]:
+    reader = csv.reader(csvfile)
+    header = next(reader, None)
+    if header is None:
+        return
+    missing = [name for name in CSV_COLUMNS if name not in header]
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+
+    if workers <= 1:
+        for chunk in _raw_chunks(reader, batch_size):
+            yield convert_rows(header, chunk)
+        return
+
+    with Pool(workers) as pool:
+        tasks = ((header, chunk) for chunk in _raw_chunks(reader, batch_size))
+        yield from pool.imap(_convert_chunk, tasks)
+
+
+# INSERT ... ON CONFLICT (id) DO UPDATE for the engine's dialect. Rows whose
+# catalog fields are unchanged are left alone, so re-running an import is a
+# no-op for them.
+def upsert_statement(engine: Engine):
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        stmt = sqlite.insert(Book.__table__)
+    elif dialect == "postgresql":
+        stmt = postgresql.insert(Book.__table__)
+    else:
+        raise ValueError(f"Bulk upsert is not supported on '{dialect}'")
+
+    changed = None
+    for column in UPDATED_COLUMNS:
+        differs = Book.__table__.c[column].is_distinct_from(stmt.excluded[column])
+        changed = differs if changed is None else changed | differs
+    return stmt.on_conflict_do_update(
+        index_elements=[Book.__table__.c.id],
+        set_={column: stmt.excluded[column] for column in UPDATED_COLUMNS},
+        where=changed,
+    )
+
+
+# Load a CSV stream into the books table, one transaction per chunk, new
+# books with their first copy. Progress
+# is reported, and on_chunk called with the chunk's records, after every
+# committed chunk.
+def import_books(engine: Engine, csvfile: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                 workers: int = 1, progress: Optional[Callable[[ImportProgress], None]] = None,
+                 on_chunk: Optional[Callable[[List[dict]], None]] = None) -> ImportResult:
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    stmt = upsert_statement(engine)
+    started = time.perf_counter()
+    total_rows = 0
+    chunks = 0
+
+    for records in read_book_chunks(csvfile, batch_size, workers):
+        chunk_started = time.perf_counter()
+        with engine.begin() as connection:
+            connection.execute(stmt, records)
+            add_first_copies(connection, [record["id"] for record in records])
+        now = time.perf_counter()
+
+        chunks += 1
+        total_rows += len(records)
+        if on_chunk:
+            on_chunk(records)
+        if progress:
+            progress(ImportProgress(chunks, len(records), now - chunk_started, total_rows, now - started))
+
+    return ImportResult(total_rows, chunks, time.perf_counter() - started)
@@ -1,14 +1,143 @@
-from sqlalchemy import create_engine
+import os
+from functools import lru_cache
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# SQLite database stored locally in this file by default. Set DATABASE_URL to
+# use another file or a postgresql:// URL. In-memory SQLite ("sqlite://")
+# only works with the sync engine: the async engine can't share its
+# connection, and asking for async sessions raises ValueError.
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./library.db")
+
+# Engine profile, see ENGINE_PROFILES below
+DB_PROFILE = os.environ.get("DB_PROFILE", "production")
+
+# PRAGMAs applied to every new SQLite connection, per profile.
+# - production: WAL lets readers run alongside the single writer, NORMAL sync
+#   is safe in WAL mode, and a 30s busy timeout queues writers instead of
+#   failing with "database is locked".
+# - test: fast and disposable, no durability guarantees.
+IN_MEMORY_URLS = ("sqlite://", "sqlite:///:memory:")
+
+ENGINE_PROFILES = {
+    "production": {
+        "sqlite_pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 30000,
+            "cache_size": -64000,  # 64 MB
+            "mmap_size": 268435456,  # 256 MB
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 10,
+        "max_overflow": 20,
+    },
+    "test": {
+        "sqlite_pragmas": {
+            "synchronous": "OFF",
+            "busy_timeout": 30000,
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 5,
+        "max_overflow": 10,
+    },
+    # Plain SQLAlchemy defaults
+    "default": {
+        "sqlite_pragmas": {},
+        "pool_size": 5,
+        "max_overflow": 10,
+    },
+}
+
+
+def _apply_sqlite_pragmas(engine: Engine, pragmas: dict):
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+# Engine keyword arguments and SQLite PRAGMAs for a URL under a profile
+def _engine_options(url: str, profile: str):
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE '{profile}', expected one of {sorted(ENGINE_PROFILES)}")
+    settings = ENGINE_PROFILES[profile]
+    pool_options = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", settings["pool_size"])),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", settings["max_overflow"])),
+    }
+
+    if not url.startswith("sqlite"):
+        return {**pool_options, "pool_pre_ping": True}, {}
+
+    pragmas = dict(settings["sqlite_pragmas"])
+    options = {"connect_args": {"timeout": pragmas.get("busy_timeout", 5000) / 1000}}
+    if url in IN_MEMORY_URLS:
+        # One shared connection, otherwise every connection gets its own empty DB
+        pragmas.pop("journal_mode", None)
+        options["poolclass"] = StaticPool
+    else:
+        options.update(pool_options)
+    return options, pragmas
+
+
+def create_db_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE) -> Engine:
+    options, pragmas = _engine_options(url, profile)
+    if url.startswith("sqlite"):
+        options["connect_args"]["check_same_thread"] = False
+    engine = create_engine(url, **options)
+    _apply_sqlite_pragmas(engine, pragmas)
+    return engine
+
+
+# Async drivers used for the same database by the async engine
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+# Async counterpart of create_db_engine, with the same profile settings
+def create_async_db_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE) -> AsyncEngine:
+    # aiosqlite would open a second, empty database next to the sync
+    # engine's, without the tables or migrations
+    if url in IN_MEMORY_URLS:
+        raise ValueError("In-memory SQLite can't be shared with the async engine; use a database file")
+    options, pragmas = _engine_options(url, profile)
+    engine = create_async_engine(async_database_url(url), **options)
+    _apply_sqlite_pragmas(engine.sync_engine, pragmas)
+    return engine
+
+
+engine = create_db_engine()
+
+# Objects stay loaded after commit, so handlers can log/return them without
+# another round trip per object
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
-# SQLite database stored locally in this file
-DATABASE_URL = "sqlite:///./library.db?check_same_thread=False"
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False, "timeout": 3}  # wait 30 seconds if locked
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Session factory of the async engine, which is created on first use rather
+# than on import: scripts and in-memory databases only need the sync engine
+@lru_cache(maxsize=None)
+def get_async_sessions() -> async_sessionmaker:
+    return async_sessionmaker(create_async_db_engine(), autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
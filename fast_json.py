@@ -0,0 +1,31 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+# orjson is optional: it serializes large listings many times faster than the
+# standard library, which is used when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Dates come out in ISO format either way, as orjson writes them
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# JSON response rendered with orjson. Handlers return it directly with plain
+# dicts/lists, which skips FastAPI's jsonable_encoder and response model
+# validation, so only use it for data whose shape the handler controls.
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
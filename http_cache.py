@@ -0,0 +1,205 @@
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+import anyio.to_thread
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+from starlette.responses import Response
+
+# brotli is optional: it compresses JSON listings a good deal smaller than
+# gzip, which is used when it isn't installed (or the client doesn't take br)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Seconds a version stamp is used before a new one is issued regardless
+DEFAULT_MAX_AGE = 30.0
+# Users with their own wishlist version kept before all are forgotten
+DEFAULT_MAX_WISHLISTS = 100000
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Chunks at least this large are compressed off the event loop
+THREAD_MIN_SIZE = 128 * 1024
+
+
+@dataclass(frozen=True)
+class Stamp:
+    etag: str
+    # Time of the last change the stamp covers, and when it was handed out
+    modified: float
+    issued: float
+
+    # HTTP dates have whole seconds, so a change made in the second the stamp
+    # is handed out could be followed by another with the same date: there is
+    # no Last-Modified until that second is over
+    @property
+    def last_modified(self) -> Optional[str]:
+        if int(self.modified) >= int(self.issued):
+            return None
+        return formatdate(int(self.modified), usegmt=True)
+
+
+# Version stamps for conditional GETs of the catalog and of wishlists. The
+# catalog generation is bumped by every committed change to what the
+# listings show (availability, copy counts, imports) and each user's
+# wishlist version by changes to that wishlist, so a client revalidating
+# with the stamp it was given gets a 304 without the query running.
+#
+# Like the catalog cache, the stamps only see changes made in this process.
+# Every `max_age` seconds all stamps are renewed, so a change made through
+# another worker process or a script is served within that time; `max_age`
+# of 0 never renews (a single worker process). The random token keeps
+# stamps from before a restart from matching.
+class VersionStamps:
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE, max_wishlists: int = DEFAULT_MAX_WISHLISTS,
+                 clock: Callable[[], float] = time.time):
+        self.max_age = max_age
+        self.max_wishlists = max_wishlists
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._token = secrets.token_hex(4)
+        self._epoch = 0
+        self._epoch_started = clock()
+        self._catalog = 0
+        self._catalog_modified = self._epoch_started
+        # user id -> (wishlist version, time of the change)
+        self._wishlists: Dict[int, Tuple[int, float]] = {}
+        self._wishlist_sequence = 0
+
+    def catalog(self) -> Stamp:
+        now = self.clock()
+        with self._lock:
+            self._renew_expired(now)
+            return self._stamp(f"c{self._catalog}", self._catalog_modified, now)
+
+    def wishlist(self, user_id: int) -> Stamp:
+        now = self.clock()
+        with self._lock:
+            self._renew_expired(now)
+            version, modified = self._wishlists.get(user_id, (0, self._epoch_started))
+            return self._stamp(f"w{version}", modified, now)
+
+    def catalog_changed(self):
+        with self._lock:
+            self._catalog += 1
+            self._catalog_modified = self.clock()
+
+    def wishlist_changed(self, user_id: int):
+        now = self.clock()
+        with self._lock:
+            self._wishlist_sequence += 1
+            self._wishlists[user_id] = (self._wishlist_sequence, now)
+            if len(self._wishlists) > self.max_wishlists:
+                self._renew(now)
+
+    # Every stamp changes, e.g. after a catalog import (wishlists show book
+    # titles too)
+    def invalidate(self):
+        now = self.clock()
+        with self._lock:
+            self._catalog += 1
+            self._catalog_modified = now
+            self._renew(now)
+
+    def _stamp(self, version: str, modified: float, now: float) -> Stamp:
+        modified = max(modified, self._epoch_started)
+        return Stamp(f'W/"{self._token}.{self._epoch}.{version}"', modified, now)
+
+    def _renew_expired(self, now: float):
+        if self.max_age > 0 and now - self._epoch_started >= self.max_age:
+            self._renew(now)
+
+    # The epoch is part of every stamp, so the per-user versions can go
+    def _renew(self, now: float):
+        self._epoch += 1
+        self._epoch_started = now
+        self._wishlists.clear()
+
+
+def _etags(header: str):
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+# Whether a GET with these request headers can be answered 304 Not Modified.
+# ETags are compared weakly, and If-None-Match takes precedence over
+# If-Modified-Since.
+def is_not_modified(headers: Mapping[str, str], stamp: Stamp) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = _etags(if_none_match)
+        return "*" in tags or stamp.etag.removeprefix("W/") in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None or stamp.last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(stamp.modified) <= since
+
+
+def cache_headers(stamp: Stamp, cache_control: str) -> Dict[str, str]:
+    headers = {"ETag": stamp.etag, "Cache-Control": cache_control}
+    if stamp.last_modified is not None:
+        headers["Last-Modified"] = stamp.last_modified
+    return headers
+
+
+# A 304 for the request if the client's copy is current, otherwise None
+def not_modified_response(headers: Mapping[str, str], stamp: Stamp, cache_control: str) -> Optional[Response]:
+    if not is_not_modified(headers, stamp):
+        return None
+    return Response(status_code=304, headers=cache_headers(stamp, cache_control))
+
+
+def add_cache_headers(response: Response, stamp: Stamp, cache_control: str) -> Response:
+    response.headers.update(cache_headers(stamp, cache_control))
+    return response
+
+
+def accepted_encodings(headers: Headers) -> set:
+    return {part.split(";")[0].strip().lower() for part in headers.get("accept-encoding", "").split(",")}
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int = BROTLI_QUALITY, **kwargs):
+        super().__init__(app, minimum_size, **kwargs)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= THREAD_MIN_SIZE:
+            return await anyio.to_thread.run_sync(self._compress, body, more_body)
+        return self._compress(body, more_body)
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        compressed = self._compressor.process(body)
+        return compressed + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+# gzip (or brotli, when installed and accepted) for responses of at least
+# COMPRESS_MIN_SIZE bytes, streamed ones included
+class CompressionMiddleware(GZipMiddleware):
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE, compresslevel: int = GZIP_LEVEL):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and brotli is not None and "br" in accepted_encodings(Headers(scope=scope)):
+            responder = BrotliResponder(self.app, self.minimum_size, exclude_content_types=self.exclude_content_types)
+            await responder(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,314 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, case, event, exists, func, insert, inspect, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from database import Base
+from models import Book, BookCopy, Rental
+
+# Most copies added to a book in one request
+MAX_NEW_COPIES = 1000
+
+# Databases whose triggers give new books their first copy. On the others
+# the application does it (see add_first_copies).
+TRIGGER_DIALECTS = ("sqlite",)
+
+# Every book gets its first copy, and direct writes to books.available (older
+# scripts, tests, the catalog import) take copies off or put them back on the
+# shelf, so the copy table and the counts on books never disagree. The
+# endpoints change copies and counts together themselves, which leaves the
+# WHEN clause false and the second trigger idle.
+_CREATE_STATEMENTS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS book_copies_books_ai AFTER INSERT ON books
+    WHEN NOT EXISTS (SELECT 1 FROM book_copies WHERE book_id = new.id) BEGIN
+        INSERT INTO book_copies (book_id, available) VALUES (new.id, coalesce(new.available, 1));
+        UPDATE books SET copies = 1, available_copies = coalesce(new.available, 1) WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS book_copies_books_au AFTER UPDATE OF available ON books
+    WHEN new.available IS NOT (new.available_copies > 0) BEGIN
+        UPDATE book_copies SET available = new.available
+        WHERE book_id = new.id AND available IS NOT new.available AND (
+            NOT new.available OR id NOT IN (
+                SELECT copy_id FROM rentals
+                WHERE book_id = new.id AND return_date IS NULL AND copy_id IS NOT NULL
+            )
+        );
+        UPDATE books SET
+            available_copies = (SELECT count(*) FROM book_copies WHERE book_id = new.id AND available),
+            available = EXISTS (SELECT 1 FROM book_copies WHERE book_id = new.id AND available)
+        WHERE id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS book_copies_books_ad AFTER DELETE ON books BEGIN
+        DELETE FROM book_copies WHERE book_id = old.id;
+    END
+    """,
+]
+
+
+def _has_columns(connection: Connection, table: str, names: Iterable[str]) -> bool:
+    columns = {column["name"] for column in inspect(connection).get_columns(table)}
+    return set(names) <= columns
+
+
+# Create the triggers if missing. Databases from before copies existed get
+# them from the migration that adds the columns they use.
+def create_inventory_triggers(connection: Connection) -> bool:
+    if connection.dialect.name not in TRIGGER_DIALECTS:
+        return False
+    if not _has_columns(connection, "books", ("copies", "available_copies")) or \
+            not _has_columns(connection, "rentals", ("copy_id",)):
+        return False
+    BookCopy.__table__.create(connection, checkfirst=True)
+    for statement in _CREATE_STATEMENTS:
+        connection.exec_driver_sql(statement)
+    return True
+
+
+# Safe to call on every startup
+def ensure_inventory(engine) -> bool:
+    with engine.begin() as connection:
+        return create_inventory_triggers(connection)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _schema_created(target, connection, **kw):
+    create_inventory_triggers(connection)
+
+
+# One copy, on the shelf if the book is available, for each of the books
+# that has none. Needed where no trigger does it (see TRIGGER_DIALECTS) after
+# inserting books with Core statements, like the catalog import; the copy
+# counts on books already default to one copy.
+def add_first_copies(connection: Connection, book_ids: Iterable[int]):
+    book_ids = list(book_ids)
+    if not book_ids or connection.dialect.name in TRIGGER_DIALECTS:
+        return
+    has_copy = exists().where(BookCopy.book_id == Book.id)
+    connection.execute(insert(BookCopy).from_select(
+        ["book_id", "available"],
+        select(Book.id, func.coalesce(Book.available, True)).where(Book.id.in_(book_ids), ~has_copy),
+    ))
+
+
+# Books added through the ORM get their first copy in the same flush
+@event.listens_for(Book, "after_insert")
+def _book_inserted(mapper, connection, book):
+    add_first_copies(connection, [book.id])
+
+
+# 1, 2, ... for the rows of each book in id order
+def _position(book_id, row_id):
+    return func.row_number().over(partition_by=book_id, order_by=row_id).label("position")
+
+
+# Copies that open rentals hold
+def _held_copies(book_id: Optional[int] = None):
+    held = select(Rental.copy_id).where(Rental.return_date.is_(None), Rental.copy_id.is_not(None))
+    if book_id is not None:
+        held = held.where(Rental.book_id == book_id)
+    return held
+
+
+# One copy for every book without any (on the shelf if the book is
+# available), counts recomputed from the copies, and each open rental matched
+# to its own copy of its book that is off the shelf (the n-th rental without
+# a copy to the n-th such copy nobody holds)
+def backfill_copies(connection: Connection):
+    has_copy = exists().where(BookCopy.book_id == Book.id)
+    connection.execute(insert(BookCopy).from_select(
+        ["book_id", "available"],
+        select(Book.id, func.coalesce(Book.available, True)).where(~has_copy),
+    ))
+
+    copies = select(func.count(BookCopy.id)).where(BookCopy.book_id == Book.id)
+    connection.execute(update(Book).values(
+        copies=copies.scalar_subquery(),
+        available_copies=copies.where(BookCopy.available.is_(True)).scalar_subquery(),
+    ))
+
+    untracked = (
+        select(Rental.id, Rental.book_id, _position(Rental.book_id, Rental.id))
+        .where(Rental.return_date.is_(None), Rental.copy_id.is_(None))
+        .subquery()
+    )
+    off_shelf = (
+        select(BookCopy.id, BookCopy.book_id, _position(BookCopy.book_id, BookCopy.id))
+        .where(BookCopy.available.is_(False), BookCopy.id.not_in(_held_copies()))
+        .subquery()
+    )
+    matches = connection.execute(
+        select(untracked.c.id, off_shelf.c.id)
+        .join(off_shelf, and_(off_shelf.c.book_id == untracked.c.book_id,
+                              off_shelf.c.position == untracked.c.position))
+    ).all()
+    if matches:
+        connection.execute(
+            update(Rental).where(Rental.id == bindparam("rental")).values(copy_id=bindparam("copy")),
+            [{"rental": rental_id, "copy": copy_id} for rental_id, copy_id in matches],
+        )
+
+
+# Add to the available copy counts, keep books.available in step and return
+# the new counts. One UPDATE for any number of books.
+def adjust_available_copies(db: Session, deltas: Dict[int, int]) -> Dict[int, int]:
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if not deltas:
+        return {}
+    count = Book.available_copies + case(deltas, value=Book.id, else_=0)
+    counts = dict(db.execute(
+        update(Book)
+        .where(Book.id.in_(deltas))
+        .values(available_copies=count, available=count > 0)
+        .returning(Book.id, Book.available_copies)
+        .execution_options(synchronize_session=False)
+    ).all())
+    _refresh_loaded_books(db, counts)
+    return counts
+
+
+# Books already loaded in the session see the new counts without a reload
+# (the async endpoints can't lazy-load expired attributes)
+def _refresh_loaded_books(db: Session, counts: Dict[int, int]):
+    for book_id, available_copies in counts.items():
+        book = db.identity_map.get(identity_key(Book, book_id))
+        if book is not None:
+            set_committed_value(book, "available_copies", available_copies)
+            set_committed_value(book, "available", available_copies > 0)
+
+
+def _free_copy(book_id: int, db: Session):
+    free = (
+        select(BookCopy.id)
+        .where(BookCopy.book_id == book_id, BookCopy.available.is_(True))
+        .order_by(BookCopy.id)
+        .limit(1)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        # Concurrent renters each take a different copy instead of queueing
+        # on the same one
+        free = free.with_for_update(skip_locked=True)
+    return free.scalar_subquery()
+
+
+# Take any free copy of a book off the shelf. Finding the copy and taking it
+# is one conditional UPDATE, so of any number of concurrent callers for the
+# last copy exactly one gets it. Returns the copy id, or None if no copy is
+# free; the book's counts are updated in the same transaction.
+def claim_copy(db: Session, book_id: int) -> Optional[int]:
+    copy_id = db.execute(
+        update(BookCopy)
+        .where(BookCopy.id == _free_copy(book_id, db), BookCopy.available.is_(True))
+        .values(available=False)
+        .returning(BookCopy.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if copy_id is not None:
+        adjust_available_copies(db, {book_id: -1})
+    return copy_id
+
+
+# Claim up to `counts[book_id]` free copies of each book with a single
+# UPDATE. Returns {book_id: [copy_id, ...]} in copy id order for the books
+# that had any; a book with fewer free copies gets all it has.
+def claim_copies(db: Session, counts: Dict[int, int]) -> Dict[int, List[int]]:
+    counts = {book_id: count for book_id, count in counts.items() if count > 0}
+    if not counts:
+        return {}
+    free = (
+        select(BookCopy.id, BookCopy.book_id, _position(BookCopy.book_id, BookCopy.id))
+        .where(BookCopy.book_id.in_(counts), BookCopy.available.is_(True))
+        .subquery()
+    )
+    first_free = select(free.c.id).where(free.c.position <= case(counts, value=free.c.book_id, else_=0))
+    claimed = {}
+    for copy_id, book_id in db.execute(
+        update(BookCopy)
+        .where(BookCopy.id.in_(first_free), BookCopy.available.is_(True))
+        .values(available=False)
+        .returning(BookCopy.id, BookCopy.book_id)
+        .execution_options(synchronize_session=False)
+    ):
+        claimed.setdefault(book_id, []).append(copy_id)
+    for copy_ids in claimed.values():
+        copy_ids.sort()
+    adjust_available_copies(db, {book_id: -len(copy_ids) for book_id, copy_ids in claimed.items()})
+    return claimed
+
+
+# Up to `count` copies of the book that are off the shelf without an open
+# rental holding them, leaving out `taken`: where rentals recorded without a
+# copy go back to, one copy each
+def _untracked_copies(db: Session, book_id: int, count: int, taken: Iterable[int]) -> List[int]:
+    return list(db.execute(
+        select(BookCopy.id)
+        .where(BookCopy.book_id == book_id, BookCopy.available.is_(False),
+               BookCopy.id.not_in(_held_copies(book_id)), BookCopy.id.not_in(list(taken)))
+        .order_by(BookCopy.id)
+        .limit(count)
+    ).scalars())
+
+
+# Put the copies of returned rentals, given as (book_id, copy_id) pairs, back
+# on the shelf. Returns {book_id: (available copies before, after)} for the
+# books that got a copy back.
+def release_copies(db: Session, rentals: List[Tuple[int, Optional[int]]]) -> Dict[int, Tuple[int, int]]:
+    copy_books = {}
+    untracked = Counter()
+    for book_id, copy_id in rentals:
+        if copy_id is None:
+            untracked[book_id] += 1
+        else:
+            copy_books[copy_id] = book_id
+    for book_id, count in untracked.items():
+        for copy_id in _untracked_copies(db, book_id, count, copy_books):
+            copy_books[copy_id] = book_id
+    if not copy_books:
+        return {}
+    released = db.execute(
+        update(BookCopy)
+        .where(BookCopy.id.in_(copy_books), BookCopy.available.is_(False))
+        .values(available=True)
+        .returning(BookCopy.id)
+        .execution_options(synchronize_session=False)
+    ).scalars()
+    deltas = Counter(copy_books[copy_id] for copy_id in released)
+    counts = adjust_available_copies(db, deltas)
+    return {book_id: (count - deltas[book_id], count) for book_id, count in counts.items()}
+
+
+# Add `count` copies of a book, all on the shelf. Returns the new available
+# count.
+def add_copies(db: Session, book_id: int, count: int) -> int:
+    db.execute(insert(BookCopy).values([{"book_id": book_id, "available": True}] * count))
+    db.execute(
+        update(Book)
+        .where(Book.id == book_id)
+        .values(copies=Book.copies + count)
+        .execution_options(synchronize_session=False)
+    )
+    counts = adjust_available_copies(db, {book_id: count})
+    book = db.identity_map.get(identity_key(Book, book_id))
+    if book is not None:
+        db.refresh(book, ["copies"])
+    return counts[book_id]
+
+
+# The manual availability switch: take every copy on the shelf off it, or put
+# back every copy no open rental holds. Returns the new available count.
+def set_shelf_availability(db: Session, book: Book, available: bool) -> int:
+    change = update(BookCopy).where(BookCopy.book_id == book.id, BookCopy.available.is_(not available))
+    if available:
+        change = change.where(BookCopy.id.not_in(_held_copies(book.id)))
+    changed = db.execute(change.values(available=available).execution_options(synchronize_session=False)).rowcount
+    if not changed:
+        return book.available_copies
+    return adjust_available_copies(db, {book.id: changed if available else -changed})[book.id]
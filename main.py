@@ -1,21 +1,156 @@
-from fastapi import FastAPI, Depends, Query, HTTPException
+import io
+import logging
+import os
+import tempfile
+
+from fastapi import FastAPI, Depends, Query, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
-
-from database import engine, SessionLocal
-from models import Base, Wishlist, Book, User, Rental, RentalBase, RentalOut, AvailabilityUpdate
+from typing import Dict, List, Literal, Optional
+
+from database import engine, SessionLocal, get_async_sessions
+from models import Base, Wishlist, Book, User, Rental, EnrichmentJob, RentalBase, RentalOut, RentalHistoryOut, AvailabilityUpdate, RentalBatch, ReturnBatch, BatchItemOut, BatchOut, BookOut, WishlistBookOut
+from search_index import ensure_search_index, search_index_enabled, build_match_query, apply_fts_search
+from audit_log import AuditLogWriter
+from notifications import NotificationDispatcher, FileNotificationSender, stage_wishlist_notification
+from reports import summary_lines, active_rentals_page, active_rental_line, active_rentals_query, active_rental_record, ACTIVE_RENTAL_COLUMNS
+from report_file import DEFAULT_REPORT_PATH, RentalReportJob
+from rental_archive import DEFAULT_BATCH_SIZE as ARCHIVE_BATCH_SIZE, RentalArchiveJob, rental_history_page
+from migrations import apply_migrations
+from rental_stats import ensure_rental_stats, current_rental_summary
+from queries import wishlist_books, book_and_user, rental_with_book_and_user
+from inventory import MAX_NEW_COPIES, ensure_inventory, claim_copy, release_copies, add_copies, set_shelf_availability
+from rental_batch import rent_books, return_rentals
+from catalog_import import DEFAULT_BATCH_SIZE, import_books
+from catalog_cache import CatalogCache
+from fast_json import FastJSONResponse
+from http_cache import CompressionMiddleware, VersionStamps, add_cache_headers, not_modified_response
+from metrics import REGISTRY, Counter, Gauge, MetricsMiddleware, slow_request_logger
+from availability_index import AvailabilityIndex
+from suggest_index import SuggestIndex
+from amazon_ids import AmazonIdUpdater, EnrichmentSettings
+from pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, keyset_page, next_cursor, iter_keyset, aiter_keyset, csv_response, ndjson_response
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    ensure_search_index(engine)
+    ensure_rental_stats(engine)
+    ensure_inventory(engine)
+    availability_index.load(engine)
+    if SUGGEST_INDEX:
+        suggest_index.load(engine)
+    notification_dispatcher.start()
+    if rental_report_job.interval > 0:
+        rental_report_job.start()
+    if rental_archive_job.retention > timedelta(0):
+        rental_archive_job.start()
     yield
     # Shutdown
+    rental_archive_job.stop()
+    rental_report_job.stop()
+    notification_dispatcher.stop()
+    audit_log.close()
 
 app = FastAPI(lifespan=lifespan)
 
+# gzip (brotli if installed) for listings, exports and other large responses
+if os.environ.get("COMPRESSION", "on") == "on":
+    app.add_middleware(CompressionMiddleware)
+
+# Per-route latency and SQL metrics, served on /metrics. Setting
+# SLOW_REQUEST_MS logs every slower request with the SQL it ran to
+# SLOW_REQUEST_LOG.
+SLOW_REQUEST_MS = os.environ.get("SLOW_REQUEST_MS")
+if SLOW_REQUEST_MS:
+    slow_request_handler = logging.FileHandler(os.environ.get("SLOW_REQUEST_LOG", "slow_requests.log"), delay=True)
+    slow_request_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    slow_request_logger.addHandler(slow_request_handler)
+    slow_request_logger.propagate = False
+app.add_middleware(MetricsMiddleware, slow_request_seconds=float(SLOW_REQUEST_MS) / 1000 if SLOW_REQUEST_MS else None)
+
+# Background fan-out of wishlist notifications (see notifications.py).
+# Coalescing repeated alerts (NOTIFY_DEDUPE_WINDOW) and digests
+# (NOTIFY_DIGEST_INTERVAL) are opt-in.
+notification_dispatcher = NotificationDispatcher(
+    SessionLocal,
+    FileNotificationSender("notifications.txt"),
+    dedupe_window=timedelta(seconds=float(os.environ.get("NOTIFY_DEDUPE_WINDOW", "0"))),
+    digest_interval=float(os.environ.get("NOTIFY_DIGEST_INTERVAL", "0")),
+)
+
+# Rewrites the rental report file every RENTAL_REPORT_INTERVAL seconds; off
+# unless set (see report_file.py)
+rental_report_job = RentalReportJob(
+    SessionLocal,
+    os.environ.get("RENTAL_REPORT_PATH", DEFAULT_REPORT_PATH),
+    float(os.environ.get("RENTAL_REPORT_INTERVAL", "0")),
+)
+
+# Moves returned rentals older than RENTAL_RETENTION_DAYS to rentals_archive
+# every RENTAL_ARCHIVE_INTERVAL seconds (never, with the default of 0 days)
+rental_archive_job = RentalArchiveJob(
+    SessionLocal,
+    timedelta(days=float(os.environ.get("RENTAL_RETENTION_DAYS", "0"))),
+    interval=float(os.environ.get("RENTAL_ARCHIVE_INTERVAL", "3600")),
+    batch_size=int(os.environ.get("RENTAL_ARCHIVE_BATCH", str(ARCHIVE_BATCH_SIZE))),
+)
+
+# Background Amazon ID enrichment (see amazon_ids.py)
+amazon_id_updater = AmazonIdUpdater(EnrichmentSettings(
+    base_url=os.environ.get("OPENLIBRARY_SEARCH_URL", "https://openlibrary.org/search.json"),
+    requests_per_second=float(os.environ.get("OPENLIBRARY_RATE_LIMIT", "5")),
+))
+
+# Cache of /books and /books/search results (see catalog_cache.py)
+catalog_cache = CatalogCache(
+    enabled=os.environ.get("CATALOG_CACHE", "on") == "on",
+    max_results=int(os.environ.get("CATALOG_CACHE_RESULTS", "1024")),
+    max_rows=int(os.environ.get("CATALOG_CACHE_ROWS", "50000")),
+    ttl=float(os.environ.get("CATALOG_CACHE_TTL", "30")),
+)
+
+# Versions behind the ETag and Last-Modified headers of catalog and wishlist
+# reads (see http_cache.py). Catalog listings may be stored by shared caches
+# for CATALOG_MAX_AGE seconds (default: revalidate every time); wishlists
+# only by the user's browser.
+version_stamps = VersionStamps(max_age=float(os.environ.get("HTTP_STAMP_MAX_AGE", "30")))
+CATALOG_MAX_AGE = int(os.environ.get("CATALOG_MAX_AGE", "0"))
+CATALOG_CACHE_CONTROL = f"public, max-age={CATALOG_MAX_AGE}" if CATALOG_MAX_AGE > 0 else "public, no-cache"
+WISHLIST_CACHE_CONTROL = "private, no-cache"
+
+# In-memory availability of every book (see availability_index.py)
+availability_index = AvailabilityIndex(max_age=float(os.environ.get("AVAILABILITY_INDEX_MAX_AGE", "30")))
+
+# In-memory word index for autocomplete and fuzzy search (see
+# suggest_index.py), built at startup unless SUGGEST_INDEX=off
+SUGGEST_INDEX = os.environ.get("SUGGEST_INDEX", "on") == "on"
+suggest_index = SuggestIndex()
+
+# Every committed availability change goes through here to keep the
+# in-memory views of the catalog current
+def copies_changed(counts: Dict[int, int]):
+    catalog_cache.set_available_copies(counts)
+    if counts:
+        version_stamps.catalog_changed()
+    availability_index.set([book_id for book_id, count in counts.items() if count > 0], True)
+    availability_index.set([book_id for book_id, count in counts.items() if count == 0], False)
+
+# Queue depths and cache counters, read when /metrics is scraped
+REGISTRY.register(Gauge("audit_log_queue_depth", "Audit log writes waiting for the writer thread",
+                        lambda: audit_log.queue_depth))
+REGISTRY.register(Gauge("notification_queue_depth", "Claimed outbox entries waiting for a worker",
+                        lambda: notification_dispatcher.queue_depth))
+REGISTRY.register(Counter("catalog_cache_hits_total", "Catalog cache hits", read=lambda: catalog_cache.hits))
+REGISTRY.register(Counter("catalog_cache_misses_total", "Catalog cache misses", read=lambda: catalog_cache.misses))
+
 # Dependency to get a DB session per request
 def get_db():
     db = SessionLocal()
@@ -24,90 +159,287 @@ def get_db():
     finally:
         db.close()
 
+# Async variant for the hot endpoints: queries are awaited on the event loop
+# instead of holding a threadpool slot for the whole request
+async def get_async_db():
+    async_sessions = get_async_sessions()
+    async with async_sessions() as db:
+        yield db
+
 # Helper Functions
+def format_rental_entry(record: dict) -> str:
+    formatted_time = record["timestamp"].strftime("%Y-%m-%d %H:%M")
+    return (
+        f'"{record["book_title"]} (bookID: {record["book_id"]}) {record["action"]} by '
+        f'{record["username"]} (userID: {record["user_id"]}) on {formatted_time}."\n'
+    )
+
+def format_availability_entry(record: dict) -> str:
+    return (
+        f"[{record['timestamp'].isoformat()}] "
+        f"Book ID: {record['book_id']}, Title: '{record['book_title']}'\n"
+        f"    Availability changed: {record['old_status']} ➜ {record['new_status']}\n"
+        f"    Changed by: {record['source']}\n"
+        f"{'-'*60}\n"
+    )
+
+# Buffered writer for rental_log.txt / availability_log.txt (see audit_log.py)
+audit_log = AuditLogWriter(
+    formats=tuple(os.environ.get("AUDIT_LOG_FORMATS", "text").split(",")),
+    fsync=os.environ.get("AUDIT_LOG_FSYNC", "never"),
+)
+audit_log.register("rental", "rental_log.txt", format_rental_entry)
+audit_log.register("availability", "availability_log.txt", format_availability_entry)
+
+def rental_record(action: str, book_title: str, book_id: int, username: str, user_id: int, timestamp: datetime) -> dict:
+    return {
+        "action": action,
+        "book_title": book_title,
+        "book_id": book_id,
+        "username": username,
+        "user_id": user_id,
+        "timestamp": timestamp,
+    }
+
+def availability_record(book: Book, old_status: bool, source: str) -> dict:
+    return {
+        "timestamp": datetime.now(),
+        "book_id": book.id,
+        "book_title": book.title,
+        "old_status": old_status,
+        "new_status": book.available,
+        "source": source,
+    }
+
 def log_rental_action(action: str, book_title: str, book_id: int, username: str, user_id: int, timestamp: datetime):
-    with open("rental_log.txt", "a") as file:
-        formatted_time = timestamp.strftime("%Y-%m-%d %H:%M")
-        line = f'"{book_title} (bookID: {book_id}) {action} by {username} (userID: {user_id}) on {formatted_time}."\n'
-        file.write(line)
+    audit_log.write("rental", rental_record(action, book_title, book_id, username, user_id, timestamp))
         
 def notify_and_log_availability_change(book: Book, old_status: bool, db: Session, source: str):
-    # Notify users if the book just became available
+    copies_changed({book.id: book.available_copies})
+    # Wishlist notifications were staged in the outbox with the change itself;
+    # let the background dispatcher know there is work rather than sending here.
+    # Only a book going from no copies to some has staged any.
     if not old_status and book.available:
-        wishlisted_users = (
-            db.query(User)
-            .join(Wishlist, Wishlist.user_id == User.id)
-            .filter(Wishlist.book_id == book.id)
-            .all()
-        )
-        notification_time = datetime.now().strftime("%Y-%m-%d %H:%M")
-        with open("notifications.txt", "a") as notif_file:
-            for user in wishlisted_users:
-                message = (
-                    f"Dear {user.username}, the book '{book.title}' "
-                    f"has been recently made available on {notification_time}.\n"
-                )
-                notif_file.write(message)
+        notification_dispatcher.wake()
 
     # Log the availability change
-    log_entry = (
-        f"[{datetime.now().isoformat()}] "
-        f"Book ID: {book.id}, Title: '{book.title}'\n"
-        f"    Availability changed: {old_status} ➜ {book.available}\n"
-        f"    Changed by: {source}\n"
-        f"{'-'*60}\n"
-    )
-    with open("availability_log.txt", "a") as f:
-        f.write(log_entry)
+    audit_log.write("availability", availability_record(book, old_status, source))
 
-# Get all book information
-@app.get("/books")
-def get_all_books(db: Session = Depends(get_db)):
-    books = db.query(Book).all()
-    return [
-        {
-            "id": book.id,
-            "title": book.title,
-            "authors": book.authors,
-            "available": book.available
-        }
-        for book in books
-    ]
+# The columns listings send (see BookOut). Listings query just these columns
+# rather than Book entities, which skips building ORM objects and the
+# identity map for every row.
+BOOK_COLUMNS = (Book.id, Book.title, Book.authors, Book.available, Book.available_copies)
 
+# Most suggestions /books/autocomplete returns
+MAX_SUGGESTIONS = 50
 
-# Enhanced search books endpoint
-@app.get("/books/search")
-def search_books(
-    query: Optional[str] = Query(None),
-    title: Optional[str] = Query(None),
-    author: Optional[str] = Query(None),
+# Works on Book entities as well as BOOK_COLUMNS rows
+def serialize_book(book) -> dict:
+    return {
+        "id": book.id,
+        "title": book.title,
+        "authors": book.authors,
+        "available": book.available,
+        "available_copies": book.available_copies
+    }
+
+# Book listings are rendered straight from the serialized dicts with orjson
+def send_book_page(rows: List[dict], cursor: Optional[int]) -> FastJSONResponse:
+    headers = {NEXT_CURSOR_HEADER: str(cursor)} if cursor is not None else None
+    return FastJSONResponse(rows, headers=headers)
+
+# Return one keyset page of a book query (cached under `cache_key`), or stream
+# every match as NDJSON
+def list_books(q, after_id: Optional[int], limit: Optional[int], output: str, cache_key):
+    if output == "ndjson":
+        return ndjson_response(iter_keyset(q, Book.id, after_id), serialize_book)
+
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return send_book_page(*cached)
+
+    generation = catalog_cache.generation
+    if after_id is not None or limit is not None:
+        q = keyset_page(q, Book.id, after_id, limit)
+    books = q.all()
+
+    rows = [serialize_book(book) for book in books]
+    cursor = next_cursor(books, limit)
+    catalog_cache.put(cache_key, rows, cursor, generation)
+    return send_book_page(rows, cursor)
+
+# Get all book information
+@app.get("/books", response_model=List[BookOut])
+def get_all_books(
+    request: Request,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    output: Literal["json", "ndjson"] = Query("json", alias="format"),
     db: Session = Depends(get_db)
 ):
-    q = db.query(Book)
-
+    # Stamped before the query, so a change made while it runs moves the
+    # stamp past the one this response carries
+    stamp = version_stamps.catalog()
+    not_modified = not_modified_response(request.headers, stamp, CATALOG_CACHE_CONTROL)
+    if not_modified is not None:
+        return not_modified
+    response = list_books(db.query(*BOOK_COLUMNS), after_id, limit, output, cache_key=("books", after_id, limit))
+    return add_cache_headers(response, stamp, CATALOG_CACHE_CONTROL)
+
+
+# Search filters on a Book query or select() statement: ranked prefix search
+# through the FTS5 index when the backend has one, otherwise substring scans
+def filter_book_search(q, query: Optional[str], title: Optional[str], author: Optional[str], fts: bool):
+    match = build_match_query(query, title, author)
+    if match and fts:
+        return apply_fts_search(q, match)
     if query:
         search = f"%{query.lower()}%"
-        q = q.filter(
+        return q.filter(
             Book.title.ilike(search) |
             Book.authors.ilike(search) |
             Book.isbn.ilike(search)
         )
-    else:
-        if title:
-            q = q.filter(Book.title.ilike(f"%{title}%"))
-        if author:
-            q = q.filter(Book.authors.ilike(f"%{author}%"))
+    if title:
+        q = q.filter(Book.title.ilike(f"%{title}%"))
+    if author:
+        q = q.filter(Book.authors.ilike(f"%{author}%"))
+    return q
+
+# Whether a fetched row still matches a fuzzy search: the index may return
+# books for words their title or authors no longer contain
+def fuzzy_search_matches(book, query: Optional[str], title: Optional[str], author: Optional[str]) -> bool:
+    return (
+        SuggestIndex.matches(query, book.title, book.authors, fuzzy=True)
+        and SuggestIndex.matches(title, book.title, fuzzy=True)
+        and SuggestIndex.matches(author, book.authors, fuzzy=True)
+    )
 
-    results = q.all()
-    return [
-        {
-            "id": book.id,
-            "title": book.title,
-            "authors": book.authors,
-            "available": book.available
-        }
-        for book in results
-    ]
+# One page of fuzzy search results in id order. Matching ids come from the
+# word index a page at a time, starting after the cursor, so the index stops
+# early; their rows are fetched by primary key until the page is full of rows
+# that still match.
+async def fuzzy_search_page(db: AsyncSession, query, title, author, available: Optional[bool],
+                            after_id: Optional[int], page_size: int) -> list:
+    text = " ".join(filter(None, (query, title, author)))
+    page = []
+    while True:
+        ids = suggest_index.find(text, fuzzy=True, after_id=after_id, limit=page_size + 1)
+        if not ids:
+            return page
+        rows = (await db.execute(select(*BOOK_COLUMNS).where(Book.id.in_(ids)).order_by(Book.id))).all()
+        for book in rows:
+            if not fuzzy_search_matches(book, query, title, author):
+                continue
+            if available is not None and book.available != available:
+                continue
+            page.append(book)
+            if len(page) == page_size:
+                return page
+        if len(ids) <= page_size:
+            return page
+        after_id = ids[-1]
+
+# Enhanced search books endpoint
+@app.get("/books/search", response_model=List[BookOut])
+async def search_books(
+    request: Request,
+    query: Optional[str] = Query(None),
+    title: Optional[str] = Query(None),
+    author: Optional[str] = Query(None),
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    available: Optional[bool] = Query(None),
+    fuzzy: bool = Query(False),
+    output: Literal["json", "ndjson"] = Query("json", alias="format"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    stamp = version_stamps.catalog()
+    not_modified = not_modified_response(request.headers, stamp, CATALOG_CACHE_CONTROL)
+    if not_modified is not None:
+        return not_modified
+    response = await find_books(query, title, author, after_id, limit, available, fuzzy, output, db)
+    return add_cache_headers(response, stamp, CATALOG_CACHE_CONTROL)
+
+# Run a search and build its response: a JSON page or an NDJSON stream
+async def find_books(query: Optional[str], title: Optional[str], author: Optional[str], after_id: Optional[int],
+                     limit: Optional[int], available: Optional[bool], fuzzy: bool, output: str, db: AsyncSession):
+    # Typo-tolerant search through the in-memory word index; until that is
+    # loaded, fuzzy=true runs the regular search
+    if fuzzy and suggest_index.loaded:
+        if output == "ndjson":
+            raise HTTPException(status_code=400, detail="Fuzzy search is paged; use format=json")
+        page_size = limit or MAX_PAGE_SIZE
+        books = await fuzzy_search_page(db, query, title, author, available, after_id, page_size)
+        return send_book_page([serialize_book(book) for book in books], next_cursor(books, page_size))
+
+    # Which books pass an availability filter changes with every rental, so
+    # filtered searches aren't cached
+    cache_key = ("search", query, title, author, after_id, limit)
+    cacheable = output == "json" and available is None
+    if cacheable:
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return send_book_page(*cached)
+
+    generation = catalog_cache.generation
+    fts = await db.run_sync(lambda session: search_index_enabled(session.get_bind()))
+    stmt = filter_book_search(select(*BOOK_COLUMNS), query, title, author, fts)
+
+    # The availability filter reads the column, which is current whatever
+    # process changed it (the in-memory index only sees this one's changes)
+    if available is not None:
+        stmt = stmt.filter(Book.available.is_(available))
+
+    # Paged and streamed results are ordered by id rather than rank so the
+    # cursor stays stable
+    if output == "ndjson":
+        return ndjson_response(aiter_keyset(db, stmt, Book.id, after_id, scalars=False), serialize_book)
+
+    if after_id is not None or limit is not None:
+        stmt = keyset_page(stmt, Book.id, after_id, limit)
+    books = (await db.execute(stmt)).all()
+
+    rows = [serialize_book(book) for book in books]
+    cursor = next_cursor(books, limit)
+    if cacheable:
+        catalog_cache.put(cache_key, rows, cursor, generation)
+    return send_book_page(rows, cursor)
+
+# Search-as-you-type: the best `limit` books whose title or author words
+# start with each word typed, or are within a typo or two of it. Answered
+# from the in-memory word index, or by the regular search until it is loaded.
+@app.get("/books/autocomplete", response_model=List[BookOut])
+async def autocomplete_books(
+    query: str = Query(..., min_length=2),
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if suggest_index.loaded:
+        # Ask for a few extra in case some no longer match
+        ids = suggest_index.suggest(query, limit * 2)
+        rows = {book.id: book for book in await db.execute(select(*BOOK_COLUMNS).where(Book.id.in_(ids)))}
+        books = [
+            rows[book_id] for book_id in ids
+            if book_id in rows and SuggestIndex.matches(query, rows[book_id].title, rows[book_id].authors, fuzzy=True)
+        ][:limit]
+    else:
+        fts = await db.run_sync(lambda session: search_index_enabled(session.get_bind()))
+        books = (await db.execute(filter_book_search(select(*BOOK_COLUMNS), query, None, None, fts).limit(limit))).all()
+    return send_book_page([serialize_book(book) for book in books], None)
+
+# Number of available and rented books, from the in-memory index once loaded.
+# Once the index is older than AVAILABILITY_INDEX_MAX_AGE it is reloaded in
+# the background, so changes made by other processes are counted too; counts
+# come from the current data until the reload is done.
+@app.get("/books/available/count")
+def count_available_books(db: Session = Depends(get_db)):
+    if availability_index.loaded:
+        availability_index.refresh_in_background(db.get_bind())
+        total, available = availability_index.total, availability_index.available_count
+    else:
+        total, available = db.query(func.count(Book.id), func.count(Book.id).filter(Book.available.is_(True))).one()
+    return {"available": available, "unavailable": total - available, "total": total}
 
 # Create a user
 @app.post("/users/")
@@ -123,37 +455,44 @@ def create_user(username: str, db: Session = Depends(get_db)):
 
 # Add book to wishlist
 @app.post("/wishlist/{user_id}/{book_id}")
-def add_to_wishlist(user_id: int, book_id: int, db: Session = Depends(get_db)):
-    existing = db.query(Wishlist).filter_by(user_id=user_id, book_id=book_id).first()
+async def add_to_wishlist(user_id: int, book_id: int, db: AsyncSession = Depends(get_async_db)):
+    existing = (await db.execute(select(Wishlist.id).filter_by(user_id=user_id, book_id=book_id))).first()
     if existing:
         raise HTTPException(status_code=400, detail="Book already in wishlist")
 
     wishlist_item = Wishlist(user_id=user_id, book_id=book_id)
     db.add(wishlist_item)
-    db.commit()
+    await db.commit()
+    version_stamps.wishlist_changed(user_id)
     return {"message": "Book added to wishlist"}
 
 # Get the wishlist of a user
-@app.get("/wishlist/{user_id}")
-def get_wishlist(user_id: int, db: Session = Depends(get_db)):
-    wishlist = db.query(Wishlist).filter_by(user_id=user_id).all()
-    return [
+@app.get("/wishlist/{user_id}", response_model=List[WishlistBookOut])
+async def get_wishlist(user_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    stamp = version_stamps.wishlist(user_id)
+    not_modified = not_modified_response(request.headers, stamp, WISHLIST_CACHE_CONTROL)
+    if not_modified is not None:
+        return not_modified
+    wishlist = await db.run_sync(wishlist_books, user_id)
+    response = FastJSONResponse([
         {
-            "book_id": item.book.id,
-            "title": item.book.title,
-            "authors": item.book.authors
+            "book_id": book.id,
+            "title": book.title,
+            "authors": book.authors
         }
-        for item in wishlist
-    ]
+        for book in wishlist
+    ])
+    return add_cache_headers(response, stamp, WISHLIST_CACHE_CONTROL)
 
 # Remove a book from a wishlist
 @app.delete("/wishlist/{user_id}/{book_id}")
-def remove_from_wishlist(user_id: int, book_id: int, db: Session = Depends(get_db)):
-    item = db.query(Wishlist).filter_by(user_id=user_id, book_id=book_id).first()
+async def remove_from_wishlist(user_id: int, book_id: int, db: AsyncSession = Depends(get_async_db)):
+    item = (await db.execute(select(Wishlist).filter_by(user_id=user_id, book_id=book_id))).scalars().first()
     if not item:
         raise HTTPException(status_code=404, detail="Item not in wishlist")
-    db.delete(item)
-    db.commit()
+    await db.delete(item)
+    await db.commit()
+    version_stamps.wishlist_changed(user_id)
     return {"message": "Book removed from wishlist"}
 
 # Update the availability of a book
@@ -163,10 +502,12 @@ def update_book_availability(book_id: int, update: AvailabilityUpdate, db: Sessi
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
 
+    # Takes every copy on the shelf off it, or puts back every copy that
+    # isn't rented out
     old_status = book.available
-    book.available = update.available
+    set_shelf_availability(db, book, update.available)
+    stage_wishlist_notification(db, book, old_status)
     db.commit()
-    db.refresh(book)
 
     notify_and_log_availability_change(book, old_status, db, source=f"PATCH /books/{book_id}/availability")
 
@@ -174,25 +515,42 @@ def update_book_availability(book_id: int, update: AvailabilityUpdate, db: Sessi
         "message": f"Book '{book.title}' availability set to {book.available}"
     }
 
+# Add physical copies of a book to the inventory
+@app.post("/books/{book_id}/copies")
+def add_book_copies(book_id: int, count: int = Query(1, ge=1, le=MAX_NEW_COPIES), db: Session = Depends(get_db)):
+    book = db.query(Book).filter_by(id=book_id).first()
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    old_status = book.available
+    add_copies(db, book.id, count)
+    stage_wishlist_notification(db, book, old_status)
+    db.commit()
+
+    notify_and_log_availability_change(book, old_status, db, source=f"POST /books/{book_id}/copies")
+    return {"book_id": book.id, "copies": book.copies, "available_copies": book.available_copies}
+
 # Initiate the rental of a book
 @app.post("/rentals", response_model=RentalOut)
-def create_rental(rental: RentalBase, db: Session = Depends(get_db)):
-    book = db.query(Book).filter_by(id=rental.book_id).first()
+async def create_rental(rental: RentalBase, db: AsyncSession = Depends(get_async_db)):
+    book, user = await db.run_sync(book_and_user, rental.book_id, rental.user_id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
     if not book.available:
         raise HTTPException(status_code=400, detail="Book is already rented")
-
-    user = db.query(User).filter_by(id=rental.user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    old_status = book.available
-    book.available = False
-    rental_entry = Rental(book_id=rental.book_id, user_id=rental.user_id)
+    # The availability read above may already be stale under concurrent
+    # requests; only the conditional update decides who gets a copy
+    old_status = True
+    copy_id = await db.run_sync(claim_copy, book.id)
+    if copy_id is None:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Book is already rented")
+    rental_entry = Rental(book_id=rental.book_id, user_id=rental.user_id, copy_id=copy_id)
     db.add(rental_entry)
-    db.commit()
-    db.refresh(rental_entry)
+    await db.commit()
 
     notify_and_log_availability_change(book, old_status, db, source="POST /rentals")
 
@@ -209,24 +567,25 @@ def create_rental(rental: RentalBase, db: Session = Depends(get_db)):
 
 # Return a borrowed book
 @app.patch("/rentals/{rental_id}/return")
-def return_book(rental_id: int, db: Session = Depends(get_db)):
-    rental = db.query(Rental).filter_by(id=rental_id).first()
+async def return_book(rental_id: int, db: AsyncSession = Depends(get_async_db)):
+    rental = await db.run_sync(rental_with_book_and_user, rental_id)
     if not rental:
         raise HTTPException(status_code=404, detail="Rental not found")
     if rental.return_date:
         raise HTTPException(status_code=400, detail="Book already returned")
 
+    user = rental.user
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
     old_status = rental.book.available
     rental.return_date = datetime.now()
-    rental.book.available = True
-    db.commit()
+    await db.run_sync(lambda session: release_copies(session, [(rental.book_id, rental.copy_id)]))
+    stage_wishlist_notification(db, rental.book, old_status)
+    await db.commit()
 
     notify_and_log_availability_change(rental.book, old_status, db, source=f"PATCH /rentals/{rental_id}/return")
 
-    user = db.query(User).filter_by(id=rental.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     log_rental_action(
         action="returned",
         book_title=rental.book.title,
@@ -238,55 +597,209 @@ def return_book(rental_id: int, db: Session = Depends(get_db)):
 
     return {"message": f"Book '{rental.book.title}' returned by {user.username}"}
 
+def batch_response(outcome) -> BatchOut:
+    return BatchOut(
+        succeeded=outcome.succeeded,
+        failed=len(outcome.items) - outcome.succeeded,
+        results=[BatchItemOut.model_validate(item) for item in outcome.items],
+    )
+
+# Rent many books in one transaction (self-checkout kiosks). Every item gets
+# the status the single-item endpoint would have returned; the ones that
+# succeeded are logged with one audit write per log.
+@app.post("/rentals/batch", response_model=BatchOut)
+async def create_rentals_batch(batch: RentalBatch, db: AsyncSession = Depends(get_async_db)):
+    outcome = await db.run_sync(rent_books, batch.items)
+    await db.commit()
+    copies_changed(outcome.available_copies)
+
+    rented = [item.rental for item in outcome.items if item.ok]
+    audit_log.write_many("availability", [
+        availability_record(outcome.books[book_id], True, "POST /rentals/batch")
+        for book_id in sorted(outcome.available_copies)
+    ])
+    audit_log.write_many("rental", [
+        rental_record(
+            "rented", outcome.books[rental.book_id].title, rental.book_id,
+            outcome.users[rental.user_id].username, rental.user_id, rental.rental_date,
+        )
+        for rental in rented
+    ])
+    return batch_response(outcome)
+
+# Return many rentals in one transaction (returns-bin sweep)
+@app.post("/rentals/returns/batch", response_model=BatchOut)
+async def return_books_batch(batch: ReturnBatch, db: AsyncSession = Depends(get_async_db)):
+    outcome = await db.run_sync(return_rentals, batch.rental_ids)
+    await db.commit()
+    copies_changed(outcome.available_copies)
+
+    if outcome.became_available:
+        notification_dispatcher.wake()
+    audit_log.write_many("availability", [
+        availability_record(outcome.books[book_id], book_id not in outcome.became_available,
+                            "POST /rentals/returns/batch")
+        for book_id in sorted(outcome.available_copies)
+    ])
+    audit_log.write_many("rental", [
+        rental_record(
+            "returned", item.rental.book.title, item.rental.book_id,
+            item.rental.user.username, item.rental.user_id, item.rental.return_date,
+        )
+        for item in outcome.items if item.ok
+    ])
+    return batch_response(outcome)
+
 # Create a report of all existing rented books
 @app.get("/rental-report")
-def rental_report(db: Session = Depends(get_db)):
-    rentals = db.query(Rental).all()
-    
-    report_lines = []
-    total_days = 0
-    total_returned = 0
-    still_rented = 0
-
-    for r in rentals:
-        rented_on = r.rental_date
-        returned_on = r.return_date or datetime.now()
-        days_rented = (returned_on - rented_on).days
-
-        # Update summary metrics
-        if r.return_date:
-            total_days += days_rented
-            total_returned += 1
-        else:
-            still_rented += 1
-            # Include only currently rented in the detailed report
-            report_lines.append(
-                f"'{r.book.title}' rented by {r.user.username} for {days_rented} day(s)."
-            )
+def rental_report(
+    response: Response,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    include_archived: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    # Summary numbers come from the maintained counters (or one aggregate
+    # query without them), over the archived rentals too if asked; only the
+    # currently rented books (optionally one page of them) are fetched row by
+    # row
+    summary = summary_lines(current_rental_summary(db, include_archived))
+
+    now = datetime.now()
+    active = active_rentals_page(db, after_id, limit)
+    report_lines = [active_rental_line(row, now) for row in active]
 
-    avg_duration = total_days // total_returned if total_returned else 0
-
-    summary_lines = [
-        f"Books Currently Rented: {still_rented}",
-        f"Returned Rentals: {total_returned}",
-        f"Total Rentals: {len(rentals)}",
-        f"Average Rental Duration: {avg_duration} day(s)"
-    ]
-
-    report_path = "rental_report.txt"
-    with open(report_path, "w") as file:
-        file.write("Rental Report - Currently Rented Books\n")
-        file.write("=" * 60 + "\n")
-        for line in report_lines:
-            file.write(line + "\n")
-        file.write("\nSummary\n")
-        file.write("=" * 60 + "\n")
-        for line in summary_lines:
-            file.write(line + "\n")
+    cursor = next_cursor(active, limit)
+    if cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = str(cursor)
 
     return {
         "message": "Rental report generated",
         "report_lines": report_lines,  # only current rentals here
-        "summary": summary_lines
+        "summary": summary
+    }
+
+# A user's rentals in id order, one keyset page at a time. Archived rentals
+# are only read when asked for.
+@app.get("/users/{user_id}/rentals", response_model=List[RentalHistoryOut])
+def user_rental_history(
+    user_id: int,
+    response: Response,
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    include_archived: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    history = rental_history_page(db, user_id, after_id, limit, include_archived)
+    cursor = next_cursor(history, limit, key=lambda rental: rental["id"])
+    if cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = str(cursor)
+    return history
+
+# Stream every currently rented book as CSV or NDJSON, in rental id order.
+# Rows are read in keyset chunks with no transaction held between them, so
+# memory stays flat and writers aren't blocked however long the export runs.
+@app.get("/rental-report/export")
+def export_rental_report(
+    output: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    db: Session = Depends(get_db)
+):
+    now = datetime.now()
+    chunks = iter_keyset(active_rentals_query(db), Rental.id)
+    serialize = lambda row: active_rental_record(row, now)
+    if output == "ndjson":
+        return ndjson_response(chunks, serialize)
+    return csv_response(chunks, ACTIVE_RENTAL_COLUMNS, serialize, filename="rental-report.csv")
+
+# Request body collected before each write to the import spool file
+IMPORT_SPOOL_WRITE_SIZE = 1024 * 1024
+
+# Bulk import/update the catalog from a CSV request body (same columns as
+# books.csv). The body is spooled to a temp file and loaded in chunks. File
+# writes run in the threadpool, a megabyte at a time, so a large upload on a
+# slow disk doesn't stall the event loop.
+@app.post("/admin/books/import")
+async def import_books_csv(
+    request: Request,
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=10000),
+    workers: int = Query(1, ge=1, le=8),
+    db: Session = Depends(get_db)
+):
+    with tempfile.TemporaryFile() as spool:
+        buffered = bytearray()
+        async for chunk in request.stream():
+            buffered += chunk
+            if len(buffered) >= IMPORT_SPOOL_WRITE_SIZE:
+                await run_in_threadpool(spool.write, bytes(buffered))
+                buffered.clear()
+        if buffered:
+            await run_in_threadpool(spool.write, bytes(buffered))
+        spool.seek(0)
+
+        csvfile = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+        try:
+            result = await run_in_threadpool(
+                import_books, db.get_bind(), csvfile, batch_size, workers, on_chunk=suggest_index.add_books
+            )
+        except (ValueError, KeyError, IndexError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid catalog CSV: {e}")
+        finally:
+            # Chunks before a failure are already committed
+            catalog_cache.invalidate()
+            version_stamps.invalidate()
+            if availability_index.loaded:
+                await run_in_threadpool(availability_index.load, db.get_bind())
+
+    return {
+        "message": "Books imported",
+        "rows": result.rows,
+        "chunks": result.chunks,
+        "seconds": round(result.seconds, 3),
+        "rows_per_second": round(result.rate, 1),
+    }
+
+# Prometheus metrics (see metrics.py)
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Hit/miss counters and size of the catalog cache
+@app.get("/admin/catalog-cache")
+def catalog_cache_stats():
+    stats = catalog_cache.stats()
+    return {
+        "enabled": stats.enabled,
+        "hits": stats.hits,
+        "misses": stats.misses,
+        "hit_rate": round(stats.hit_rate, 4),
+        "results": stats.results,
+        "rows": stats.rows,
+        "overrides": stats.overrides,
+    }
+
+def serialize_enrichment_job(job: EnrichmentJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "processed": job.processed,
+        "updated": job.updated,
+        "cache_hits": job.cache_hits,
+        "failures": job.failures,
+        "last_book_id": job.last_book_id,
+        "finished_at": job.finished_at,
+        "error": job.error,
     }
 
+# Update the Amazon IDs of all books without one. Runs as a background job;
+# calling it again while a job is unfinished resumes that job.
+@app.post("/books/amazon-ids/update", status_code=202)
+def update_amazon_ids(db: Session = Depends(get_db)):
+    job_id = amazon_id_updater.start(db.get_bind())
+    return {"message": "Amazon ID update started", "job_id": job_id}
+
+@app.get("/books/amazon-ids/jobs/{job_id}")
+def get_amazon_id_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(EnrichmentJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return serialize_enrichment_job(job)
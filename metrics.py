@@ -0,0 +1,302 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_request_logger = logging.getLogger("slow_requests")
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow reports
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+# Statement text kept per query in the slow-request log
+MAX_LOGGED_STATEMENT = 1000
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+# Minimal Prometheus metric types: just what the text exposition format needs
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+
+# A counter either moved with inc() or, unlabelled, read from a callback
+# returning a running total when /metrics is scraped
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), read: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self.read = read
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        if self.read is not None:
+            return self.read()
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> List[str]:
+        if self.read is not None:
+            return [f"{self.name} {_format_value(self.read())}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(v)}" for labels, v in values]
+
+
+# A gauge either moved with inc()/dec() or read from a callback when
+# /metrics is scraped
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.read = read
+        self._value = 0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def value(self) -> float:
+        return self.read() if self.read is not None else self._value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.value())}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    # Context manager timing a block into this histogram
+    def time(self, *label_values: str) -> "_Timer":
+        return _Timer(self, label_values)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = []
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, label_values: Tuple[str, ...]):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time to send the full response", ("method", "route", "status")
+))
+REQUESTS_IN_PROGRESS = REGISTRY.register(Gauge("http_requests_in_progress", "Requests being handled"))
+REQUEST_DB_STATEMENTS = REGISTRY.register(Histogram(
+    "http_request_db_statements", "SQL statements issued per request", ("route",), COUNT_BUCKETS
+))
+REQUEST_DB_SECONDS = REGISTRY.register(Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request", ("route",)
+))
+DB_STATEMENT_DURATION = REGISTRY.register(Histogram(
+    "db_statement_duration_seconds", "Time to execute one SQL statement", ("operation",)
+))
+AUDIT_LOG_FLUSH = REGISTRY.register(Histogram(
+    "audit_log_flush_seconds", "Time to write and flush one batch of audit log records"
+))
+AUDIT_LOG_RECORDS = REGISTRY.register(Counter(
+    "audit_log_records_total", "Audit log records written", ("channel",)
+))
+NOTIFICATION_SEND = REGISTRY.register(Histogram(
+    "notification_send_seconds", "Time to send one batch of wishlist notifications"
+))
+NOTIFICATIONS_SENT = REGISTRY.register(Counter(
+    "notifications_sent_total", "Wishlist notifications sent"
+))
+# Alerts that did not get a message of their own: repeats within the dedupe
+# window ("duplicate") and alerts folded into another alert's digest ("digest")
+NOTIFICATIONS_SUPPRESSED = REGISTRY.register(Counter(
+    "notifications_suppressed_total", "Wishlist alerts not sent as a message of their own", ("reason",)
+))
+NOTIFICATION_FAILURES = REGISTRY.register(Counter(
+    "notification_send_failures_total", "Notification batches that failed to send"
+))
+RENTALS_ARCHIVED = REGISTRY.register(Counter(
+    "rentals_archived_total", "Returned rentals moved to the archive"
+))
+
+
+# SQL issued while handling the current request
+@dataclass
+class RequestStats:
+    record_sql: bool = False
+    statements: int = 0
+    db_seconds: float = 0.0
+    sql: List[Tuple[str, float]] = field(default_factory=list)
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _current_request.get()
+
+
+# Time every statement on every engine. Statements run while a request is
+# handled (including in the threadpool and through the async engine, which
+# carry the request's context) are also added to that request's stats.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_STATEMENT_DURATION.observe(elapsed, operation)
+
+    stats = _current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+        if stats.record_sql:
+            stats.sql.append((statement[:MAX_LOGGED_STATEMENT], elapsed))
+
+
+# ASGI middleware timing every HTTP request by route template (so
+# /rentals/{rental_id}/return is one series, not one per id), together with
+# the SQL it issued. With slow_request_seconds set, requests slower than that
+# are logged to the "slow_requests" logger along with their statements.
+class MetricsMiddleware:
+    def __init__(self, app, slow_request_seconds: Optional[float] = None):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(record_sql=self.slow_request_seconds is not None)
+        token = _current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUESTS_IN_PROGRESS.dec()
+            _current_request.reset(token)
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.observe(elapsed, scope["method"], route, str(status))
+            REQUEST_DB_STATEMENTS.observe(stats.statements, route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, route)
+            if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+                log_slow_request(scope, status, elapsed, stats)
+
+
+def log_slow_request(scope, status: int, elapsed: float, stats: RequestStats):
+    path = scope["path"] + ("?" + scope["query_string"].decode() if scope.get("query_string") else "")
+    lines = [
+        f"{scope['method']} {path} -> {status} in {elapsed * 1000:.1f} ms, "
+        f"{stats.statements} SQL statements in {stats.db_seconds * 1000:.1f} ms"
+    ]
+    lines += [f"  [{seconds * 1000:.2f} ms] {' '.join(sql.split())}" for sql, seconds in stats.sql]
+    slow_request_logger.warning("\n".join(lines))
@@ -0,0 +1,111 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List
+
+from sqlalchemy import Index, inspect, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn
+
+from inventory import backfill_copies, create_inventory_triggers
+from models import Book, BookCopy, Rental, ArchivedRental, Wishlist, NotificationOutbox, NotificationDelivery, SchemaMigration
+
+logger = logging.getLogger(__name__)
+
+
+# One schema change for databases created before it. New databases already
+# get the change from Base.metadata.create_all, so upgrades must be safe to
+# run on a schema that has it (CREATE ... IF NOT EXISTS, checkfirst=True).
+@dataclass
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def _model_index(model, name: str) -> Index:
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+
+# ALTER TABLE ... ADD COLUMN for the model's columns the table lacks
+def _add_columns(connection: Connection, model, names):
+    existing = {column["name"] for column in inspect(connection).get_columns(model.__tablename__)}
+    for name in names:
+        if name not in existing:
+            column = CreateColumn(model.__table__.c[name]).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {model.__tablename__} ADD COLUMN {column}")
+
+
+def _add_query_indexes(connection: Connection):
+    for model, name in (
+        (Rental, "ix_rentals_active"),
+        (Wishlist, "ix_wishlist_book_user"),
+        (NotificationOutbox, "ix_notification_outbox_pending"),
+    ):
+        _model_index(model, name).create(connection, checkfirst=True)
+
+
+def _add_notification_deliveries(connection: Connection):
+    NotificationDelivery.__table__.create(connection, checkfirst=True)
+
+
+def _add_rental_archive(connection: Connection):
+    _model_index(Rental, "ix_rentals_user").create(connection, checkfirst=True)
+    ArchivedRental.__table__.create(connection, checkfirst=True)
+
+
+# One copy per existing book, available if the book was; open rentals are
+# matched to their book's copy
+def _add_book_copies(connection: Connection):
+    BookCopy.__table__.create(connection, checkfirst=True)
+    _add_columns(connection, Book, ("copies", "available_copies"))
+    _add_columns(connection, Rental, ("copy_id",))
+    backfill_copies(connection)
+    create_inventory_triggers(connection)
+
+
+# In version order; append new migrations, never edit applied ones
+MIGRATIONS: List[Migration] = [
+    Migration(1, "query indexes", _add_query_indexes),
+    Migration(2, "notification deliveries", _add_notification_deliveries),
+    Migration(3, "rental archive", _add_rental_archive),
+    Migration(4, "book copies", _add_book_copies),
+]
+
+
+def applied_versions(connection: Connection) -> set:
+    SchemaMigration.__table__.create(connection, checkfirst=True)
+    return set(connection.execute(select(SchemaMigration.version)).scalars())
+
+
+# Apply pending migrations, each in its own transaction together with its
+# schema_migrations row, so a failed upgrade leaves nothing behind. Returns
+# the versions applied. Safe to call on every startup, also from several
+# workers at once: the loser of a race finds the version recorded.
+def apply_migrations(engine: Engine, migrations: List[Migration] = MIGRATIONS) -> List[int]:
+    with engine.begin() as connection:
+        pending = set(m.version for m in migrations) - applied_versions(connection)
+
+    done = []
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version not in pending:
+            continue
+        try:
+            with engine.begin() as connection:
+                if connection.dialect.name == "sqlite":
+                    # pysqlite runs DDL outside of transactions unless one is
+                    # open; IMMEDIATE also takes the write lock up front
+                    connection.exec_driver_sql("BEGIN IMMEDIATE")
+                if migration.version in applied_versions(connection):
+                    continue
+                migration.upgrade(connection)
+                connection.execute(SchemaMigration.__table__.insert().values(
+                    version=migration.version, name=migration.name, applied_at=datetime.now()
+                ))
+        except IntegrityError:
+            logger.info("Migration %s was applied by another process", migration.version)
+            continue
+        logger.info("Applied migration %s: %s", migration.version, migration.name)
+        done.append(migration.version)
+    return done
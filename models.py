@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint, DateTime, Index, text
 from sqlalchemy.orm import relationship
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from database import Base
 
@@ -15,6 +15,10 @@ class User(Base):
     rentals = relationship("Rental", back_populates="user", cascade="all, delete-orphan")
     wishlist = relationship("Wishlist", back_populates="user", cascade="all, delete-orphan")
 
+# A new book's single copy is on the shelf if the book is available
+def _initial_available_copies(context) -> int:
+    return 0 if context.get_current_parameters().get("available") is False else 1
+
 class Book(Base):
     __tablename__ = "books"
 
@@ -24,13 +28,32 @@ class Book(Base):
     publication_year = Column(Integer)
     title = Column(String)
     language = Column(String)
+    # At least one copy is on the shelf. Kept in step with the copy counts
+    # below, which are denormalized from book_copies (see inventory.py).
     available = Column(Boolean, default=True)
     amazon_id = Column(String, nullable=True)
+    copies = Column(Integer, default=1, server_default=text("1"), nullable=False)
+    available_copies = Column(Integer, default=_initial_available_copies, server_default=text("1"), nullable=False)
 
     rentals = relationship("Rental", back_populates="book", cascade="all, delete-orphan")
     wishlisted_by = relationship("Wishlist", back_populates="book", cascade="all, delete-orphan")
 
 
+# One physical copy of a book. Rentals take a copy off the shelf rather than
+# the whole title.
+class BookCopy(Base):
+    __tablename__ = "book_copies"
+
+    id = Column(Integer, primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    available = Column(Boolean, default=True, nullable=False)
+
+    # A free copy of a book, lowest id first, straight from the index
+    __table_args__ = (
+        Index('ix_book_copies_book_available', 'book_id', 'available', 'id'),
+    )
+
+
 class Wishlist(Base):
     __tablename__ = "wishlist"
     id = Column(Integer, primary_key=True, index=True)
@@ -40,7 +63,11 @@ class Wishlist(Base):
     user = relationship("User", back_populates="wishlist")
     book = relationship("Book", back_populates="wishlisted_by")
 
-    __table_args__ = (UniqueConstraint('user_id', 'book_id', name='_user_book_uc'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'book_id', name='_user_book_uc'),
+        # Wishlisters of a book in user order, for the notification fan-out
+        Index('ix_wishlist_book_user', 'book_id', 'user_id'),
+    )
     
 class Rental(Base):
     __tablename__ = "rentals"
@@ -50,10 +77,121 @@ class Rental(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     rental_date = Column(DateTime, default=datetime.now)
     return_date = Column(DateTime, nullable=True)
+    # The copy taken; NULL for rentals recorded without one (returned before
+    # books had copies, or inserted directly)
+    copy_id = Column(Integer, ForeignKey("book_copies.id"), nullable=True)
 
     book = relationship("Book", back_populates="rentals")
     user = relationship("User", back_populates="rentals")
 
+    # Open rentals in id order (the rental report pages through them) without
+    # reading the returned ones, which are most of the table; and a user's
+    # rental history in id order
+    __table_args__ = (
+        Index('ix_rentals_active', 'id',
+              sqlite_where=text('return_date IS NULL'), postgresql_where=text('return_date IS NULL')),
+        Index('ix_rentals_user', 'user_id', 'id'),
+    )
+
+# Returned rentals moved out of `rentals` once older than the retention period
+# (see rental_archive.py). Rows keep their rental id.
+class ArchivedRental(Base):
+    __tablename__ = "rentals_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    book_id = Column(Integer, ForeignKey("books.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    rental_date = Column(DateTime)
+    return_date = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index('ix_rentals_archive_user', 'user_id', 'id'),
+    )
+
+# Wishlist notifications waiting to be fanned out. One row per availability
+# change; last_user_id records how far delivery has got through the wishlisters.
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
+    book_title = Column(String)
+    available_at = Column(DateTime, default=datetime.now, nullable=False)
+    last_user_id = Column(Integer, default=0, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    locked_until = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+    # Entries still to deliver; completed ones pile up and are never read again
+    __table_args__ = (
+        Index('ix_notification_outbox_pending', 'id',
+              sqlite_where=text('completed_at IS NULL'), postgresql_where=text('completed_at IS NULL')),
+    )
+
+# The latest wishlist alert for each (user, book), used to drop repeated alerts
+# within the dispatcher's dedupe window. sent_at is NULL while the alert waits
+# for the user's next digest.
+class NotificationDelivery(Base):
+    __tablename__ = "notification_deliveries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    book_title = Column(String)
+    available_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    # Alerts waiting for a digest, by user
+    __table_args__ = (
+        Index('ix_notification_deliveries_pending', 'user_id',
+              sqlite_where=text('sent_at IS NULL'), postgresql_where=text('sent_at IS NULL')),
+    )
+
+# Running totals over the rentals table (and a second row for the archive),
+# kept up to date by the triggers in rental_stats.py so the rental report
+# summary is a single lookup
+class RentalStats(Base):
+    __tablename__ = "rental_stats"
+
+    id = Column(Integer, primary_key=True)
+    active_count = Column(Integer, default=0, nullable=False)
+    returned_count = Column(Integer, default=0, nullable=False)
+    returned_days = Column(Integer, default=0, nullable=False)
+
+# OpenLibrary lookups by (title, author). asin is NULL for "not found", which
+# is re-checked once fetched_at is older than the negative cache TTL.
+class AsinCache(Base):
+    __tablename__ = "asin_cache"
+
+    title = Column(String, primary_key=True)
+    author = Column(String, primary_key=True)
+    asin = Column(String, nullable=True)
+    fetched_at = Column(DateTime, default=datetime.now, nullable=False)
+
+# Progress of an Amazon ID update run; last_book_id is the resume checkpoint
+class EnrichmentJob(Base):
+    __tablename__ = "enrichment_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String, default="pending", nullable=False)
+    last_book_id = Column(Integer, default=0, nullable=False)
+    processed = Column(Integer, default=0, nullable=False)
+    updated = Column(Integer, default=0, nullable=False)
+    cache_hits = Column(Integer, default=0, nullable=False)
+    failures = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    error = Column(String, nullable=True)
+
+# Schema migrations applied to this database (see migrations.py)
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.now, nullable=False)
+
 class RentalBase(BaseModel):
     book_id: int
     user_id: int  
@@ -62,10 +200,51 @@ class RentalOut(RentalBase):
     id: int
     rental_date: datetime
     return_date: Optional[datetime]
+    copy_id: Optional[int] = None
 
     model_config = {
         "from_attributes": True
     }
 
+# A rental in a user's history, which may have been moved to the archive
+class RentalHistoryOut(RentalOut):
+    archived: bool
+
+# Slim response models for the listing endpoints: only the fields they send
+class BookOut(BaseModel):
+    id: int
+    title: Optional[str]
+    authors: Optional[str]
+    available: bool
+    available_copies: int
+
+class WishlistBookOut(BaseModel):
+    book_id: int
+    title: Optional[str]
+    authors: Optional[str]
+
 class AvailabilityUpdate(BaseModel):
-    available: bool
\ No newline at end of file
+    available: bool
+
+# Largest number of items accepted by the batch rental endpoints
+MAX_BATCH_SIZE = 1000
+
+class RentalBatch(BaseModel):
+    items: List[RentalBase] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+class ReturnBatch(BaseModel):
+    rental_ids: List[int] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BatchItemOut(BaseModel):
+    status_code: int
+    detail: Optional[str] = None
+    rental: Optional[RentalOut] = None
+
+    model_config = {
+        "from_attributes": True
+    }
+
+class BatchOut(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BatchItemOut]
@@ -0,0 +1,408 @@
+import logging
+from abc import ABC, abstractmethod
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import insert, or_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import Book, User, Wishlist, NotificationOutbox, NotificationDelivery
+from metrics import NOTIFICATION_SEND, NOTIFICATIONS_SENT, NOTIFICATIONS_SUPPRESSED, NOTIFICATION_FAILURES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Notification:
+    user_id: int
+    username: str
+    book_id: int
+    book_title: str
+    available_at: datetime
+
+    @property
+    def message(self) -> str:
+        return (
+            f"Dear {self.username}, the book '{self.book_title}' "
+            f"has been recently made available on {self.available_at.strftime('%Y-%m-%d %H:%M')}.\n"
+        )
+
+
+# Several alerts for one user sent as a single message: (title, available_at)
+# for each book, oldest first
+@dataclass
+class Digest:
+    user_id: int
+    username: str
+    books: List[Tuple[str, datetime]]
+
+    @property
+    def message(self) -> str:
+        if len(self.books) == 1:
+            title, available_at = self.books[0]
+            return Notification(self.user_id, self.username, 0, title, available_at).message
+        lines = [f"Dear {self.username}, these books on your wishlist have recently been made available:\n"]
+        lines += [f"  - '{title}' on {available_at.strftime('%Y-%m-%d %H:%M')}\n" for title, available_at in self.books]
+        return "".join(lines)
+
+
+# Senders deliver one batch of notifications (or digests) at a time. Raising
+# from send_batch leaves the batch in the outbox so it is retried later.
+class NotificationSender(ABC):
+    @abstractmethod
+    def send_batch(self, notifications: List[Notification]):
+        ...
+
+
+# Default sender: appends the messages to a text file in place of real emails
+class FileNotificationSender(NotificationSender):
+    def __init__(self, path: str = "notifications.txt"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send_batch(self, notifications: List[Notification]):
+        with self._lock, open(self.path, "a") as notif_file:
+            notif_file.write("".join(n.message for n in notifications))
+
+
+# Record a pending wishlist notification in the caller's transaction. It only
+# becomes visible to the dispatcher once the availability change commits.
+def stage_wishlist_notification(db: Session, book: Book, old_status: bool) -> Optional[NotificationOutbox]:
+    if old_status or not book.available:
+        return None
+    entry = NotificationOutbox(book_id=book.id, book_title=book.title, available_at=datetime.now())
+    db.add(entry)
+    return entry
+
+
+# Stage the notifications for many books that just became available with one
+# multi-row INSERT, in the caller's transaction
+def stage_wishlist_notifications(db: Session, books: List[Book]):
+    if not books:
+        return
+    now = datetime.now()
+    db.execute(insert(NotificationOutbox).values([
+        {"book_id": book.id, "book_title": book.title, "available_at": now} for book in books
+    ]))
+
+
+# Outbox entries that are neither delivered nor leased to a worker
+def claimable_entries(now: datetime) -> list:
+    return [
+        NotificationOutbox.completed_at.is_(None),
+        or_(NotificationOutbox.locked_until.is_(None), NotificationOutbox.locked_until < now),
+    ]
+
+
+# The next `limit` users (by id) with the book on their wishlist. Filtering
+# and ordering on the wishlist columns lets ix_wishlist_book_user return them
+# in order instead of sorting every wishlister of the book.
+def wishlist_recipients(db: Session, book_id: int, after_user_id: int, limit: int):
+    return (
+        db.query(User.id, User.username)
+        .join(Wishlist, Wishlist.user_id == User.id)
+        .filter(Wishlist.book_id == book_id, Wishlist.user_id > after_user_id)
+        .order_by(Wishlist.user_id)
+        .limit(limit)
+    )
+
+
+# INSERT ... ON CONFLICT (user_id, book_id) DO UPDATE recording the latest
+# alert for each (user, book)
+def record_deliveries(db: Session, notifications: List[Notification], sent_at: Optional[datetime]):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        stmt = sqlite.insert(NotificationDelivery.__table__)
+    elif dialect == "postgresql":
+        stmt = postgresql.insert(NotificationDelivery.__table__)
+    else:
+        raise ValueError(f"Notification coalescing is not supported on '{dialect}'")
+    stmt = stmt.values([
+        {"user_id": n.user_id, "book_id": n.book_id, "book_title": n.book_title,
+         "available_at": n.available_at, "sent_at": sent_at}
+        for n in notifications
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id", "book_id"],
+        set_={column: stmt.excluded[column] for column in ("book_title", "available_at", "sent_at")},
+    ))
+
+
+# Delivers staged outbox entries in the background. A poller claims pending
+# entries with a time-limited lease and feeds them through a bounded queue to a
+# pool of workers; each worker pages through the book's wishlisters in batches
+# and records its progress after every batch. An entry whose worker dies is
+# picked up again once the lease expires, so delivery is at-least-once.
+#
+# With a dedupe_window, a user already alerted about a book within that long
+# before it became available again is skipped, so rapid rent/return cycles
+# don't repeat the alert. With a digest_interval, alerts are queued in
+# notification_deliveries instead of sent, and every digest_interval seconds
+# each user gets one message listing all of theirs.
+class NotificationDispatcher:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        sender: NotificationSender,
+        workers: int = 4,
+        queue_size: int = 100,
+        batch_size: int = 500,
+        poll_interval: float = 5.0,
+        lease: timedelta = timedelta(minutes=5),
+        retry_delay: timedelta = timedelta(seconds=30),
+        dedupe_window: timedelta = timedelta(0),
+        digest_interval: float = 0,
+    ):
+        self.session_factory = session_factory
+        self.sender = sender
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.dedupe_window = dedupe_window
+        self.digest_interval = digest_interval
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    # Whether deliveries are recorded per (user, book) at all
+    @property
+    def coalescing(self) -> bool:
+        return self.dedupe_window > timedelta(0) or self.digest_interval > 0
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._next_digest = time.monotonic() + self.digest_interval
+        self._threads = [threading.Thread(target=self._poll_loop, name="notify-poller", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._worker_loop, name=f"notify-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        for _ in range(self.workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # Outbox entries claimed and waiting for a worker
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # Called from request handlers after commit; never blocks
+    def wake(self):
+        self._wakeup.set()
+
+    # Deliver everything currently pending on the calling thread. In digest
+    # mode this only queues the alerts; flush_digests() sends them.
+    def run_once(self) -> int:
+        delivered = 0
+        for entry_id in self._claim_pending(limit=None):
+            delivered += self._deliver(entry_id)
+        return delivered
+
+    def _poll_loop(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                # Claim only what the queue can hold; the rest stays pending
+                room = self._queue.maxsize - self._queue.qsize()
+                for entry_id in self._claim_pending(limit=room):
+                    self._queue.put(entry_id)
+            except Exception:
+                logger.exception("Failed to poll the notification outbox")
+            if self.digest_interval > 0 and time.monotonic() >= self._next_digest:
+                self._next_digest = time.monotonic() + self.digest_interval
+                try:
+                    self.flush_digests()
+                except Exception:
+                    logger.exception("Failed to send notification digests")
+
+    def _worker_loop(self):
+        while True:
+            entry_id = self._queue.get()
+            if entry_id is None:
+                return
+            try:
+                self._deliver(entry_id)
+            except Exception:
+                logger.exception("Failed to deliver notification outbox entry %s", entry_id)
+            finally:
+                self._queue.task_done()
+
+    def _claim_pending(self, limit: Optional[int]) -> List[int]:
+        if limit is not None and limit <= 0:
+            return []
+        now = datetime.now()
+        claimable = claimable_entries(now)
+        with self.session_factory() as db:
+            q = db.query(NotificationOutbox.id).filter(*claimable).order_by(NotificationOutbox.id)
+            if limit is not None:
+                q = q.limit(limit)
+            candidates = [row.id for row in q]
+
+            claimed = []
+            for entry_id in candidates:
+                # Conditional update so only one poller (or process) wins each entry
+                won = (
+                    db.query(NotificationOutbox)
+                    .filter(NotificationOutbox.id == entry_id, *claimable)
+                    .update({NotificationOutbox.locked_until: now + self.lease}, synchronize_session=False)
+                )
+                if won:
+                    claimed.append(entry_id)
+            db.commit()
+        return claimed
+
+    # Send every batch for one outbox entry; returns the number of messages sent
+    def _deliver(self, entry_id: int) -> int:
+        sent = 0
+        with self.session_factory() as db:
+            entry = db.get(NotificationOutbox, entry_id)
+            if entry is None or entry.completed_at is not None:
+                return 0
+
+            while True:
+                recipients = wishlist_recipients(db, entry.book_id, entry.last_user_id, self.batch_size).all()
+                if not recipients:
+                    break
+
+                batch = [
+                    Notification(user.id, user.username, entry.book_id, entry.book_title, entry.available_at)
+                    for user in recipients
+                ]
+                if self.coalescing:
+                    batch = self._drop_repeats(db, batch)
+
+                if self.digest_interval > 0:
+                    if batch:
+                        record_deliveries(db, batch, sent_at=None)
+                elif batch:
+                    try:
+                        with NOTIFICATION_SEND.time():
+                            self.sender.send_batch(batch)
+                    except Exception as e:
+                        NOTIFICATION_FAILURES.inc()
+                        entry.attempts += 1
+                        entry.last_error = str(e)
+                        entry.locked_until = datetime.now() + self.retry_delay
+                        db.commit()
+                        raise
+
+                    sent += len(batch)
+                    NOTIFICATIONS_SENT.inc(amount=len(batch))
+                    if self.coalescing:
+                        record_deliveries(db, batch, sent_at=datetime.now())
+                entry.last_user_id = recipients[-1].id
+                entry.locked_until = datetime.now() + self.lease
+                db.commit()
+
+            entry.completed_at = datetime.now()
+            entry.locked_until = None
+            db.commit()
+        return sent
+
+    # The alerts in a batch (all for one book) whose user has not had an
+    # alert for the book within the dedupe window before it became available,
+    # nor has one waiting for a digest
+    def _drop_repeats(self, db: Session, batch: List[Notification]) -> List[Notification]:
+        previous = dict(
+            db.query(NotificationDelivery.user_id, NotificationDelivery.sent_at)
+            .filter(NotificationDelivery.book_id == batch[0].book_id,
+                    NotificationDelivery.user_id.in_([n.user_id for n in batch]))
+            .all()
+        )
+        fresh = []
+        for notification in batch:
+            if notification.user_id in previous:
+                sent_at = previous[notification.user_id]
+                if sent_at is None or sent_at > notification.available_at - self.dedupe_window:
+                    continue
+            fresh.append(notification)
+        if len(fresh) < len(batch):
+            NOTIFICATIONS_SUPPRESSED.inc("duplicate", amount=len(batch) - len(fresh))
+        return fresh
+
+    # Send every queued alert, one digest message per user, batch_size users
+    # at a time. Returns the number of digests sent.
+    def flush_digests(self) -> int:
+        sent = 0
+        after_user_id = 0
+        with self.session_factory() as db:
+            while True:
+                user_ids = [row.user_id for row in (
+                    db.query(NotificationDelivery.user_id)
+                    .filter(NotificationDelivery.sent_at.is_(None), NotificationDelivery.user_id > after_user_id)
+                    .distinct()
+                    .order_by(NotificationDelivery.user_id)
+                    .limit(self.batch_size)
+                )]
+                if not user_ids:
+                    break
+
+                rows = (
+                    db.query(NotificationDelivery.user_id, NotificationDelivery.book_id, User.username,
+                             NotificationDelivery.book_title, NotificationDelivery.available_at)
+                    .join(User, User.id == NotificationDelivery.user_id)
+                    .filter(NotificationDelivery.sent_at.is_(None), NotificationDelivery.user_id.in_(user_ids))
+                    .order_by(NotificationDelivery.user_id, NotificationDelivery.available_at)
+                    .all()
+                )
+                digests = {}
+                for row in rows:
+                    digest = digests.setdefault(row.user_id, Digest(row.user_id, row.username, []))
+                    digest.books.append((row.book_title, row.available_at))
+                if digests:
+                    try:
+                        with NOTIFICATION_SEND.time():
+                            self.sender.send_batch(list(digests.values()))
+                    except Exception:
+                        NOTIFICATION_FAILURES.inc()
+                        raise
+                    sent += len(digests)
+                    NOTIFICATIONS_SENT.inc(amount=len(digests))
+                    NOTIFICATIONS_SUPPRESSED.inc("digest", amount=len(rows) - len(digests))
+
+                    # Only the alerts just sent. There is one row per (user,
+                    # book): a newer alert for a book still queued is dropped
+                    # (see _drop_repeats), but once the row has been marked
+                    # sent, e.g. by a digest in another process, the next
+                    # alert overwrites it with a later available_at and no
+                    # sent_at. That one stays queued for the next digest.
+                    (
+                        db.query(NotificationDelivery)
+                        .filter(NotificationDelivery.sent_at.is_(None),
+                                tuple_(NotificationDelivery.user_id, NotificationDelivery.book_id,
+                                       NotificationDelivery.available_at)
+                                .in_([(row.user_id, row.book_id, row.available_at) for row in rows]))
+                        .update({NotificationDelivery.sent_at: datetime.now()}, synchronize_session=False)
+                    )
+                    db.commit()
+                after_user_id = user_ids[-1]
+        return sent
@@ -0,0 +1,104 @@
+import csv
+import io
+from typing import AsyncIterator, Callable, Iterator, Optional, Sequence
+
+from fastapi.responses import StreamingResponse
+
+from fast_json import dumps
+
+# Upper bound for a single page, and the chunk size used when streaming
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+
+NEXT_CURSOR_HEADER = "X-Next-After-Id"
+
+
+# Keyset (cursor) pagination: rows are ordered by the key column and each page
+# starts strictly after the last key the client saw, so deep pages cost the
+# same as the first one (no OFFSET scan).
+def keyset_page(q, key_column, after_id: Optional[int], limit: Optional[int]):
+    q = q.order_by(None).order_by(key_column)
+    if after_id is not None:
+        q = q.filter(key_column > after_id)
+    if limit is not None:
+        q = q.limit(limit)
+    return q
+
+
+# Cursor for the next page, or None if this page was the last one
+def next_cursor(rows, limit: Optional[int], key: Callable = lambda row: row.id):
+    if limit is None or len(rows) < limit:
+        return None
+    return key(rows[-1])
+
+
+# Walk the whole result set in keyset chunks. Only one chunk is held in memory
+# at a time and no read transaction stays open between chunks.
+def iter_keyset(q, key_column, after_id: Optional[int] = None,
+                chunk_size: int = STREAM_CHUNK_SIZE, key: Callable = lambda row: row.id):
+    while True:
+        rows = keyset_page(q, key_column, after_id, chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after_id = key(rows[-1])
+        # End the read transaction so writers aren't held back between chunks
+        q.session.rollback()
+
+
+# Async version of iter_keyset for select() statements on an AsyncSession.
+# Yields entities for select(Entity), or rows with scalars=False for column
+# selects.
+async def aiter_keyset(db, stmt, key_column, after_id: Optional[int] = None,
+                       chunk_size: int = STREAM_CHUNK_SIZE, key: Callable = lambda row: row.id,
+                       scalars: bool = True):
+    while True:
+        result = await db.execute(keyset_page(stmt, key_column, after_id, chunk_size))
+        rows = result.scalars().all() if scalars else result.all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after_id = key(rows[-1])
+        await db.rollback()
+
+
+def ndjson_lines(chunks: Iterator[list], serialize: Callable) -> Iterator[bytes]:
+    for rows in chunks:
+        yield b"".join(dumps(serialize(row)) + b"\n" for row in rows)
+
+
+async def andjson_lines(chunks: AsyncIterator[list], serialize: Callable) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield b"".join(dumps(serialize(row)) + b"\n" for row in rows)
+
+
+# Accepts both sync and async chunk iterators
+def ndjson_response(chunks, serialize: Callable) -> StreamingResponse:
+    lines = andjson_lines(chunks, serialize) if hasattr(chunks, "__aiter__") else ndjson_lines(chunks, serialize)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+# CSV with a header row; each chunk of rows goes out as one block of lines
+def csv_lines(chunks: Iterator[list], columns: Sequence[str], serialize: Callable) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue().encode()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            record = serialize(row)
+            writer.writerow([record[column] for column in columns])
+        yield buffer.getvalue().encode()
+
+
+def csv_response(chunks: Iterator[list], columns: Sequence[str], serialize: Callable,
+                 filename: Optional[str] = None) -> StreamingResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'} if filename else None
+    return StreamingResponse(csv_lines(chunks, columns, serialize), media_type="text/csv; charset=utf-8",
+                             headers=headers)
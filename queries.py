@@ -0,0 +1,44 @@
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session, joinedload
+
+from models import Book, User, Rental, Wishlist
+
+
+# Query helpers that load everything an endpoint needs in a single statement,
+# so handlers never trigger lazy loads (one extra SELECT per relationship).
+
+# Books on a user's wishlist as plain rows (id, title, authors)
+def wishlist_books(db: Session, user_id: int):
+    return (
+        db.query(Book.id, Book.title, Book.authors)
+        .join(Wishlist, Wishlist.book_id == Book.id)
+        .filter(Wishlist.user_id == user_id)
+        .order_by(Wishlist.id)
+        .all()
+    )
+
+
+# The book and the user for a new rental. Returns (None, None) if the book
+# doesn't exist and (book, None) if only the user is missing.
+def book_and_user(db: Session, book_id: int, user_id: int) -> Tuple[Optional[Book], Optional[User]]:
+    row = (
+        db.query(Book, User)
+        .select_from(Book)
+        .outerjoin(User, User.id == user_id)
+        .filter(Book.id == book_id)
+        .first()
+    )
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+# A rental together with its book and user
+def rental_with_book_and_user(db: Session, rental_id: int) -> Optional[Rental]:
+    return (
+        db.query(Rental)
+        .options(joinedload(Rental.book), joinedload(Rental.user))
+        .filter(Rental.id == rental_id)
+        .first()
+    )
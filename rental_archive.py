@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from heapq import merge
+from typing import Callable, List, Optional
+
+from sqlalchemy import func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from metrics import RENTALS_ARCHIVED
+from models import Rental, ArchivedRental
+from pagination import keyset_page
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+_ARCHIVED_COLUMNS = ("id", "book_id", "user_id", "rental_date", "return_date")
+
+
+# Move returned rentals whose return is older than `retention` from `rentals`
+# to `rentals_archive`, batch_size rows per transaction. Each batch copies and
+# deletes its rows in one short write transaction and the writer lock is given
+# up in between (for `pause` seconds), so requests renting and returning books
+# only ever wait for one batch. Returns the number of rentals moved.
+#
+# The newest rental always stays: SQLite hands out max(id) + 1 as the next
+# rental id, which must never be an id already in the archive.
+def archive_rentals(session_factory: Callable[[], Session], retention: timedelta,
+                    batch_size: int = DEFAULT_BATCH_SIZE, pause: float = 0.0,
+                    now: Optional[datetime] = None) -> int:
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    now = now or datetime.now()
+    cutoff = now - retention
+    moved = 0
+    after_id = 0
+    while True:
+        with session_factory() as db:
+            newest = db.query(func.max(Rental.id)).scalar()
+            if newest is None:
+                break
+            ids = [row.id for row in (
+                db.query(Rental.id)
+                .filter(Rental.id > after_id, Rental.id < newest,
+                        Rental.return_date.is_not(None), Rental.return_date < cutoff)
+                .order_by(Rental.id)
+                .limit(batch_size)
+            )]
+            if not ids:
+                break
+
+            source = select(*(Rental.__table__.c[name] for name in _ARCHIVED_COLUMNS), literal(now))
+            db.execute(insert(ArchivedRental).from_select(
+                _ARCHIVED_COLUMNS + ("archived_at",), source.where(Rental.id.in_(ids))
+            ))
+            db.query(Rental).filter(Rental.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+
+        moved += len(ids)
+        RENTALS_ARCHIVED.inc(amount=len(ids))
+        after_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+# One page of a user's rentals in id order, live and (with include_archived)
+# archived ones together. Each table is read with its own keyset query on its
+# (user_id, id) index and the two pages are merged.
+def rental_history_page(db: Session, user_id: int, after_id: Optional[int] = None,
+                        limit: Optional[int] = None, include_archived: bool = False) -> List[dict]:
+    sources = [(Rental, False)]
+    if include_archived:
+        sources.append((ArchivedRental, True))
+
+    pages = []
+    for model, archived in sources:
+        q = db.query(model.id, model.book_id, model.user_id, model.rental_date, model.return_date)
+        rows = keyset_page(q.filter(model.user_id == user_id), model.id, after_id, limit).all()
+        pages.append([
+            {
+                "id": row.id,
+                "book_id": row.book_id,
+                "user_id": row.user_id,
+                "rental_date": row.rental_date,
+                "return_date": row.return_date,
+                "archived": archived,
+            }
+            for row in rows
+        ])
+    history = list(merge(*pages, key=lambda rental: rental["id"]))
+    return history[:limit] if limit is not None else history
+
+
+# Archives rentals every `interval` seconds on a background thread, so the
+# live table only holds open rentals and the last `retention` of returns
+class RentalArchiveJob:
+    def __init__(self, session_factory: Callable[[], Session], retention: timedelta,
+                 interval: float = 3600.0, batch_size: int = DEFAULT_BATCH_SIZE, pause: float = 0.05):
+        self.session_factory = session_factory
+        self.retention = retention
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._loop, name="rental-archive", daemon=True)]
+        self._threads[0].start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self) -> int:
+        return archive_rentals(self.session_factory, self.retention, self.batch_size, self.pause)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                moved = self.run_once()
+                if moved:
+                    logger.info("Archived %s rentals", moved)
+            except Exception:
+                logger.exception("Failed to archive rentals")
+            self._stopping.wait(self.interval)
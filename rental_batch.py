@@ -0,0 +1,158 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session, joinedload
+
+from inventory import claim_copies, release_copies
+from models import Book, User, Rental
+from notifications import stage_wishlist_notifications
+
+
+# Outcome of one item of a batch: a status code and detail as the single-item
+# endpoint would have answered, plus the rental on success
+@dataclass
+class BatchItem:
+    status_code: int = 200
+    detail: Optional[str] = None
+    rental: Optional[Rental] = None
+
+    def fail(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code == 200
+
+
+@dataclass
+class BatchOutcome:
+    items: List[BatchItem]
+    # Books rented or returned, their new available copy counts and the users
+    # involved, for the caches and the audit log once the transaction has
+    # committed
+    books: Dict[int, Book] = field(default_factory=dict)
+    users: Dict[int, User] = field(default_factory=dict)
+    available_copies: Dict[int, int] = field(default_factory=dict)
+    became_available: Set[int] = field(default_factory=set)
+
+    @property
+    def succeeded(self) -> int:
+        return sum(item.ok for item in self.items)
+
+
+# Rent many books in the caller's transaction. Books and users are loaded with
+# one query each, and a free copy for every item of a still-available book is
+# claimed with a single conditional UPDATE, so items lose to concurrent
+# rentals exactly like the single-item endpoint. A book requested more often
+# than it has free copies goes to its first items.
+def rent_books(db: Session, requests) -> BatchOutcome:
+    book_ids = {request.book_id for request in requests}
+    user_ids = {request.user_id for request in requests}
+    books = {book.id: book for book in db.query(Book).filter(Book.id.in_(book_ids))}
+    users = {user.id: user for user in db.query(User).filter(User.id.in_(user_ids))}
+
+    items = [BatchItem() for _ in requests]
+    for item, request in zip(items, requests):
+        book = books.get(request.book_id)
+        if book is None:
+            item.fail(404, "Book not found")
+        elif not book.available:
+            item.fail(400, "Book is already rented")
+        elif request.user_id not in users:
+            item.fail(404, "User not found")
+
+    claimed = claim_copies(db, Counter(request.book_id for item, request in zip(items, requests) if item.ok))
+
+    # Each item takes the next copy claimed for its book
+    copy_items = {}
+    for item, request in zip(items, requests):
+        if not item.ok:
+            continue
+        if not claimed.get(request.book_id):
+            item.fail(400, "Book is already rented")
+            continue
+        copy_items[claimed[request.book_id].pop(0)] = (item, request)
+
+    now = datetime.now()
+    outcome = BatchOutcome(items)
+    for item, request in zip(items, requests):
+        if item.ok:
+            outcome.books[request.book_id] = books[request.book_id]
+            outcome.users[request.user_id] = users[request.user_id]
+            outcome.available_copies[request.book_id] = books[request.book_id].available_copies
+
+    # One multi-row INSERT (a flush would insert row by row to get the ids
+    # back in order); each copy appears once, so rows are matched by copy
+    if copy_items:
+        rentals = db.scalars(
+            insert(Rental)
+            .values([
+                {"book_id": request.book_id, "user_id": request.user_id, "rental_date": now, "copy_id": copy_id}
+                for copy_id, (item, request) in copy_items.items()
+            ])
+            .returning(Rental)
+        )
+        for rental in rentals:
+            copy_items[rental.copy_id][0].rental = rental
+    return outcome
+
+
+# Return many rentals in the caller's transaction: one query loads the
+# rentals with their books and users, one UPDATE closes the open ones, one
+# puts their copies back on the shelf and one more updates the books' counts.
+# Wishlist notifications for every book that had no copy left are staged
+# with a single INSERT.
+def return_rentals(db: Session, rental_ids: List[int]) -> BatchOutcome:
+    rentals = {
+        rental.id: rental
+        for rental in db.query(Rental)
+        .options(joinedload(Rental.book), joinedload(Rental.user))
+        .filter(Rental.id.in_(set(rental_ids)))
+    }
+
+    items = [BatchItem() for _ in rental_ids]
+    wanted = {}
+    for item, rental_id in zip(items, rental_ids):
+        rental = rentals.get(rental_id)
+        if rental is None:
+            item.fail(404, "Rental not found")
+        elif rental.return_date or rental_id in wanted:
+            item.fail(400, "Book already returned")
+        elif rental.user is None:
+            item.fail(404, "User not found")
+        else:
+            wanted[rental_id] = item
+
+    now = datetime.now()
+    closed = set()
+    if wanted:
+        closed = set(db.execute(
+            update(Rental)
+            .where(Rental.id.in_(wanted), Rental.return_date.is_(None))
+            .values(return_date=now)
+            .returning(Rental.id)
+            .execution_options(synchronize_session="evaluate")
+        ).scalars())
+
+    outcome = BatchOutcome(items)
+    for item, rental_id in zip(items, rental_ids):
+        if not item.ok:
+            continue
+        if rental_id not in closed:
+            item.fail(400, "Book already returned")
+            continue
+        rental = rentals[rental_id]
+        item.rental = rental
+        outcome.books[rental.book_id] = rental.book
+        outcome.users[rental.user_id] = rental.user
+
+    if outcome.books:
+        counts = release_copies(db, [(item.rental.book_id, item.rental.copy_id) for item in items if item.ok])
+        outcome.available_copies = {book_id: after for book_id, (before, after) in counts.items()}
+        outcome.became_available = {book_id for book_id, (before, after) in counts.items() if before == 0}
+        stage_wishlist_notifications(db, [outcome.books[book_id] for book_id in sorted(outcome.became_available)])
+    return outcome
@@ -0,0 +1,178 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import Base
+from models import RentalStats, ArchivedRental
+from reports import rental_summary, archived_rental_summary, add_summaries
+
+STATS_ID = 1
+# Second row: the same totals over rentals_archive
+ARCHIVE_STATS_ID = 2
+
+# Whole days between rental and return, same rounding as reports.days_between
+_DAYS = "(CAST(ROUND((julianday({row}.return_date) - julianday({row}.rental_date)) * 86400) AS INTEGER) / 86400)"
+
+
+def _contribution(row: str, sign: str) -> str:
+    days = _DAYS.format(row=row)
+    return f"""
+        active_count = active_count {sign} ({row}.return_date IS NULL),
+        returned_count = returned_count {sign} ({row}.return_date IS NOT NULL),
+        returned_days = returned_days {sign} COALESCE({days}, 0)
+    """
+
+
+# The counters are maintained by triggers, so every write to `rentals` (or
+# `rentals_archive`) updates them inside the same transaction - the API
+# endpoints as well as scripts, bulk deletes, archiving and the test suite.
+_CREATE_STATEMENTS = [
+    f"INSERT OR IGNORE INTO rental_stats (id, active_count, returned_count, returned_days) VALUES ({STATS_ID}, 0, 0, 0)",
+    f"INSERT OR IGNORE INTO rental_stats (id, active_count, returned_count, returned_days) VALUES ({ARCHIVE_STATS_ID}, 0, 0, 0)",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rental_stats_ai AFTER INSERT ON rentals BEGIN
+        UPDATE rental_stats SET {_contribution("new", "+")} WHERE id = {STATS_ID};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rental_stats_ad AFTER DELETE ON rentals BEGIN
+        UPDATE rental_stats SET {_contribution("old", "-")} WHERE id = {STATS_ID};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rental_stats_au AFTER UPDATE OF rental_date, return_date ON rentals BEGIN
+        UPDATE rental_stats SET {_contribution("old", "-")} WHERE id = {STATS_ID};
+        UPDATE rental_stats SET {_contribution("new", "+")} WHERE id = {STATS_ID};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rental_stats_archive_ai AFTER INSERT ON rentals_archive BEGIN
+        UPDATE rental_stats SET {_contribution("new", "+")} WHERE id = {ARCHIVE_STATS_ID};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS rental_stats_archive_ad AFTER DELETE ON rentals_archive BEGIN
+        UPDATE rental_stats SET {_contribution("old", "-")} WHERE id = {ARCHIVE_STATS_ID};
+    END
+    """,
+]
+_TRIGGER_NAMES = ("rental_stats_ai", "rental_stats_archive_ai")
+
+# Engines whose stats table is known to be maintained
+_stats_engines = set()
+
+
+def _create_triggers(connection) -> bool:
+    if connection.dialect.name != "sqlite":
+        return False
+    RentalStats.__table__.create(connection, checkfirst=True)
+    ArchivedRental.__table__.create(connection, checkfirst=True)
+    triggers = connection.exec_driver_sql(
+        f"SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN {_TRIGGER_NAMES}"
+    ).scalar()
+    for statement in _CREATE_STATEMENTS:
+        connection.exec_driver_sql(statement)
+    if triggers < len(_TRIGGER_NAMES):
+        # Counters start from whatever history is already in the table
+        with Session(bind=connection) as db:
+            _rebuild(db)
+    return True
+
+
+# Create the stats row and triggers if missing. Safe to call on every startup.
+def ensure_rental_stats(engine: Engine) -> bool:
+    with engine.begin() as connection:
+        created = _create_triggers(connection)
+    if created:
+        _stats_engines.add(engine)
+    return created
+
+
+def rental_stats_enabled(engine: Engine) -> bool:
+    if engine in _stats_engines:
+        return True
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'rental_stats_ai'"
+        ).first()
+    if exists:
+        _stats_engines.add(engine)
+    return bool(exists)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _schema_created(target, connection, **kw):
+    if _create_triggers(connection):
+        _stats_engines.add(connection.engine)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _schema_dropped(target, connection, **kw):
+    _stats_engines.discard(connection.engine)
+
+
+# Report summary from the counters where they are maintained, otherwise from
+# aggregate queries over the tables
+def current_rental_summary(db: Session, include_archived: bool = False) -> dict:
+    if rental_stats_enabled(db.get_bind()):
+        return read_rental_stats(db, include_archived)
+    return rental_summary(db, include_archived)
+
+
+def _read_row(db: Session, stats_id: int) -> dict:
+    stats = db.get(RentalStats, stats_id)
+    if stats is None:
+        return {"active": 0, "returned": 0, "total": 0, "returned_days": 0}
+    return {
+        "active": stats.active_count,
+        "returned": stats.returned_count,
+        "total": stats.active_count + stats.returned_count,
+        "returned_days": stats.returned_days,
+    }
+
+
+# O(1) report summary, in the same shape as reports.rental_summary
+def read_rental_stats(db: Session, include_archived: bool = False) -> dict:
+    summary = _read_row(db, STATS_ID)
+    if include_archived:
+        summary = add_summaries(summary, _read_row(db, ARCHIVE_STATS_ID))
+    return summary
+
+
+def _store_row(db: Session, stats_id: int, actual: dict):
+    stats = db.get(RentalStats, stats_id)
+    if stats is None:
+        stats = RentalStats(id=stats_id)
+        db.add(stats)
+    stats.active_count = actual["active"]
+    stats.returned_count = actual["returned"]
+    stats.returned_days = actual["returned_days"]
+
+
+def _rebuild(db: Session) -> dict:
+    actual = rental_summary(db)
+    _store_row(db, STATS_ID, actual)
+    _store_row(db, ARCHIVE_STATS_ID, archived_rental_summary(db))
+    db.flush()
+    return actual
+
+
+# Recompute the counters from the rentals table and the archive. The caller
+# commits.
+def rebuild_rental_stats(db: Session) -> dict:
+    return _rebuild(db)
+
+
+# Compare the counters against the rentals table and the archive. Returns the
+# fields that have drifted as {field: (stored, actual)}, archive fields
+# prefixed with "archived_"; empty when everything matches.
+def verify_rental_stats(db: Session) -> dict:
+    drift = {}
+    for prefix, stored, actual in (
+        ("", _read_row(db, STATS_ID), rental_summary(db)),
+        ("archived_", _read_row(db, ARCHIVE_STATS_ID), archived_rental_summary(db)),
+    ):
+        drift.update({prefix + key: (stored[key], actual[key]) for key in actual if stored[key] != actual[key]})
+    return drift
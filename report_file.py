@@ -0,0 +1,94 @@
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import Rental
+from pagination import iter_keyset
+from reports import summary_lines, active_rentals_query, active_rental_line
+from rental_stats import current_rental_summary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPORT_PATH = "rental_report.txt"
+
+
+# Write the rental report to `path`. Rows are streamed to a temp file in the
+# same directory, which then replaces `path` in one rename: readers see the
+# old report or the new one, never half of one, and concurrent writers can't
+# interleave their lines. Returns the number of active rentals written.
+def write_rental_report(db: Session, path: str = DEFAULT_REPORT_PATH, now: Optional[datetime] = None) -> int:
+    now = now or datetime.now()
+    summary = summary_lines(current_rental_summary(db))
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".rental_report.", suffix=".tmp", dir=directory)
+    written = 0
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write("Rental Report - Currently Rented Books\n")
+            file.write("=" * 60 + "\n")
+            for rows in iter_keyset(active_rentals_query(db), Rental.id):
+                file.writelines(active_rental_line(row, now) + "\n" for row in rows)
+                written += len(rows)
+            file.write("\nSummary\n")
+            file.write("=" * 60 + "\n")
+            for line in summary:
+                file.write(line + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file readable by the owner only
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return written
+
+
+# Regenerates the report file every `interval` seconds on a background
+# thread, so the file is kept fresh without any request writing to it
+class RentalReportJob:
+    def __init__(self, session_factory: Callable[[], Session], path: str = DEFAULT_REPORT_PATH,
+                 interval: float = 300.0):
+        self.session_factory = session_factory
+        self.path = path
+        self.interval = interval
+
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._loop, name="rental-report", daemon=True)]
+        self._threads[0].start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self) -> int:
+        with self.session_factory() as db:
+            return write_rental_report(db, self.path)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Failed to write the rental report to %s", self.path)
+            self._stopping.wait(self.interval)
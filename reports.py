@@ -0,0 +1,98 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, extract, cast, Integer
+from sqlalchemy.orm import Session
+
+from models import Book, User, Rental, ArchivedRental
+from pagination import keyset_page
+
+SECONDS_PER_DAY = 86400
+
+
+# Whole days between two datetime columns, computed in SQL. Matches
+# timedelta.days in Python (rounded to the second to avoid float noise).
+def days_between(db: Session, start, end):
+    if db.get_bind().dialect.name == "sqlite":
+        seconds = func.round((func.julianday(end) - func.julianday(start)) * SECONDS_PER_DAY)
+    else:
+        seconds = func.round(extract("epoch", end - start))
+    return cast(seconds, Integer) // SECONDS_PER_DAY
+
+
+# Active/returned/total counts and the total days of returned rentals, in a
+# single aggregate query over the rentals table. With include_archived, the
+# archived rentals are added from one more query over the archive.
+def rental_summary(db: Session, include_archived: bool = False) -> dict:
+    total, returned, returned_days = db.query(
+        func.count(Rental.id),
+        func.count(Rental.return_date),
+        func.coalesce(func.sum(days_between(db, Rental.rental_date, Rental.return_date)), 0),
+    ).one()
+    summary = {
+        "active": total - returned,
+        "returned": returned,
+        "total": total,
+        "returned_days": returned_days,
+    }
+    if include_archived:
+        summary = add_summaries(summary, archived_rental_summary(db))
+    return summary
+
+
+# The same numbers over the archive, where every rental is returned
+def archived_rental_summary(db: Session) -> dict:
+    returned, returned_days = db.query(
+        func.count(ArchivedRental.id),
+        func.coalesce(func.sum(days_between(db, ArchivedRental.rental_date, ArchivedRental.return_date)), 0),
+    ).one()
+    return {"active": 0, "returned": returned, "total": returned, "returned_days": returned_days}
+
+
+def add_summaries(a: dict, b: dict) -> dict:
+    return {key: a[key] + b[key] for key in a}
+
+
+def summary_lines(summary: dict) -> list:
+    avg_duration = summary["returned_days"] // summary["returned"] if summary["returned"] else 0
+    return [
+        f"Books Currently Rented: {summary['active']}",
+        f"Returned Rentals: {summary['returned']}",
+        f"Total Rentals: {summary['total']}",
+        f"Average Rental Duration: {avg_duration} day(s)"
+    ]
+
+
+# Currently rented books with the borrower, as one joined query
+def active_rentals_query(db: Session):
+    return (
+        db.query(Rental.id, Rental.book_id, Rental.user_id, Rental.rental_date, Book.title, User.username)
+        .join(Book, Book.id == Rental.book_id)
+        .join(User, User.id == Rental.user_id)
+        .filter(Rental.return_date.is_(None))
+    )
+
+
+def active_rentals_page(db: Session, after_id: Optional[int] = None, limit: Optional[int] = None):
+    return keyset_page(active_rentals_query(db), Rental.id, after_id, limit).all()
+
+
+def active_rental_line(row, now: datetime) -> str:
+    days_rented = (now - row.rental_date).days
+    return f"'{row.title}' rented by {row.username} for {days_rented} day(s)."
+
+
+# Columns of the active rentals export, in order
+ACTIVE_RENTAL_COLUMNS = ("rental_id", "book_id", "title", "user_id", "username", "rental_date", "days_rented")
+
+
+def active_rental_record(row, now: datetime) -> dict:
+    return {
+        "rental_id": row.id,
+        "book_id": row.book_id,
+        "title": row.title,
+        "user_id": row.user_id,
+        "username": row.username,
+        "rental_date": row.rental_date.isoformat(),
+        "days_rented": (now - row.rental_date).days,
+    }
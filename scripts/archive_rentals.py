@@ -0,0 +1,34 @@
+import sys
+import os
+import argparse
+from datetime import timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, engine
+from models import Base
+from migrations import apply_migrations
+from rental_archive import DEFAULT_BATCH_SIZE, archive_rentals
+from rental_stats import ensure_rental_stats
+
+
+# Move returned rentals older than the retention period to the archive once,
+# e.g. from cron. Batches are short transactions, so it is safe to run while
+# the API is serving.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old returned rentals")
+    parser.add_argument("--retention-days", type=float, required=True,
+                        help="keep rentals returned within this many days in the live table")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to wait between batches")
+    args = parser.parse_args(argv)
+
+    Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    ensure_rental_stats(engine)
+    moved = archive_rentals(SessionLocal, timedelta(days=args.retention_days), args.batch_size, args.pause)
+    print(f"Archived {moved} rentals.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,40 @@
-import csv
 import sys
 import os
+import argparse
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import SessionLocal
-from models import Book
+from database import engine
+from models import Base
+from migrations import apply_migrations
+from search_index import ensure_search_index
+from catalog_import import DEFAULT_BATCH_SIZE, import_books
 
 
-def load_books_from_csv(csv_path: str):
-    db: Session = SessionLocal()
+def print_progress(progress):
+    print(
+        f"chunk {progress.chunk}: {progress.chunk_rows} rows at {progress.chunk_rate:,.0f} rows/s "
+        f"({progress.total_rows:,} total, {progress.overall_rate:,.0f} rows/s overall)"
+    )
+
+
+def load_books_from_csv(csv_path: str, batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 1, quiet: bool = False):
+    Base.metadata.create_all(bind=engine)
+    apply_migrations(engine)
+    # Make sure the search index triggers exist so imported rows are indexed
+    ensure_search_index(engine)
 
     with open(csv_path, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=',')
-        
-        for row in reader:
-            if db.query(Book).filter_by(id=int(row['Id'])).first():
-                continue  # Skip if book already exists
-
-            book = Book(
-                id=int(row['Id']),
-                isbn=row['ISBN'],
-                authors=row['Authors'],
-                publication_year=int(row['Publication Year']),
-                title=row['Title'],
-                language=row['Language']
-            )
-            db.add(book)
-        db.commit()
-
-        db.close()
-        print("Books imported successfully.")
+        result = import_books(engine, csvfile, batch_size, workers, progress=None if quiet else print_progress)
+
+    print(f"Books imported successfully: {result.rows:,} rows in {result.seconds:.1f}s ({result.rate:,.0f} rows/s).")
+    return result
 
 if __name__ == "__main__":
-    load_books_from_csv("books.csv") 
+    parser = argparse.ArgumentParser(description="Import or update the book catalog from a CSV file")
+    parser.add_argument("csv_path", nargs="?", default="books.csv")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="rows per INSERT/transaction")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to parse CSV rows")
+    parser.add_argument("--quiet", action="store_true", help="don't print per-chunk progress")
+    args = parser.parse_args()
+    load_books_from_csv(args.csv_path, args.batch_size, args.workers, args.quiet)
@@ -0,0 +1,33 @@
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import engine
+from models import Base
+from migrations import MIGRATIONS, applied_versions, apply_migrations
+
+
+# Bring an existing database (library.db by default, or DATABASE_URL) up to
+# the current schema. The API does the same on startup.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--list", action="store_true", help="show which migrations are applied and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        with engine.begin() as connection:
+            applied = applied_versions(connection)
+        for migration in MIGRATIONS:
+            state = "applied" if migration.version in applied else "pending"
+            print(f"{migration.version:4} {state:8} {migration.name}")
+        return 0
+
+    Base.metadata.create_all(bind=engine)
+    done = apply_migrations(engine)
+    print(f"Applied migrations: {', '.join(map(str, done))}." if done else "Database is up to date.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,50 +1,35 @@
-from sqlalchemy.orm import Session
-from models import Book
-from database import Base, SessionLocal
 import sys
 import os
-import requests
+import argparse
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def fetch_amazon_asin(title: str, author: str):
-    query = f"https://openlibrary.org/search.json?title={title}&author={author}"
-    response = requests.get(query)
-    if response.status_code != 200:
-        print(f"Failed to fetch data for {title} by {author}")
-        return None
-    
-    data = response.json()
-    docs = data.get('docs', [])
-    
-    if not docs:
-        print(f"No docs found for {title} by {author}")
-        return None
-    
-    for doc in docs:
-        print(f"Checking doc: {doc}") 
-        identifiers = doc.get('identifier') or {}
-        if 'amazon' in identifiers:
-            return identifiers['amazon'][0]
-        if 'asin' in identifiers:
-            return identifiers['asin'][0]
-    print(f"No ASIN found for {title} by {author}")
-    return None
+from database import engine
+from models import Base, EnrichmentJob
+from amazon_ids import AmazonIdUpdater, EnrichmentSettings
 
 
-def update_books_amazon_id():
-    db: Session = SessionLocal()
-    try:
-        books = db.query(Book).filter(Book.amazon_id == None).all()
-        for book in books:
-            asin = fetch_amazon_asin(book.title, book.authors)
-            if asin:
-                book.amazon_id = asin
-                db.add(book)
-                print(f"Updated {book.title} with Amazon ASIN: {asin}")
-        db.commit()
-    finally:
-        db.close()
+def update_books_amazon_id(settings: EnrichmentSettings = None):
+    Base.metadata.create_all(bind=engine)
+    updater = AmazonIdUpdater(settings)
+    job_id = updater.start(engine)
+    updater.join()
+
+    with engine.connect() as connection:
+        job = connection.execute(EnrichmentJob.__table__.select().where(EnrichmentJob.id == job_id)).first()
+    print(
+        f"Job {job.id} {job.status}: {job.processed} books checked, {job.updated} updated, "
+        f"{job.cache_hits} from cache, {job.failures} failed lookups."
+    )
 
 if __name__ == "__main__":
-    update_books_amazon_id()
+    parser = argparse.ArgumentParser(description="Fill in missing Amazon IDs from OpenLibrary")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=5.0, help="requests per second")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="books per commit")
+    args = parser.parse_args()
+    update_books_amazon_id(EnrichmentSettings(
+        concurrency=args.concurrency,
+        requests_per_second=args.rate,
+        checkpoint_every=args.checkpoint_every,
+    ))
@@ -0,0 +1,39 @@
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, engine
+from rental_stats import ensure_rental_stats, rebuild_rental_stats, verify_rental_stats
+
+
+# Check the rental_stats counters against the rentals table, and optionally
+# rebuild them. Exits non-zero if drift was found and not repaired.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify or rebuild the rental statistics table")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the counters from the rentals table")
+    args = parser.parse_args(argv)
+
+    ensure_rental_stats(engine)
+    db = SessionLocal()
+    try:
+        drift = verify_rental_stats(db)
+        for field, (stored, actual) in drift.items():
+            print(f"{field}: stored {stored}, actual {actual}")
+
+        if args.rebuild:
+            rebuild_rental_stats(db)
+            db.commit()
+            print("Rental stats rebuilt.")
+            return 0
+        if drift:
+            print("Rental stats have drifted; run with --rebuild to repair.")
+            return 1
+        print("Rental stats match the rentals table.")
+        return 0
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal
+from report_file import DEFAULT_REPORT_PATH, write_rental_report
+
+
+# Regenerate the rental report file once, e.g. from cron. The file is
+# replaced atomically, so it is safe to run while the API is serving.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the rental report file")
+    parser.add_argument("path", nargs="?", default=DEFAULT_REPORT_PATH)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        rentals = write_rental_report(db, args.path)
+    print(f"Rental report written to {args.path} ({rentals} active rentals).")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import re
+
+from sqlalchemy import event, text, column, table
+from sqlalchemy.engine import Engine
+
+from models import Book
+
+# FTS5 index over the searchable book columns. It is an external-content table
+# so the text lives only in `books`; the triggers below keep it in sync.
+FTS_TABLE = "books_fts"
+
+# bm25 weights per column (title, authors, isbn) - title hits rank highest
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+books_fts = table(FTS_TABLE, column("rowid"))
+
+_CREATE_STATEMENTS = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, authors, isbn,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, authors, isbn)
+        VALUES (new.id, new.title, new.authors, new.isbn);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, authors, isbn)
+        VALUES ('delete', old.id, old.title, old.authors, old.isbn);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, authors, isbn ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, authors, isbn)
+        VALUES ('delete', old.id, old.title, old.authors, old.isbn);
+        INSERT INTO {FTS_TABLE}(rowid, title, authors, isbn)
+        VALUES (new.id, new.title, new.authors, new.isbn);
+    END
+    """,
+]
+
+# Engines known to have a usable index, so the check runs once per engine
+_fts_engines = set()
+
+
+def _supports_fts5(connection) -> bool:
+    if connection.dialect.name != "sqlite":
+        return False
+    options = connection.exec_driver_sql("PRAGMA compile_options").scalars().all()
+    if any(option == "ENABLE_FTS5" for option in options):
+        return True
+    # Some builds ship FTS5 as a loadable default without the compile flag
+    try:
+        connection.exec_driver_sql("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)")
+        connection.exec_driver_sql("DROP TABLE temp._fts5_probe")
+        return True
+    except Exception:
+        return False
+
+
+def _create_index(connection) -> bool:
+    if not _supports_fts5(connection):
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).first()
+    for statement in _CREATE_STATEMENTS:
+        connection.exec_driver_sql(statement)
+    if not exists:
+        # Backfill rows that were inserted before the index existed
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+# Create the index (and triggers) if missing. Safe to call on every startup.
+def ensure_search_index(engine: Engine) -> bool:
+    with engine.begin() as connection:
+        created = _create_index(connection)
+    if created:
+        _fts_engines.add(engine)
+    return created
+
+
+# Re-populate the index from the books table, e.g. after a bulk load that
+# bypassed the triggers.
+def rebuild_search_index(engine: Engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_index_enabled(engine: Engine) -> bool:
+    if engine in _fts_engines:
+        return True
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+        ).first()
+    if exists:
+        _fts_engines.add(engine)
+    return bool(exists)
+
+
+# Keep the index alongside the books table when the schema is created/dropped
+# through Base.metadata (e.g. the test suite).
+@event.listens_for(Book.__table__, "after_create")
+def _books_created(target, connection, **kw):
+    if _create_index(connection):
+        _fts_engines.add(connection.engine)
+
+
+@event.listens_for(Book.__table__, "before_drop")
+def _books_dropped(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    _fts_engines.discard(connection.engine)
+
+
+# Turn free text into an FTS5 expression where every term must match as a
+# prefix, e.g. "Harry Pot" -> "harry"* AND "pot"*. Returns None if the text has
+# no searchable terms.
+def build_match_expression(terms: str, columns: tuple = ()):
+    words = re.findall(r"\w+", terms.lower())
+    if not words:
+        return None
+    expression = " AND ".join(f'"{word}"*' for word in words)
+    if columns:
+        expression = "{" + " ".join(columns) + "} : (" + expression + ")"
+    return expression
+
+
+def build_match_query(query=None, title=None, author=None):
+    if query:
+        return build_match_expression(query)
+
+    parts = []
+    for columns, value in ((("title",), title), (("authors",), author)):
+        if value:
+            expression = build_match_expression(value, columns)
+            if expression is None:
+                return None
+            parts.append(expression)
+    return " AND ".join(parts) or None
+
+
+# Apply a ranked full-text filter to a Book query
+def apply_fts_search(q, match: str):
+    weights = ", ".join(str(weight) for weight in RANK_WEIGHTS)
+    return (
+        q.join(books_fts, books_fts.c.rowid == Book.id)
+        .filter(text(f"{FTS_TABLE} MATCH :match").bindparams(match=match))
+        .order_by(text(f"bm25({FTS_TABLE}, {weights})"), Book.id)
+    )
@@ -0,0 +1,378 @@
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from models import Book
+
+LOAD_CHUNK_SIZE = 10000
+
+# Words shorter than this (and numbers) only match by prefix, never with typos
+MIN_FUZZY_LENGTH = 4
+# Share of trigrams a word and a term need in common before the edit
+# distance is checked
+MIN_TRIGRAM_SIMILARITY = 0.3
+
+# Above this many books, a word matching several terms has their postings
+# merged lazily instead of sorted up front
+MAX_SORTED_CANDIDATES = 10000
+
+# Books kept apart from the flat arrays (see SuggestIndex) before they are
+# merged back in: this many, plus one per LATE_BOOKS_RATIO books indexed
+MIN_LATE_BOOKS = 1000
+LATE_BOOKS_RATIO = 16
+
+_WORD = re.compile(r"\w+")
+
+
+# Lowercase words without diacritics, split like the FTS5 tokenizer does
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    text = text.lower()
+    if not text.isascii():
+        decomposed = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _WORD.findall(text)
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Typos tolerated in a word: one for short words, two from eight letters on
+def max_edits(word: str) -> int:
+    return 1 if len(word) < 8 else 2
+
+
+# Edit distance counting insertions, deletions, substitutions and swaps of
+# adjacent letters ("tolkein") as one edit each. Gives up, returning
+# limit + 1, once every alignment needs more than `limit` edits.
+def edit_distance(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def typo_tolerant(word: str) -> bool:
+    return len(word) >= MIN_FUZZY_LENGTH and not word.isdigit()
+
+
+def word_matches(word: str, terms: Iterable[str], fuzzy: bool) -> bool:
+    fuzzy = fuzzy and typo_tolerant(word)
+    limit = max_edits(word)
+    for term in terms:
+        if term.startswith(word):
+            return True
+        if fuzzy and edit_distance(word, term, limit) <= limit:
+            return True
+    return False
+
+
+# In-memory word index over book titles and authors for search-as-you-type.
+# Every distinct word (term) gets an id. A sorted list of the terms answers
+# prefix lookups with two bisections, and a trigram -> term ids map finds the
+# terms within a typo or two of a word. Each term's postings are the sorted
+# ids of the books containing it, and each book's term ids are kept the other
+# way round, all in flat int arrays (4 bytes per entry) rather than sets.
+#
+# A query walks the postings of its rarest word in id order and checks the
+# other words against each book's terms, stopping as soon as it has enough
+# books, so answers cost about the same however large the catalog is.
+#
+# Loaded once at startup; books added later are indexed with add_books().
+# A book indexed again is dropped from the postings of words it no longer
+# has, and its term ids overwrite its slice of the flat arrays when they fit.
+# Other books (new ones with an id below the last, or books with more terms
+# than before) wait in a small map that is merged back into the flat arrays
+# once it passes MIN_LATE_BOOKS + 1/LATE_BOOKS_RATIO of the books, so memory
+# stays proportional to the catalog across re-imports. Words nobody uses any
+# more keep their (empty) term entry until the next load. Changes made
+# without add_books() aren't seen, so callers check the rows they fetch with
+# matches().
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._term_ids: Dict[str, int] = {}
+        self._terms: List[str] = []
+        # Terms in sorted order, and their ids in the same order
+        self._sorted_terms: List[str] = []
+        self._sorted_ids = array("i")
+        self._postings: List[array] = []
+        self._trigrams: Dict[str, array] = {}
+        # Books in id order: the i-th book is _book_ids[i] and its term ids
+        # are _book_terms[_offsets[i]:_offsets[i + 1]]. Book ids are sparse
+        # (Goodreads ids), so they are looked up by bisection rather than
+        # used as positions. -1 pads a slice that shrank. Books indexed out of
+        # id order, or again with more terms, live in _late_books.
+        self._book_ids = array("i")
+        self._offsets = array("I", [0])
+        self._book_terms = array("i")
+        self._late_books: Dict[int, array] = {}
+
+    def load(self, bind: Engine):
+        fresh = SuggestIndex()
+        with bind.connect() as connection:
+            result = connection.execution_options(yield_per=LOAD_CHUNK_SIZE).execute(
+                select(Book.id, Book.title, Book.authors).order_by(Book.id)
+            )
+            for book_id, title, authors in result:
+                fresh._add(book_id, title, authors, keep_sorted=False)
+        order = sorted(range(len(fresh._terms)), key=fresh._terms.__getitem__)
+        fresh._sorted_terms = [fresh._terms[term_id] for term_id in order]
+        fresh._sorted_ids = array("i", order)
+        with self._lock:
+            self.__dict__.update({name: value for name, value in vars(fresh).items() if name != "_lock"})
+            self.loaded = True
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.loaded = False
+
+    # Index new or changed books: rows or dicts with id, title and authors.
+    # A no-op until the index is loaded.
+    def add_books(self, books: Iterable):
+        with self._lock:
+            if not self.loaded:
+                return
+            for book in books:
+                if isinstance(book, dict):
+                    self._add(book["id"], book.get("title"), book.get("authors"))
+                else:
+                    self._add(book.id, book.title, book.authors)
+
+    @property
+    def terms(self) -> int:
+        return len(self._terms)
+
+    # Up to `limit` ids after `after_id`, in id order, of the books matching
+    # every word of `text`. Words match title and author words by prefix, or
+    # with `fuzzy` also within max_edits() typos.
+    def find(self, text: str, fuzzy: bool = False, after_id: Optional[int] = None,
+             limit: Optional[int] = None) -> List[int]:
+        words = tokenize(text)
+        with self._lock:
+            groups = self._word_groups(words, fuzzy, strict=False)
+            return self._scan(groups, after_id, limit) if groups else []
+
+    # The `limit` best matches for `text`. Books where every word but the
+    # last (which is still being typed) is a whole word come first, then
+    # those matching by prefixes and typos; each in id order.
+    def suggest(self, text: str, limit: int, fuzzy: bool = True) -> List[int]:
+        words = tokenize(text)
+        found: List[int] = []
+        with self._lock:
+            for strict in (True, False):
+                groups = self._word_groups(words, fuzzy and not strict, strict)
+                if groups:
+                    found += self._scan(groups, None, limit - len(found), exclude=set(found))
+                if len(found) >= limit:
+                    break
+        return found
+
+    # Whether a fetched row still matches `text`, checking its words against
+    # the given field values
+    @staticmethod
+    def matches(text: Optional[str], *fields: Optional[str], fuzzy: bool = False) -> bool:
+        terms = [term for field in fields for term in tokenize(field)]
+        return all(word_matches(word, terms, fuzzy) for word in tokenize(text))
+
+    def _add(self, book_id: int, title: Optional[str], authors: Optional[str], keep_sorted: bool = True):
+        term_ids = array("i")
+        known_terms, all_postings = self._term_ids, self._postings
+        for word in set(tokenize(f"{title or ''} {authors or ''}")):
+            term_id = known_terms.get(word)
+            if term_id is None:
+                term_id = self._new_term(word, keep_sorted)
+            term_ids.append(term_id)
+            postings = all_postings[term_id]
+            if not postings or postings[-1] < book_id:
+                postings.append(book_id)
+            elif not _contains(postings, book_id):
+                postings.insert(bisect_left(postings, book_id), book_id)
+
+        if not self._book_ids or book_id > self._book_ids[-1]:
+            self._book_ids.append(book_id)
+            self._book_terms.extend(term_ids)
+            self._offsets.append(len(self._book_terms))
+            return
+
+        kept = set(term_ids)
+        for term_id in self._terms_of(book_id):
+            if term_id >= 0 and term_id not in kept:
+                postings = all_postings[term_id]
+                del postings[bisect_left(postings, book_id)]
+
+        position = self._position(book_id)
+        if position is not None and book_id not in self._late_books:
+            start, end = self._offsets[position], self._offsets[position + 1]
+            if len(term_ids) <= end - start:
+                term_ids.extend([-1] * (end - start - len(term_ids)))
+                self._book_terms[start:end] = term_ids
+                return
+        self._late_books[book_id] = term_ids
+        if len(self._late_books) > MIN_LATE_BOOKS + len(self._book_ids) // LATE_BOOKS_RATIO:
+            self._merge_late_books()
+
+    # Rebuild the flat arrays with the late books in their place
+    def _merge_late_books(self):
+        late = sorted(self._late_books.items())
+        book_ids, offsets, book_terms = array("i"), array("I", [0]), array("i")
+
+        def append(book_id, term_ids):
+            book_ids.append(book_id)
+            book_terms.extend(term_id for term_id in term_ids if term_id >= 0)
+            offsets.append(len(book_terms))
+
+        next_late = 0
+        for position, book_id in enumerate(self._book_ids):
+            while next_late < len(late) and late[next_late][0] < book_id:
+                append(*late[next_late])
+                next_late += 1
+            if next_late < len(late) and late[next_late][0] == book_id:
+                append(*late[next_late])
+                next_late += 1
+            else:
+                append(book_id, self._book_terms[self._offsets[position]:self._offsets[position + 1]])
+        for book_id, term_ids in late[next_late:]:
+            append(book_id, term_ids)
+        self._book_ids, self._offsets, self._book_terms = book_ids, offsets, book_terms
+        self._late_books = {}
+
+    def _new_term(self, word: str, keep_sorted: bool) -> int:
+        term_id = self._term_ids[word] = len(self._terms)
+        self._terms.append(word)
+        self._postings.append(array("i"))
+        if keep_sorted:
+            position = bisect_left(self._sorted_terms, word)
+            self._sorted_terms.insert(position, word)
+            self._sorted_ids.insert(position, term_id)
+        for gram in trigrams(word):
+            self._trigrams.setdefault(gram, array("i")).append(term_id)
+        return term_id
+
+    # Where the book is in the flat arrays, if it is
+    def _position(self, book_id: int) -> Optional[int]:
+        position = bisect_left(self._book_ids, book_id)
+        if position == len(self._book_ids) or self._book_ids[position] != book_id:
+            return None
+        return position
+
+    def _terms_of(self, book_id: int):
+        late = self._late_books.get(book_id)
+        if late is not None:
+            return late
+        position = self._position(book_id)
+        if position is None:
+            return ()
+        return self._book_terms[self._offsets[position]:self._offsets[position + 1]]
+
+    # Term ids starting with `word`
+    def _prefix_terms(self, word: str):
+        start = bisect_left(self._sorted_terms, word)
+        end = bisect_left(self._sorted_terms, word + "\U0010ffff", start)
+        return self._sorted_ids[start:end]
+
+    # Term ids within max_edits() typos of `word`. Candidates sharing enough
+    # trigrams are counted from the trigram postings first, so the edit
+    # distance is only computed for a handful of terms.
+    def _fuzzy_terms(self, word: str) -> List[int]:
+        if not typo_tolerant(word):
+            return []
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            postings = self._trigrams.get(gram)
+            if postings:
+                shared.update(postings)
+        limit = max_edits(word)
+        found = []
+        for term_id, count in shared.items():
+            term = self._terms[term_id]
+            if count / (len(grams) + len(term) + 1 - count) < MIN_TRIGRAM_SIMILARITY:
+                continue
+            if edit_distance(word, term, limit) <= limit:
+                found.append(term_id)
+        return found
+
+    # The term ids each word may match, or None if some word matches nothing.
+    # `strict` matches every word but the last as a whole word only.
+    def _word_groups(self, words: List[str], fuzzy: bool, strict: bool) -> Optional[List[Set[int]]]:
+        if not words:
+            return None
+        groups = []
+        for position, word in enumerate(words):
+            if strict and position < len(words) - 1:
+                term_id = self._term_ids.get(word)
+                term_ids = {term_id} if term_id is not None else set()
+            else:
+                term_ids = set(self._prefix_terms(word))
+                if fuzzy:
+                    term_ids.update(self._fuzzy_terms(word))
+            if not term_ids:
+                return None
+            groups.append(term_ids)
+        return groups
+
+    # Walk the postings of the group matching the fewest books in id order,
+    # keeping the books whose own terms satisfy every other group
+    def _scan(self, groups: List[Set[int]], after_id: Optional[int], limit: Optional[int],
+              exclude: Set[int] = frozenset()) -> List[int]:
+        sizes = [sum(len(self._postings[term_id]) for term_id in group) for group in groups]
+        driver = groups[sizes.index(min(sizes))]
+        others = [group for group in groups if group is not driver]
+
+        lists = [self._postings[term_id] for term_id in driver]
+        if after_id is not None:
+            lists = [postings[bisect_right(postings, after_id):] for postings in lists]
+        if len(lists) == 1:
+            candidates = lists[0]
+        elif min(sizes) <= MAX_SORTED_CANDIDATES:
+            candidates = sorted(set().union(*lists))
+        else:
+            # Many books: merge lazily, as only the first few may be needed
+            candidates = heapq.merge(*lists)
+
+        found = []
+        previous = None
+        for book_id in candidates:
+            if book_id == previous or book_id in exclude:
+                continue
+            previous = book_id
+            if others:
+                terms = self._terms_of(book_id)
+                if not all(any(term_id in group for term_id in terms) for group in others):
+                    continue
+            found.append(book_id)
+            if len(found) == limit:
+                break
+        return found
+
+
+def _contains(postings: array, book_id: int) -> bool:
+    position = bisect_left(postings, book_id)
+    return position < len(postings) and postings[position] == book_id
@@ -4,20 +4,21 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
 
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
-from database import engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import create_db_engine, create_async_db_engine
 from models import Base, Book, User
-from main import app, get_db
+from main import app, get_db, get_async_db, catalog_cache
 
 # Use a test database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db?check_same_thread=False"
-test_engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False, "timeout": 3}
-)
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+test_engine = create_db_engine(SQLALCHEMY_DATABASE_URL, profile="test")
 Base.metadata.bind = test_engine
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=test_engine)
+async_test_engine = create_async_db_engine(SQLALCHEMY_DATABASE_URL, profile="test")
+TestingAsyncSessionLocal = async_sessionmaker(async_test_engine, autoflush=False, expire_on_commit=False)
 
 # Override get_db to use test DB
 def override_get_db():
@@ -27,13 +28,43 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+# Tests seed the database directly, behind the catalog cache's back;
+# test_catalog_cache.py turns it on where it is under test
+catalog_cache.enabled = False
 client = TestClient(app)
 
 @pytest.fixture(scope="module")
 def test_client():
     return client
 
+# Record every SQL statement sent to the test database inside the block, so
+# tests can pin the number of queries an endpoint issues
+@contextmanager
+def capture_queries():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = [test_engine, async_test_engine.sync_engine]
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+@pytest.fixture
+def count_queries():
+    return capture_queries
+
 @pytest.fixture(scope="module", autouse=True)
 def setup_database():
     Base.metadata.drop_all(bind=test_engine)
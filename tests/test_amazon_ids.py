@@ -0,0 +1,166 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from models import Book, AsinCache, EnrichmentJob
+from conftest import TestingSessionLocal, test_engine
+from amazon_ids import AmazonIdUpdater, EnrichmentSettings, TokenBucket, extract_asin
+import main
+
+
+# Local stand-in for the OpenLibrary search API. Titles starting with "Known"
+# have an ASIN, "Flaky" titles fail once with a 503 first.
+class StubOpenLibrary(BaseHTTPRequestHandler):
+    requests = Counter()
+
+    def do_GET(self):
+        title = parse_qs(urlparse(self.path).query).get("title", [""])[0]
+        StubOpenLibrary.requests[title] += 1
+
+        if title.startswith("Flaky") and StubOpenLibrary.requests[title] == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        docs = []
+        if title.startswith("Known") or title.startswith("Flaky"):
+            docs = [{"title": title}, {"title": title, "id_amazon": [f"ASIN-{title.split()[-1]}"]}]
+        body = json.dumps({"docs": docs}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenLibrary)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/search.json"
+    server.shutdown()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def catalog():
+    db = TestingSessionLocal()
+    db.add_all([
+        Book(title="Known 1", authors="Author K", isbn="AMZ1"),
+        Book(title="Known 2", authors="Author K", isbn="AMZ2"),
+        Book(title="Unknown 3", authors="Author K", isbn="AMZ3"),
+        Book(title="Flaky 4", authors="Author K", isbn="AMZ4"),
+    ])
+    db.commit()
+    db.close()
+
+
+def settings(stub_url, **overrides):
+    return EnrichmentSettings(**{
+        "base_url": stub_url, "requests_per_second": 1000, "backoff": 0.01, "checkpoint_every": 2, **overrides
+    })
+
+
+def reset():
+    db = TestingSessionLocal()
+    db.query(EnrichmentJob).delete()
+    db.query(AsinCache).delete()
+    db.query(Book).update({Book.amazon_id: None})
+    db.commit()
+    db.close()
+    StubOpenLibrary.requests.clear()
+
+
+def run_job(stub_url, **overrides):
+    updater = AmazonIdUpdater(settings(stub_url, **overrides))
+    job_id = updater.start(test_engine)
+    updater.join(10)
+    db = TestingSessionLocal()
+    job = db.get(EnrichmentJob, job_id)
+    db.close()
+    return job
+
+
+def amazon_ids():
+    db = TestingSessionLocal()
+    ids = {book.title: book.amazon_id for book in db.query(Book).filter(Book.isbn.like("AMZ%"))}
+    db.close()
+    return ids
+
+
+def test_extract_asin():
+    assert extract_asin({"docs": [{"identifier": {"amazon": ["B000"]}}]}) == "B000"
+    assert extract_asin({"docs": [{}, {"id_amazon": ["B001"]}]}) == "B001"
+    assert extract_asin({"docs": []}) is None
+
+
+def test_enrichment_updates_books_and_caches_results(stub_url):
+    reset()
+    job = run_job(stub_url)
+
+    assert job.status == "done"
+    assert amazon_ids() == {"Known 1": "ASIN-1", "Known 2": "ASIN-2", "Unknown 3": None, "Flaky 4": "ASIN-4"}
+    assert StubOpenLibrary.requests["Flaky 4"] == 2  # retried after the 503
+
+    db = TestingSessionLocal()
+    negative = db.get(AsinCache, ("Unknown 3", "Author K"))
+    assert negative is not None and negative.asin is None
+
+
+def test_negative_results_served_from_cache(stub_url):
+    reset()
+    run_job(stub_url)
+    StubOpenLibrary.requests.clear()
+
+    job = run_job(stub_url)
+    assert job.status == "done"
+    assert StubOpenLibrary.requests["Unknown 3"] == 0
+    assert job.cache_hits >= 1
+
+
+def test_job_resumes_after_checkpoint(stub_url):
+    reset()
+    db = TestingSessionLocal()
+    known_2 = db.query(Book).filter_by(isbn="AMZ2").one()
+    # A previous run got as far as "Known 2" before stopping
+    db.add(EnrichmentJob(status="running", last_book_id=known_2.id))
+    db.commit()
+    db.close()
+
+    job = run_job(stub_url)
+    assert job.status == "done"
+    assert StubOpenLibrary.requests["Known 1"] == 0
+    assert amazon_ids()["Known 1"] is None
+    assert amazon_ids()["Flaky 4"] == "ASIN-4"
+
+
+def test_update_amazon_ids_endpoint(test_client, stub_url, monkeypatch):
+    reset()
+    monkeypatch.setattr(main.amazon_id_updater, "settings", settings(stub_url))
+
+    response = test_client.post("/books/amazon-ids/update")
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    main.amazon_id_updater.join(10)
+
+    status = test_client.get(f"/books/amazon-ids/jobs/{job_id}").json()
+    assert status["status"] == "done"
+    assert status["updated"] == 3
+    assert test_client.get("/books/amazon-ids/jobs/9999").status_code == 404
+
+
+def test_token_bucket_limits_rate():
+    async def take(n):
+        bucket = TokenBucket(rate=50, capacity=1)
+        start = time.perf_counter()
+        for _ in range(n):
+            await bucket.acquire()
+        return time.perf_counter() - start
+
+    assert asyncio.run(take(6)) >= 0.09
@@ -0,0 +1,103 @@
+import json
+import pytest
+from datetime import datetime
+from audit_log import AuditLogWriter
+
+
+def format_line(record):
+    return f"{record['message']}\n"
+
+
+@pytest.fixture
+def writer_factory(tmp_path):
+    writers = []
+
+    def make(**kwargs):
+        writer = AuditLogWriter(**kwargs)
+        writer.register("test", str(tmp_path / "test_log.txt"), format_line)
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.close()
+
+
+def test_writes_are_batched_until_flush(writer_factory, tmp_path):
+    writer = writer_factory(flush_interval=60, batch_size=100)
+    writer.write("test", {"message": "first"})
+    writer.write("test", {"message": "second"})
+
+    log_path = tmp_path / "test_log.txt"
+    writer.flush()
+    assert log_path.read_text() == "first\nsecond\n"
+
+def test_full_batch_is_flushed_without_waiting(writer_factory, tmp_path):
+    writer = writer_factory(flush_interval=60, batch_size=2, fsync="batch")
+    writer.write("test", {"message": "a"})
+    writer.write("test", {"message": "b"})
+    writer.close()
+    assert (tmp_path / "test_log.txt").read_text() == "a\nb\n"
+
+def test_jsonl_format_alongside_text(writer_factory, tmp_path):
+    writer = writer_factory(formats=("text", "jsonl"))
+    writer.write("test", {"message": "hello", "timestamp": datetime(2025, 6, 17, 13, 20)})
+    writer.flush()
+
+    assert (tmp_path / "test_log.txt").read_text() == "hello\n"
+    record = json.loads((tmp_path / "test_log.jsonl").read_text())
+    assert record == {"channel": "test", "message": "hello", "timestamp": "2025-06-17T13:20:00"}
+
+def test_size_based_rotation(writer_factory, tmp_path):
+    writer = writer_factory(max_bytes=10, backup_count=2, batch_size=1)
+    for message in ["aaaaaaa", "bbbbbbb", "ccccccc", "ddddddd"]:
+        writer.write("test", {"message": message})
+    writer.flush()
+
+    assert (tmp_path / "test_log.txt").read_text() == "ddddddd\n"
+    assert (tmp_path / "test_log.txt.1").read_text() == "ccccccc\n"
+    assert (tmp_path / "test_log.txt.2").read_text() == "bbbbbbb\n"
+    assert not (tmp_path / "test_log.txt.3").exists()
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        AuditLogWriter(fsync="sometimes")
+    with pytest.raises(ValueError):
+        AuditLogWriter(formats=("xml",))
+
+def test_unknown_channel(writer_factory):
+    writer = writer_factory()
+    with pytest.raises(KeyError):
+        writer.write("missing", {"message": "x"})
+
+def test_write_many_queues_records_in_order(writer_factory, tmp_path):
+    writer = writer_factory(flush_interval=60, batch_size=100)
+    writer.write("test", {"message": "single"})
+    writer.write_many("test", [{"message": "batch 1"}, {"message": "batch 2"}])
+    writer.write_many("test", [])
+    writer.flush()
+    assert (tmp_path / "test_log.txt").read_text() == "single\nbatch 1\nbatch 2\n"
+
+class FailingHandle:
+    def write(self, data):
+        raise OSError("disk full")
+
+    def close(self):
+        pass
+
+def test_failed_write_is_retried(writer_factory, tmp_path):
+    writer = writer_factory(flush_interval=60, batch_size=100)
+    writer.write("test", {"message": "a"})
+    writer.flush()
+    log_file = next(iter(writer._files.values()))
+    log_file.handle.close()
+    log_file.handle = FailingHandle()
+
+    writer.write("test", {"message": "b"})
+    writer.flush()
+    assert log_file.pending == ["b\n"]
+
+    writer.write("test", {"message": "c"})
+    writer.flush()
+    assert (tmp_path / "test_log.txt").read_text() == "a\nb\nc\n"
+    assert log_file.pending == []
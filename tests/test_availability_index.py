@@ -0,0 +1,145 @@
+import pytest
+from availability_index import AvailabilityIndex
+from models import Book, User
+from main import availability_index
+from conftest import TestingSessionLocal, test_engine
+
+
+@pytest.fixture(scope="module")
+def shelf():
+    db = TestingSessionLocal()
+    books = [
+        Book(title=f"Shelf Volume {i}", authors="Author Shelf", available=i % 2 == 0, isbn=f"SHELF{i}")
+        for i in range(6)
+    ]
+    db.add_all(books)
+    db.commit()
+    ids = [book.id for book in books]
+    db.close()
+    return ids
+
+
+@pytest.fixture
+def loaded_index():
+    availability_index.load(test_engine)
+    yield availability_index
+    availability_index.clear()
+
+
+def database_counts():
+    db = TestingSessionLocal()
+    total = db.query(Book).count()
+    available = db.query(Book).filter(Book.available.is_(True)).count()
+    db.close()
+    return total, available
+
+
+def test_load_and_set(shelf):
+    index = AvailabilityIndex()
+    index.set([shelf[0]], False)
+    assert index.get(shelf[0]) is None
+
+    index.load(test_engine)
+    assert (index.total, index.available_count) == database_counts()
+    assert [index.get(book_id) for book_id in shelf] == [True, False, True, False, True, False]
+    assert index.get(10 ** 6) is None
+    assert index.get(10 ** 6, default=True) is True
+
+    available = index.available_count
+    index.set([shelf[0], shelf[1]], False)
+    assert index.available_count == available - 1
+    index.set([shelf[0], shelf[1]], True)
+    assert index.available_count == available + 1
+
+    # a book created after the load joins on its first change
+    index.set([10 ** 6], True)
+    assert index.get(10 ** 6) is True
+    assert index.total == database_counts()[0] + 1
+
+def test_stale_index_is_reloaded(shelf):
+    now = [0.0]
+    index = AvailabilityIndex(max_age=30, clock=lambda: now[0])
+    index.load(test_engine)
+    total = index.total
+
+    # Another process adds a book behind the index's back
+    db = TestingSessionLocal()
+    db.add(Book(title="Shelf Outsider", authors="Author Shelf", available=True, isbn="SHELFX"))
+    db.commit()
+    db.close()
+
+    assert not index.refresh_if_stale(test_engine)
+    assert index.total == total
+    now[0] = 30
+    assert index.refresh_if_stale(test_engine)
+    assert index.total == total + 1
+    assert not index.stale
+
+def test_stale_index_is_reloaded_in_the_background(shelf):
+    now = [0.0]
+    index = AvailabilityIndex(max_age=30, clock=lambda: now[0])
+    index.load(test_engine)
+    index.set([10 ** 6], True)
+    assert not index.refresh_in_background(test_engine)
+
+    now[0] = 30
+    index._reloading.acquire()
+    try:
+        # A reload is already running: the caller doesn't wait or start another
+        assert not index.refresh_in_background(test_engine)
+        assert index.get(10 ** 6) is True
+    finally:
+        index._reloading.release()
+    assert index.refresh_in_background(test_engine)
+    index._reload_thread.join()
+    assert index.get(10 ** 6) is None
+    assert not index.stale
+
+def test_count_falls_back_to_database_until_loaded(test_client, shelf):
+    total, available = database_counts()
+    assert test_client.get("/books/available/count").json() == {
+        "available": available, "unavailable": total - available, "total": total
+    }
+
+def test_count_from_index_without_sql(test_client, shelf, loaded_index, count_queries):
+    total, available = database_counts()
+    with count_queries() as statements:
+        response = test_client.get("/books/available/count")
+    assert response.json() == {"available": available, "unavailable": total - available, "total": total}
+    assert statements == []
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_search_filtered_by_availability(test_client, shelf, use_index):
+    if use_index:
+        availability_index.load(test_engine)
+    try:
+        available = test_client.get("/books/search", params={"query": "shelf volume", "available": "true"})
+        rented = test_client.get("/books/search", params={"query": "shelf volume", "available": "false"})
+        page = test_client.get("/books/search", params={"query": "shelf volume", "available": "false", "limit": 2})
+        rest = test_client.get(
+            "/books/search",
+            params={"query": "shelf volume", "available": "false", "limit": 2, "after_id": page.headers["X-Next-After-Id"]},
+        )
+        streamed = test_client.get("/books/search", params={"query": "shelf volume", "available": "true", "format": "ndjson"})
+    finally:
+        availability_index.clear()
+
+    assert sorted(book["id"] for book in available.json()) == shelf[0::2]
+    assert sorted(book["id"] for book in rented.json()) == shelf[1::2]
+    assert [book["id"] for book in page.json() + rest.json()] == shelf[1::2]
+    assert len(streamed.text.splitlines()) == 3
+
+def test_index_follows_rentals_and_returns(test_client, shelf, loaded_index):
+    user_id = TestingSessionLocal().query(User).filter_by(username="testuser").first().id
+    before = loaded_index.available_count
+
+    rental = test_client.post("/rentals", json={"book_id": shelf[4], "user_id": user_id}).json()
+    assert loaded_index.get(shelf[4]) is False
+    assert loaded_index.available_count == before - 1
+    assert shelf[4] not in [
+        book["id"] for book in test_client.get("/books/search", params={"query": "shelf", "available": "true"}).json()
+    ]
+
+    test_client.patch(f"/rentals/{rental['id']}/return")
+    assert loaded_index.get(shelf[4]) is True
+    assert loaded_index.available_count == before
@@ -0,0 +1,47 @@
+from collections import Counter
+from sqlalchemy import func, select
+from database import create_db_engine
+from models import Book, User, Rental, Wishlist
+from benchmarks.seed import catalog_counts, seed_catalog
+from benchmarks.scenarios import Workload
+from benchmarks.contention import run_contention
+from benchmarks.micro import run_micro
+from benchmarks.stats import percentile, summarize
+
+
+def test_percentiles():
+    ordered = [i / 1000 for i in range(1, 101)]
+    assert percentile(ordered, 50) == 0.05
+    assert percentile(ordered, 99) == 0.099
+    summary = summarize(ordered, 2.0, Counter({200: 99, 404: 1}))
+    assert summary["requests_per_second"] == 50.0
+    assert (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"]) == (50.0, 95.0, 99.0)
+    assert summary["statuses"] == {"200": 99, "404": 1}
+
+def test_seed_and_micro_benchmarks(tmp_path):
+    path = tmp_path / "catalog.db"
+    engine = create_db_engine(f"sqlite:///{path}", profile="test")
+    counts = seed_catalog(engine, 500)
+    with engine.connect() as connection:
+        def count(model):
+            return connection.execute(select(func.count()).select_from(model)).scalar()
+        assert (count(Book), count(User), count(Rental), count(Wishlist)) == (500, 10, 50, 100)
+        open_rentals = connection.execute(
+            select(func.count()).select_from(Rental).where(Rental.return_date.is_(None))
+        ).scalar()
+        unavailable = connection.execute(
+            select(func.count()).select_from(Book).where(Book.available.is_(False))
+        ).scalar()
+    assert open_rentals == unavailable == counts["rentals"] // 2
+    engine.dispose()
+
+    names = ["search", "search_sync", "rent", "return"]
+    results = run_micro(str(path), Workload(500, counts["users"]), names, requests=5, warmup=1, concurrency=2)
+    assert set(results) == set(names)
+    assert results["search"]["statuses"] == results["search_sync"]["statuses"] == {"200": 5}
+    assert results["search"]["p99_ms"] >= results["search"]["p50_ms"] > 0
+
+    contention = run_contention(str(path), threads=4, attempts=40)["claim_copy"]
+    assert contention["requests"] == 40
+    assert sum(contention["statuses"].values()) == 40
+    assert contention["statuses"]["claimed"] > 0
@@ -1,7 +1,9 @@
+import json
 import pytest
 from models import User, Book, Rental
 from datetime import datetime, timedelta
 from conftest import TestingSessionLocal
+from pagination import iter_keyset
 
 def test_patch_book_availability_success(test_client):
     db = TestingSessionLocal()
@@ -77,4 +79,47 @@ def test_delete_book_currently_rented():
     # Cleanup
     db.query(Rental).delete()
     db.query(Book).filter(Book.isbn == "DEL456").delete()
-    db.commit()
\ No newline at end of file
+    db.commit()
+
+def test_get_books_keyset_pagination(test_client):
+    db = TestingSessionLocal()
+    db.add_all([Book(title=f"Paged Book {i}", authors="Author P", isbn=f"PAGE{i}") for i in range(5)])
+    db.commit()
+    all_ids = [book.id for book in db.query(Book).order_by(Book.id)]
+
+    seen = []
+    after_id = None
+    while True:
+        params = {"limit": 2}
+        if after_id is not None:
+            params["after_id"] = after_id
+        response = test_client.get("/books", params=params)
+        assert response.status_code == 200
+        seen += [book["id"] for book in response.json()]
+        after_id = response.headers.get("X-Next-After-Id")
+        if after_id is None:
+            break
+
+    assert seen == all_ids
+
+def test_get_books_limit_out_of_range(test_client):
+    response = test_client.get("/books", params={"limit": 0})
+    assert response.status_code == 422
+
+def test_get_books_ndjson_stream(test_client):
+    db = TestingSessionLocal()
+    expected = [book.id for book in db.query(Book).order_by(Book.id)]
+
+    response = test_client.get("/books", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == expected
+    assert set(rows[0]) == {"id", "title", "authors", "available", "available_copies"}
+
+def test_iter_keyset_chunks_cover_all_rows():
+    db = TestingSessionLocal()
+    expected = [book.id for book in db.query(Book).order_by(Book.id)]
+    chunks = list(iter_keyset(db.query(Book), Book.id, chunk_size=2))
+    assert all(len(chunk) <= 2 for chunk in chunks)
+    assert [book.id for chunk in chunks for book in chunk] == expected
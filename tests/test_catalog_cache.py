@@ -0,0 +1,128 @@
+import pytest
+from catalog_cache import CatalogCache
+from models import Book, User
+from main import catalog_cache
+from conftest import TestingSessionLocal
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def row(book_id, available=True):
+    return {"id": book_id, "title": f"Book {book_id}", "authors": "Author", "available": available}
+
+
+def test_hit_after_put_and_miss_after_ttl():
+    clock = FakeClock()
+    cache = CatalogCache(ttl=10, clock=clock)
+    assert cache.get("k") is None
+    cache.put("k", [row(1), row(2)], 2, cache.generation)
+    assert cache.get("k") == ([row(1), row(2)], 2)
+
+    clock.now = 11
+    assert cache.get("k") is None
+    assert (cache.stats().hits, cache.stats().misses) == (1, 2)
+
+def test_least_recently_used_result_is_evicted():
+    cache = CatalogCache(max_results=2)
+    for key in ("a", "b"):
+        cache.put(key, [row(1)], None, cache.generation)
+    cache.get("a")
+    cache.put("c", [row(2)], None, cache.generation)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+def test_evicted_row_makes_its_results_miss():
+    cache = CatalogCache(max_rows=2)
+    cache.put("a", [row(1), row(2)], None, cache.generation)
+    cache.put("b", [row(3)], None, cache.generation)
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+
+def test_availability_is_written_through_to_shared_rows():
+    cache = CatalogCache()
+    cache.put("a", [row(1), row(2)], None, cache.generation)
+    cache.put("b", [row(2)], None, cache.generation)
+    cache.set_availability([2], False)
+    assert cache.get("a")[0] == [row(1), row(2, available=False)]
+    assert cache.get("b")[0] == [row(2, available=False)]
+
+def test_result_read_before_a_write_is_stored_with_the_written_value():
+    cache = CatalogCache()
+    generation = cache.generation
+    # the database read happened here, then the book was rented...
+    cache.set_availability([1], False)
+    # ...and only then the stale read is stored
+    cache.put("a", [row(1, available=True)], None, generation)
+    assert cache.get("a")[0] == [row(1, available=False)]
+
+    # a read that started after the write is trusted as is
+    cache.put("b", [row(1, available=True)], None, cache.generation)
+    assert cache.get("b")[0] == [row(1, available=True)]
+
+def test_invalidate_drops_entries_and_reads_in_flight():
+    cache = CatalogCache()
+    cache.put("a", [row(1)], None, cache.generation)
+    generation = cache.generation
+    cache.invalidate()
+    assert cache.get("a") is None
+    cache.put("b", [row(1)], None, generation)
+    assert cache.get("b") is None
+
+def test_disabled_cache_stores_nothing():
+    cache = CatalogCache(enabled=False)
+    cache.put("a", [row(1)], None, cache.generation)
+    assert cache.get("a") is None
+    assert cache.stats().misses == 0
+
+
+@pytest.fixture
+def app_cache():
+    catalog_cache.invalidate()
+    catalog_cache.hits = catalog_cache.misses = 0
+    catalog_cache.enabled = True
+    yield catalog_cache
+    catalog_cache.enabled = False
+    catalog_cache.invalidate()
+
+
+def test_search_is_served_from_cache_and_never_stale(test_client, app_cache, count_queries):
+    db = TestingSessionLocal()
+    user = db.query(User).filter_by(username="testuser").first()
+    book = Book(title="Cached Catalog Volume", authors="Author Cache", available=True, isbn="CACHE1")
+    db.add(book)
+    db.commit()
+
+    first = test_client.get("/books/search", params={"query": "cached catalog"})
+    assert [b["available"] for b in first.json()] == [True]
+    with count_queries() as statements:
+        second = test_client.get("/books/search", params={"query": "cached catalog"})
+    assert second.json() == first.json()
+    assert statements == []
+
+    rental = test_client.post("/rentals", json={"book_id": book.id, "user_id": user.id})
+    assert rental.status_code == 200
+    with count_queries() as statements:
+        after_rental = test_client.get("/books/search", params={"query": "cached catalog"})
+    assert [b["available"] for b in after_rental.json()] == [False]
+    assert statements == []
+
+    test_client.patch(f"/rentals/{rental.json()['id']}/return")
+    assert test_client.get("/books/search", params={"query": "cached catalog"}).json()[0]["available"] is True
+
+    stats = test_client.get("/admin/catalog-cache").json()
+    assert stats["enabled"] is True
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+
+def test_book_pages_keep_their_cursor(test_client, app_cache):
+    first = test_client.get("/books", params={"limit": 2})
+    cached = test_client.get("/books", params={"limit": 2})
+    assert cached.json() == first.json()
+    assert cached.headers["X-Next-After-Id"] == first.headers["X-Next-After-Id"]
+    assert app_cache.stats().hits == 1
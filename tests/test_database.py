@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import pytest
+from sqlalchemy import text
+from sqlalchemy.pool import StaticPool
+from database import create_db_engine, create_async_db_engine
+
+
+def pragma(engine, name):
+    with engine.connect() as connection:
+        return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_production_profile_enables_wal(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'prod.db'}", profile="production")
+    assert pragma(engine, "journal_mode") == "wal"
+    assert pragma(engine, "synchronous") == 1  # NORMAL
+    assert pragma(engine, "busy_timeout") == 30000
+    assert pragma(engine, "cache_size") == -64000
+    engine.dispose()
+
+def test_in_memory_engine_shares_one_connection():
+    engine = create_db_engine("sqlite://", profile="test")
+    assert isinstance(engine.pool, StaticPool)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (x INTEGER)"))
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM t")).scalar() == 0
+
+def test_async_engine_rejects_in_memory_database():
+    for url in ("sqlite://", "sqlite:///:memory:"):
+        with pytest.raises(ValueError):
+            create_async_db_engine(url, profile="test")
+
+def test_in_memory_database_is_usable_without_async_engine():
+    script = (
+        "import pytest, database, main\n"
+        "with database.engine.connect() as connection: connection.exec_driver_sql('SELECT 1')\n"
+        "with pytest.raises(ValueError): database.get_async_sessions()\n"
+    )
+    env = {**os.environ, "DATABASE_URL": "sqlite://"}
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def test_pool_size_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pool.db'}", profile="default")
+    assert engine.pool.size() == 3
+    engine.dispose()
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        create_db_engine("sqlite://", profile="turbo")
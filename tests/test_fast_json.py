@@ -0,0 +1,24 @@
+import json
+from datetime import datetime
+import fast_json
+
+
+ROWS = [{"id": 1, "title": "Café", "authors": None, "available": True, "at": datetime(2024, 5, 1, 12, 30)}]
+
+
+def test_dumps_with_and_without_orjson(monkeypatch):
+    fast = json.loads(fast_json.dumps(ROWS))
+    monkeypatch.setattr(fast_json, "orjson", None)
+    fallback = json.loads(fast_json.dumps(ROWS))
+    assert fast == fallback
+    assert fast[0]["title"] == "Café"
+    assert fast[0]["at"] == "2024-05-01T12:30:00"
+
+def test_listings_match_their_response_models(test_client):
+    books = test_client.get("/books", params={"limit": 5})
+    assert books.headers["content-type"] == "application/json"
+    assert set(books.json()[0]) == {"id", "title", "authors", "available", "available_copies"}
+
+    schema = test_client.get("/openapi.json").json()
+    listing = schema["paths"]["/books"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert listing["items"]["$ref"].endswith("/BookOut")
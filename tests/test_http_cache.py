@@ -0,0 +1,137 @@
+import pytest
+from http_cache import VersionStamps, is_not_modified
+from models import Book, User
+from main import version_stamps
+from conftest import TestingSessionLocal
+
+
+# Stamps that don't renew while a test revalidates
+@pytest.fixture(scope="module", autouse=True)
+def lasting_stamps():
+    max_age, version_stamps.max_age = version_stamps.max_age, 0
+    yield
+    version_stamps.max_age = max_age
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stamps_change_with_their_data_only():
+    clock = FakeClock()
+    stamps = VersionStamps(clock=clock)
+    catalog, alice, bob = stamps.catalog(), stamps.wishlist(1), stamps.wishlist(2)
+    assert stamps.catalog() == catalog
+
+    stamps.wishlist_changed(1)
+    assert stamps.wishlist(1).etag != alice.etag
+    assert (stamps.wishlist(2).etag, stamps.catalog().etag) == (bob.etag, catalog.etag)
+
+    stamps.catalog_changed()
+    assert stamps.catalog().etag != catalog.etag
+    assert stamps.wishlist(2).etag == bob.etag
+
+    stamps.invalidate()
+    assert stamps.wishlist(2).etag != bob.etag
+
+
+def test_stamps_are_renewed_after_max_age():
+    clock = FakeClock()
+    stamps = VersionStamps(max_age=30, clock=clock)
+    catalog = stamps.catalog()
+    clock.now += 29
+    assert stamps.catalog().etag == catalog.etag
+    clock.now += 1
+    assert stamps.catalog().etag != catalog.etag
+    assert VersionStamps(max_age=30).catalog().etag != catalog.etag
+
+
+def test_conditional_headers():
+    clock = FakeClock()
+    stamps = VersionStamps(clock=clock)
+    stamps.catalog_changed()
+    # No Last-Modified in the second of the change
+    assert stamps.catalog().last_modified is None
+    clock.now += 1
+    stamp = stamps.catalog()
+
+    assert is_not_modified({"if-none-match": stamp.etag}, stamp)
+    assert is_not_modified({"if-none-match": f'"other", {stamp.etag.removeprefix("W/")}'}, stamp)
+    assert is_not_modified({"if-none-match": "*"}, stamp)
+    assert not is_not_modified({"if-none-match": '"other"', "if-modified-since": stamp.last_modified}, stamp)
+    assert is_not_modified({"if-modified-since": stamp.last_modified}, stamp)
+    assert not is_not_modified({"if-modified-since": "Thu, 01 Jan 1970 00:00:00 GMT"}, stamp)
+    assert not is_not_modified({"if-modified-since": "yesterday"}, stamp)
+    assert not is_not_modified({}, stamp)
+
+
+def test_unchanged_catalog_is_not_sent_again(test_client, count_queries):
+    first = test_client.get("/books", params={"limit": 5})
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "public, no-cache"
+
+    with count_queries() as statements:
+        again = test_client.get("/books", params={"limit": 5}, headers={"If-None-Match": etag})
+        search = test_client.get("/books/search", params={"query": "test"}, headers={"If-None-Match": etag})
+    assert (again.status_code, again.content, again.headers["ETag"]) == (304, b"", etag)
+    assert search.status_code == 304
+    assert statements == []
+
+    # A rental changes what the listing shows
+    db = TestingSessionLocal()
+    user = User(username="etag_reader")
+    book = Book(title="Conditional Book", authors="Author E", available=True, isbn="ETAG1")
+    db.add_all([user, book])
+    db.commit()
+    rental = test_client.post("/rentals", json={"book_id": book.id, "user_id": user.id}).json()
+    changed = test_client.get("/books", params={"limit": 5}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+    test_client.patch(f"/rentals/{rental['id']}/return")
+    assert test_client.get("/books", headers={"If-None-Match": changed.headers["ETag"]}).status_code == 200
+    db.close()
+
+
+def test_wishlist_versions_are_per_user(test_client):
+    db = TestingSessionLocal()
+    users = [User(username=f"etag_wisher{i}") for i in range(2)]
+    db.add_all(users)
+    db.commit()
+    first, second = (user.id for user in users)
+    db.close()
+
+    etags = {user_id: test_client.get(f"/wishlist/{user_id}").headers["ETag"] for user_id in (first, second)}
+    assert test_client.get(f"/wishlist/{first}").headers["Cache-Control"] == "private, no-cache"
+    test_client.post(f"/wishlist/{first}/1")
+
+    changed = test_client.get(f"/wishlist/{first}", headers={"If-None-Match": etags[first]})
+    assert changed.status_code == 200
+    assert [item["book_id"] for item in changed.json()] == [1]
+    assert test_client.get(f"/wishlist/{second}", headers={"If-None-Match": etags[second]}).status_code == 304
+
+    test_client.delete(f"/wishlist/{first}/1")
+    assert test_client.get(f"/wishlist/{first}", headers={"If-None-Match": changed.headers["ETag"]}).status_code == 200
+
+
+def test_large_listings_are_compressed(test_client):
+    db = TestingSessionLocal()
+    db.add_all([Book(title=f"Compressed Book {i}", authors="Author Z", available=True, isbn=f"GZIP{i}") for i in range(50)])
+    db.commit()
+    db.close()
+
+    response = test_client.get("/books", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) < len(response.content)
+
+    plain = test_client.get("/books", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.json() == response.json()
+
+    small = test_client.get("/books/available/count", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
@@ -0,0 +1,216 @@
+import asyncio
+import io
+from collections import Counter
+import httpx
+import pytest
+import inventory
+from catalog_import import import_books
+from database import create_db_engine
+from inventory import backfill_copies, claim_copy
+from main import app, audit_log
+from models import Base, User, Book, BookCopy, Rental, NotificationOutbox
+from sqlalchemy.orm import Session
+from conftest import TestingSessionLocal, async_test_engine, test_engine
+
+
+@pytest.fixture(scope="module")
+def shelf():
+    db = TestingSessionLocal()
+    users = [User(username=f"copy_reader{i}") for i in range(4)]
+    book = Book(title="Many Copies", authors="Author M", available=True, isbn="COPIES1")
+    db.add_all(users + [book])
+    db.commit()
+    ids = [user.id for user in users], book.id
+    db.close()
+    return ids
+
+
+def test_new_books_get_one_copy():
+    db = TestingSessionLocal()
+    on_shelf = Book(title="Single Copy", authors="Author S", available=True, isbn="COPIES2")
+    off_shelf = Book(title="Lent Out", authors="Author S", available=False, isbn="COPIES3")
+    db.add_all([on_shelf, off_shelf])
+    db.commit()
+    db.expire_all()
+
+    for book, available in ((on_shelf, True), (off_shelf, False)):
+        copies = db.query(BookCopy).filter_by(book_id=book.id).all()
+        assert [copy.available for copy in copies] == [available]
+        assert (book.copies, book.available_copies, book.available) == (1, int(available), available)
+    db.close()
+
+
+def test_each_rental_takes_its_own_copy(test_client, shelf):
+    user_ids, book_id = shelf
+    response = test_client.post(f"/books/{book_id}/copies", params={"count": 2})
+    assert response.json() == {"book_id": book_id, "copies": 3, "available_copies": 3}
+
+    rentals = [test_client.post("/rentals", json={"book_id": book_id, "user_id": user_id}) for user_id in user_ids]
+    assert [rental.status_code for rental in rentals] == [200, 200, 200, 400]
+    assert len({rental.json()["copy_id"] for rental in rentals[:3]}) == 3
+
+    db = TestingSessionLocal()
+    book = db.get(Book, book_id)
+    assert (book.available_copies, book.available) == (0, False)
+    listed = [row for row in test_client.get("/books").json() if row["id"] == book_id]
+    assert listed == [{"id": book_id, "title": "Many Copies", "authors": "Author M",
+                       "available": False, "available_copies": 0}]
+
+    # Only the first copy back makes the book available and notifies
+    db.query(NotificationOutbox).delete()
+    db.commit()
+    for rental in rentals[:2]:
+        assert test_client.patch(f"/rentals/{rental.json()['id']}/return").status_code == 200
+    db.expire_all()
+    assert db.get(Book, book_id).available_copies == 2
+    assert db.query(NotificationOutbox).filter_by(book_id=book_id).count() == 1
+
+    test_client.patch(f"/rentals/{rentals[2].json()['id']}/return")
+    db.expire_all()
+    assert db.query(BookCopy).filter_by(book_id=book_id, available=True).count() == 3
+    db.close()
+
+
+def test_availability_switch_keeps_rented_copies_out(test_client, shelf):
+    user_ids, book_id = shelf
+    rental = test_client.post("/rentals", json={"book_id": book_id, "user_id": user_ids[0]}).json()
+
+    test_client.patch(f"/books/{book_id}/availability", json={"available": False})
+    db = TestingSessionLocal()
+    assert db.get(Book, book_id).available_copies == 0
+
+    test_client.patch(f"/books/{book_id}/availability", json={"available": True})
+    db.expire_all()
+    assert db.get(Book, book_id).available_copies == 2
+    assert db.get(BookCopy, rental["copy_id"]).available is False
+    test_client.patch(f"/rentals/{rental['id']}/return")
+    db.close()
+
+
+def test_direct_availability_writes_move_copies(test_client):
+    db = TestingSessionLocal()
+    book = Book(title="Legacy Writer", authors="Author L", available=True, isbn="COPIES4")
+    db.add(book)
+    db.commit()
+
+    book.available = False
+    db.commit()
+    db.expire_all()
+    assert book.available_copies == 0
+    assert db.query(BookCopy).filter_by(book_id=book.id, available=True).count() == 0
+
+    # A rental recorded without a copy returns one that nobody holds
+    user = db.query(User).filter_by(username="testuser").first()
+    rental = Rental(book_id=book.id, user_id=user.id)
+    db.add(rental)
+    db.commit()
+    assert test_client.patch(f"/rentals/{rental.id}/return").status_code == 200
+    db.expire_all()
+    assert (book.available_copies, book.available) == (1, True)
+    db.close()
+
+
+def test_concurrent_rentals_share_out_the_copies(test_client):
+    db = TestingSessionLocal()
+    users = [User(username=f"copy_racer{i}") for i in range(16)]
+    book = Book(title="Contended Copies", authors="Author R", available=True, isbn="COPIES5")
+    db.add_all(users + [book])
+    db.commit()
+    user_ids, book_id = [user.id for user in users], book.id
+    db.close()
+    test_client.post(f"/books/{book_id}/copies", params={"count": 4})
+
+    async def race():
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await asyncio.gather(*(
+                    client.post("/rentals", json={"book_id": book_id, "user_id": user_ids[i % len(user_ids)]})
+                    for i in range(200)
+                ))
+        finally:
+            # The pool's connections belong to this event loop
+            await async_test_engine.dispose()
+
+    responses = asyncio.run(race())
+    assert Counter(response.status_code for response in responses) == {200: 5, 400: 195}
+    assert len({response.json()["copy_id"] for response in responses if response.status_code == 200}) == 5
+
+    db = TestingSessionLocal()
+    assert db.get(Book, book_id).available_copies == 0
+    assert db.query(BookCopy).filter_by(book_id=book_id, available=True).count() == 0
+    db.close()
+
+
+def test_every_rental_is_logged_while_copies_remain(test_client, shelf, monkeypatch):
+    records = []
+    monkeypatch.setattr(audit_log, "write", lambda log, record: records.append((log, record)))
+    user_ids, book_id = shelf
+
+    rental = test_client.post("/rentals", json={"book_id": book_id, "user_id": user_ids[0]}).json()
+    test_client.patch(f"/rentals/{rental['id']}/return")
+    availability = [(record["old_status"], record["new_status"], record["source"])
+                    for log, record in records if log == "availability"]
+    assert availability == [(True, True, "POST /rentals"), (True, True, f"PATCH /rentals/{rental['id']}/return")]
+
+
+# Rentals from before copies existed, on a book with three copies of which
+# two are off the shelf
+def legacy_rentals(count: int):
+    db = TestingSessionLocal()
+    user = User(username=f"legacy_reader{db.query(User).count()}")
+    book = Book(title="Legacy Copies", authors="Author L", available=True, isbn=f"LEGACY{db.query(Book).count()}")
+    db.add_all([user, book])
+    db.commit()
+    db.add_all([BookCopy(book_id=book.id, available=False) for _ in range(count)])
+    db.add_all([Rental(book_id=book.id, user_id=user.id) for _ in range(count)])
+    book.copies += count
+    db.commit()
+    ids = book.id, [rental.id for rental in db.query(Rental).filter_by(book_id=book.id)]
+    db.close()
+    return ids
+
+
+def test_rentals_without_a_copy_return_one_copy_each(test_client):
+    book_id, rental_ids = legacy_rentals(2)
+    response = test_client.post("/rentals/returns/batch", json={"rental_ids": rental_ids})
+    assert response.json()["succeeded"] == 2
+
+    db = TestingSessionLocal()
+    assert db.get(Book, book_id).available_copies == 3
+    assert db.query(BookCopy).filter_by(book_id=book_id, available=True).count() == 3
+    db.close()
+
+
+def test_backfill_gives_open_rentals_their_own_copy():
+    book_id, rental_ids = legacy_rentals(2)
+    with test_engine.begin() as connection:
+        backfill_copies(connection)
+
+    db = TestingSessionLocal()
+    copy_ids = [db.get(Rental, rental_id).copy_id for rental_id in rental_ids]
+    off_shelf = {copy.id for copy in db.query(BookCopy).filter_by(book_id=book_id, available=False)}
+    assert sorted(copy_ids) == sorted(off_shelf)
+    assert len(set(copy_ids)) == 2
+    db.close()
+
+
+# As on databases without the inventory triggers, e.g. PostgreSQL
+def test_new_books_get_a_copy_without_triggers(tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory, "TRIGGER_DIALECTS", ())
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'no_triggers.db'}", profile="test")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add(Book(id=1, title="Added", authors="Author N", available=True, isbn="NOTRIG1"))
+        db.commit()
+    csv_text = "Id,ISBN,Authors,Publication Year,Title,Language\n2,NOTRIG2,Author N,2001,Imported,eng\n"
+    for _ in range(2):
+        import_books(engine, io.StringIO(csv_text))
+
+    with Session(engine) as db:
+        assert [(copy.book_id, copy.available) for copy in db.query(BookCopy).order_by(BookCopy.book_id)] == \
+            [(1, True), (2, True)]
+        assert all(claim_copy(db, book_id) is not None for book_id in (1, 2))
+        db.commit()
+        assert [book.available_copies for book in db.query(Book).order_by(Book.id)] == [0, 0]
+    engine.dispose()
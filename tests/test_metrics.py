@@ -0,0 +1,75 @@
+import logging
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from metrics import Counter, Gauge, Histogram, MetricsMiddleware, Registry, REQUEST_DB_STATEMENTS
+from conftest import TestingSessionLocal
+
+
+def test_metrics_endpoint_reports_request_by_route(test_client):
+    before = REQUEST_DB_STATEMENTS.count("/wishlist/{user_id}")
+    response = test_client.get("/wishlist/1")
+    assert response.status_code == 200
+    assert REQUEST_DB_STATEMENTS.count("/wishlist/{user_id}") == before + 1
+
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    # Labelled by route template, not by the concrete path
+    assert 'http_request_duration_seconds_count{method="GET",route="/wishlist/{user_id}",status="200"}' in body
+    assert 'route="/wishlist/1"' not in body
+    assert 'http_request_db_statements_bucket{route="/wishlist/{user_id}",le="+Inf"}' in body
+    assert "# TYPE audit_log_queue_depth gauge" in body
+    assert "# TYPE catalog_cache_hits_total counter" in body
+    assert "catalog_cache_misses_total " in body
+
+
+def test_unmatched_paths_share_one_series(test_client):
+    test_client.get("/no/such/path/123")
+    assert 'route="unmatched",status="404"' in test_client.get("/metrics").text
+
+
+def test_render_format():
+    registry = Registry()
+    counter = registry.register(Counter("things_total", "Things", ("kind",)))
+    gauge = registry.register(Gauge("depth", "Depth", lambda: 7))
+    histogram = registry.register(Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)))
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE things_total counter" in lines
+    assert 'things_total{kind="a"} 3' in lines
+    assert "depth 7" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines
+    assert "latency_seconds_count 3" in lines
+    assert gauge.value() == 7
+
+
+def test_slow_requests_are_logged_with_their_sql(caplog):
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, slow_request_seconds=0)
+
+    @app.get("/slow")
+    def slow():
+        db = TestingSessionLocal()
+        try:
+            return {"books": db.execute(text("SELECT count(*) FROM books")).scalar()}
+        finally:
+            db.close()
+
+    with caplog.at_level(logging.WARNING, logger="slow_requests"):
+        assert TestClient(app).get("/slow?x=1").status_code == 200
+
+    [record] = [r for r in caplog.records if r.name == "slow_requests"]
+    message = record.getMessage()
+    assert message.startswith("GET /slow?x=1 -> 200 in ")
+    assert "1 SQL statements" in message
+    assert "SELECT count(*) FROM books" in message
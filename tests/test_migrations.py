@@ -0,0 +1,146 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import text
+from database import create_db_engine
+from models import Base, NotificationOutbox, Rental
+from migrations import MIGRATIONS, Migration, apply_migrations
+from notifications import claimable_entries, wishlist_recipients
+from pagination import keyset_page
+from reports import active_rentals_query
+from conftest import TestingSessionLocal
+
+QUERY_INDEXES = {"ix_rentals_active", "ix_rentals_user", "ix_wishlist_book_user", "ix_notification_outbox_pending"}
+
+
+def schema_names(engine, kind="index"):
+    with engine.connect() as connection:
+        return set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = :kind"), {"kind": kind}).scalars())
+
+
+def query_plan(db, q) -> str:
+    sql = q.statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True})
+    return "\n".join(row[3] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+
+# A database created before the indexes existed
+def legacy_engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}", profile="test")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for name in QUERY_INDEXES:
+            connection.execute(text(f"DROP INDEX {name}"))
+        connection.execute(text("DROP TABLE schema_migrations"))
+    return engine
+
+
+def test_migrations_add_indexes_to_existing_database(tmp_path):
+    engine = legacy_engine(tmp_path)
+    assert not QUERY_INDEXES & schema_names(engine)
+
+    assert apply_migrations(engine) == [migration.version for migration in MIGRATIONS]
+    assert QUERY_INDEXES <= schema_names(engine)
+    # Recorded, so the next startup has nothing to do
+    assert apply_migrations(engine) == []
+    engine.dispose()
+
+
+def test_migrations_are_safe_on_a_new_database(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'new.db'}", profile="test")
+    Base.metadata.create_all(bind=engine)
+    assert QUERY_INDEXES <= schema_names(engine)
+    assert apply_migrations(engine) == [migration.version for migration in MIGRATIONS]
+    engine.dispose()
+
+
+# Books with a single availability flag and rentals without copies, as they
+# were before book_copies
+def test_migration_gives_existing_books_copies(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'flags.db'}", profile="test")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE schema_migrations"))
+        connection.execute(text("DROP TABLE book_copies"))
+        connection.execute(text("DROP TABLE books"))
+        connection.execute(text("DROP TABLE rentals"))
+        connection.execute(text(
+            "CREATE TABLE books (id INTEGER PRIMARY KEY, isbn VARCHAR NOT NULL, title VARCHAR, authors VARCHAR,"
+            " publication_year INTEGER, language VARCHAR, available BOOLEAN, amazon_id VARCHAR)"
+        ))
+        connection.execute(text(
+            "CREATE TABLE rentals (id INTEGER PRIMARY KEY, book_id INTEGER, user_id INTEGER NOT NULL,"
+            " rental_date DATETIME, return_date DATETIME)"
+        ))
+        connection.execute(text("INSERT INTO books (id, isbn, title, available) VALUES (1, 'A', 'On Shelf', 1), (2, 'B', 'Rented', 0)"))
+        connection.execute(text("INSERT INTO rentals (book_id, user_id, rental_date) VALUES (2, 1, '2025-01-01 10:00:00')"))
+
+    apply_migrations(engine)
+    with engine.connect() as connection:
+        books = connection.execute(text("SELECT id, copies, available_copies FROM books ORDER BY id")).all()
+        assert [tuple(book) for book in books] == [(1, 1, 1), (2, 1, 0)]
+        copy_id = connection.execute(text("SELECT id FROM book_copies WHERE book_id = 2 AND NOT available")).scalar()
+        assert connection.execute(text("SELECT copy_id FROM rentals")).scalar() == copy_id
+    assert {"book_copies_books_ai", "book_copies_books_au"} <= schema_names(engine, "trigger")
+
+    # Books added from now on get their copy from the trigger
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO books (isbn, title, available) VALUES ('C', 'New', 1)"))
+        assert connection.execute(text("SELECT count(*) FROM book_copies WHERE book_id = 3")).scalar() == 1
+    engine.dispose()
+
+
+def test_failed_migration_is_rolled_back_and_retried(tmp_path):
+    engine = legacy_engine(tmp_path)
+
+    def broken(connection):
+        connection.execute(text("CREATE TABLE half_done (x INTEGER)"))
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        apply_migrations(engine, [Migration(1, "broken", broken)])
+    assert "half_done" not in schema_names(engine, "table")
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM schema_migrations")).scalar() == 0
+    assert apply_migrations(engine) == [migration.version for migration in MIGRATIONS]
+    engine.dispose()
+
+
+def test_active_rentals_use_partial_index():
+    db = TestingSessionLocal()
+    try:
+        plan = query_plan(db, keyset_page(active_rentals_query(db), Rental.id, 10, 50))
+        assert "USING INDEX ix_rentals_active (id>?)" in plan
+        assert "TEMP B-TREE" not in plan
+    finally:
+        db.close()
+
+
+def test_user_rental_history_uses_user_index_in_order():
+    db = TestingSessionLocal()
+    try:
+        q = db.query(Rental.id, Rental.return_date).filter(Rental.user_id == 1)
+        plan = query_plan(db, keyset_page(q, Rental.id, 10, 50))
+        assert "ix_rentals_user (user_id=? AND id>?)" in plan
+        assert "TEMP B-TREE" not in plan
+    finally:
+        db.close()
+
+
+def test_notification_recipients_use_wishlist_index_in_order():
+    db = TestingSessionLocal()
+    try:
+        plan = query_plan(db, wishlist_recipients(db, 1, 0, 500))
+        assert "ix_wishlist_book_user (book_id=? AND user_id>?)" in plan
+        assert "TEMP B-TREE" not in plan
+    finally:
+        db.close()
+
+
+def test_outbox_claim_reads_only_pending_entries():
+    db = TestingSessionLocal()
+    try:
+        q = db.query(NotificationOutbox.id).filter(*claimable_entries(datetime.now())).order_by(NotificationOutbox.id)
+        plan = query_plan(db, q)
+        assert "USING INDEX ix_notification_outbox_pending" in plan
+        assert "TEMP B-TREE" not in plan
+    finally:
+        db.close()
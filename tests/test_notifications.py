@@ -0,0 +1,234 @@
+import time
+import pytest
+from datetime import datetime, timedelta
+from models import User, Book, Wishlist, NotificationOutbox, NotificationDelivery
+from notifications import Notification, NotificationDispatcher, NotificationSender, record_deliveries
+from metrics import NOTIFICATIONS_SENT, NOTIFICATIONS_SUPPRESSED
+from conftest import TestingSessionLocal
+
+
+class CollectingSender(NotificationSender):
+    def __init__(self, fail_times=0):
+        self.batches = []
+        self.fail_times = fail_times
+
+    def send_batch(self, notifications):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError("mail server down")
+        self.batches.append(list(notifications))
+
+
+@pytest.fixture(scope="module")
+def wishlisted_book():
+    db = TestingSessionLocal()
+    book = Book(title="Popular Book", authors="Author N", available=False, isbn="NOTIFY1")
+    users = [User(username=f"reader{i}") for i in range(5)]
+    db.add_all([book] + users)
+    db.commit()
+    db.add_all([Wishlist(user_id=user.id, book_id=book.id) for user in users])
+    db.commit()
+    book_id = book.id
+    db.close()
+    return book_id
+
+
+def clear_outbox():
+    db = TestingSessionLocal()
+    db.query(NotificationOutbox).delete()
+    db.commit()
+    db.close()
+
+
+def test_availability_change_stages_outbox_entry(test_client, wishlisted_book):
+    clear_outbox()
+    response = test_client.patch(f"/books/{wishlisted_book}/availability", json={"available": True})
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    entries = db.query(NotificationOutbox).all()
+    assert len(entries) == 1
+    assert entries[0].book_id == wishlisted_book
+    assert entries[0].completed_at is None
+
+    # Making the book unavailable again stages nothing new
+    test_client.patch(f"/books/{wishlisted_book}/availability", json={"available": False})
+    assert db.query(NotificationOutbox).count() == 1
+
+
+def test_dispatcher_delivers_in_batches(wishlisted_book):
+    sender = CollectingSender()
+    dispatcher = NotificationDispatcher(TestingSessionLocal, sender, batch_size=2)
+
+    assert dispatcher.run_once() == 5
+    assert [len(batch) for batch in sender.batches] == [2, 2, 1]
+    assert "Dear reader0, the book 'Popular Book'" in sender.batches[0][0].message
+
+    db = TestingSessionLocal()
+    assert db.query(NotificationOutbox).filter(NotificationOutbox.completed_at.is_(None)).count() == 0
+
+    # Completed entries are not delivered twice
+    assert dispatcher.run_once() == 0
+
+
+def test_dispatcher_retries_failed_batches(wishlisted_book):
+    clear_outbox()
+    db = TestingSessionLocal()
+    db.add(NotificationOutbox(book_id=wishlisted_book, book_title="Popular Book", available_at=datetime.now()))
+    db.commit()
+
+    sender = CollectingSender(fail_times=1)
+    dispatcher = NotificationDispatcher(TestingSessionLocal, sender, batch_size=10, retry_delay=timedelta(0))
+    with pytest.raises(RuntimeError):
+        dispatcher.run_once()
+
+    entry = db.query(NotificationOutbox).one()
+    db.refresh(entry)
+    assert entry.attempts == 1
+    assert entry.completed_at is None
+
+    assert dispatcher.run_once() == 5
+    assert len(sender.batches) == 1
+
+
+def test_dispatcher_background_workers(wishlisted_book):
+    clear_outbox()
+    db = TestingSessionLocal()
+    db.add(NotificationOutbox(book_id=wishlisted_book, book_title="Popular Book", available_at=datetime.now()))
+    db.commit()
+
+    sender = CollectingSender()
+    dispatcher = NotificationDispatcher(TestingSessionLocal, sender, workers=2, poll_interval=0.05)
+    dispatcher.start()
+    try:
+        dispatcher.wake()
+        deadline = datetime.now() + timedelta(seconds=5)
+        while not sender.batches and datetime.now() < deadline:
+            time.sleep(0.05)
+    finally:
+        dispatcher.stop()
+
+    assert sum(len(batch) for batch in sender.batches) == 5
+
+
+def clear_deliveries():
+    db = TestingSessionLocal()
+    db.query(NotificationDelivery).delete()
+    db.commit()
+    db.close()
+
+
+def stage_availability(book_id, available_at):
+    db = TestingSessionLocal()
+    db.add(NotificationOutbox(book_id=book_id, book_title="Popular Book", available_at=available_at))
+    db.commit()
+    db.close()
+
+
+def test_dedupe_window_suppresses_repeated_alerts(wishlisted_book):
+    clear_outbox()
+    clear_deliveries()
+    sender = CollectingSender()
+    dispatcher = NotificationDispatcher(TestingSessionLocal, sender, dedupe_window=timedelta(hours=1))
+    suppressed = NOTIFICATIONS_SUPPRESSED.value("duplicate")
+
+    # Three availability flips within the window: one alert per wishlister
+    now = datetime.now()
+    stage_availability(wishlisted_book, now)
+    assert dispatcher.run_once() == 5
+    stage_availability(wishlisted_book, now + timedelta(minutes=10))
+    stage_availability(wishlisted_book, now + timedelta(minutes=20))
+    assert dispatcher.run_once() == 0
+    assert len(sender.batches) == 1
+    assert NOTIFICATIONS_SUPPRESSED.value("duplicate") == suppressed + 10
+
+    # Once the window has passed the book is announced again
+    stage_availability(wishlisted_book, now + timedelta(hours=2))
+    assert dispatcher.run_once() == 5
+
+
+def test_failed_send_is_not_recorded_as_delivered(wishlisted_book):
+    clear_outbox()
+    clear_deliveries()
+    sender = CollectingSender(fail_times=1)
+    dispatcher = NotificationDispatcher(TestingSessionLocal, sender, retry_delay=timedelta(0),
+                                        dedupe_window=timedelta(hours=1))
+    stage_availability(wishlisted_book, datetime.now())
+    with pytest.raises(RuntimeError):
+        dispatcher.run_once()
+    assert dispatcher.run_once() == 5
+
+
+def test_digest_batches_a_users_alerts(wishlisted_book):
+    clear_outbox()
+    clear_deliveries()
+    db = TestingSessionLocal()
+    other = Book(title="Second Book", authors="Author N", available=False, isbn="NOTIFY2")
+    db.add(other)
+    db.commit()
+    reader = db.query(User).filter(User.username == "reader0").one()
+    db.add(Wishlist(user_id=reader.id, book_id=other.id))
+    db.add(NotificationOutbox(book_id=other.id, book_title="Second Book", available_at=datetime.now()))
+    db.commit()
+    stage_availability(wishlisted_book, datetime.now())
+    stage_availability(wishlisted_book, datetime.now())
+
+    sender = CollectingSender()
+    dispatcher = NotificationDispatcher(TestingSessionLocal, sender, dedupe_window=timedelta(hours=1),
+                                        digest_interval=3600)
+    sent, duplicates, digested = (NOTIFICATIONS_SENT.value(), NOTIFICATIONS_SUPPRESSED.value("duplicate"),
+                                  NOTIFICATIONS_SUPPRESSED.value("digest"))
+
+    # Alerts are only queued until the digest goes out
+    assert dispatcher.run_once() == 0
+    assert sender.batches == []
+
+    assert dispatcher.flush_digests() == 5
+    digests = {digest.username: digest for digest in sender.batches[0]}
+    assert [title for title, _ in digests["reader0"].books] == ["Second Book", "Popular Book"]
+    assert "these books on your wishlist" in digests["reader0"].message
+    assert digests["reader1"].message.startswith("Dear reader1, the book 'Popular Book'")
+
+    # 7 alerts (6 + 1 repeated flip) became 5 messages
+    assert NOTIFICATIONS_SENT.value() == sent + 5
+    assert NOTIFICATIONS_SUPPRESSED.value("duplicate") == duplicates + 5
+    assert NOTIFICATIONS_SUPPRESSED.value("digest") == digested + 1
+    assert dispatcher.flush_digests() == 0
+
+    db.query(Wishlist).filter(Wishlist.book_id == other.id).delete()
+    db.commit()
+    db.close()
+
+
+def test_alert_queued_during_a_digest_stays_pending(wishlisted_book):
+    clear_outbox()
+    clear_deliveries()
+    db = TestingSessionLocal()
+    reader = db.query(User).filter(User.username == "reader1").one()
+    earlier = datetime.now() - timedelta(hours=2)
+    record_deliveries(db, [Notification(reader.id, "reader1", wishlisted_book, "Popular Book", earlier)], None)
+    db.commit()
+
+    # While the digest is being sent, another process sends and marks the
+    # same alert, and the book comes back again: that alert is staged anew
+    stager = NotificationDispatcher(TestingSessionLocal, CollectingSender(), digest_interval=3600)
+
+    class RequeueingSender(CollectingSender):
+        def send_batch(self, notifications):
+            super().send_batch(notifications)
+            if len(self.batches) > 1:
+                return
+            with TestingSessionLocal() as other:
+                other.query(NotificationDelivery).update({NotificationDelivery.sent_at: datetime.now()})
+                other.commit()
+            stage_availability(wishlisted_book, datetime.now())
+            assert stager.run_once() == 0
+
+    dispatcher = NotificationDispatcher(TestingSessionLocal, RequeueingSender(), digest_interval=3600)
+    # reader1's digest, then those of the readers after reader1 just staged
+    assert dispatcher.flush_digests() == 4
+    pending = db.query(NotificationDelivery).filter(NotificationDelivery.user_id == reader.id).one()
+    db.refresh(pending)
+    assert pending.sent_at is None
+    assert pending.available_at > earlier
+    db.close()
@@ -0,0 +1,59 @@
+import pytest
+from models import User, Book, Rental, Wishlist
+from conftest import TestingSessionLocal
+
+# Fixed number of SQL statements per request. An N+1 regression (a lazy load
+# per row) makes these grow with the data and fail.
+
+
+@pytest.fixture(scope="module")
+def reader():
+    db = TestingSessionLocal()
+    user = User(username="counted_reader")
+    books = [Book(title=f"Counted Book {i}", authors="Author Q", available=True, isbn=f"COUNT{i}") for i in range(10)]
+    db.add_all([user] + books)
+    db.commit()
+    db.add_all([Wishlist(user_id=user.id, book_id=book.id) for book in books])
+    db.commit()
+    ids = (user.id, [book.id for book in books])
+    db.close()
+    return ids
+
+
+def test_get_wishlist_single_query(test_client, count_queries, reader):
+    user_id, book_ids = reader
+    with count_queries() as statements:
+        response = test_client.get(f"/wishlist/{user_id}")
+    assert response.status_code == 200
+    assert [item["book_id"] for item in response.json()] == book_ids
+    assert len(statements) == 1
+
+
+def test_create_rental_query_count(test_client, count_queries, reader):
+    user_id, book_ids = reader
+    with count_queries() as statements:
+        response = test_client.post("/rentals", json={"book_id": book_ids[0], "user_id": user_id})
+    assert response.status_code == 200
+    # lookup of book + user, claim a copy, update the book's counts, insert rental
+    assert len(statements) == 4, statements
+
+
+def test_create_rental_missing_user_query_count(test_client, count_queries, reader):
+    _, book_ids = reader
+    with count_queries() as statements:
+        response = test_client.post("/rentals", json={"book_id": book_ids[1], "user_id": 99999})
+    assert response.status_code == 404
+    assert len(statements) == 1
+
+
+def test_return_book_query_count(test_client, count_queries, reader):
+    user_id, book_ids = reader
+    rental_id = test_client.post("/rentals", json={"book_id": book_ids[2], "user_id": user_id}).json()["id"]
+
+    with count_queries() as statements:
+        response = test_client.patch(f"/rentals/{rental_id}/return")
+    assert response.status_code == 200
+    assert response.json()["message"] == "Book 'Counted Book 2' returned by counted_reader"
+    # rental + book + user lookup, update rental, release the copy, update the
+    # book's counts, insert outbox entry
+    assert len(statements) == 5, statements
@@ -0,0 +1,102 @@
+import pytest
+from datetime import datetime, timedelta
+from models import User, Book, Rental, ArchivedRental
+from conftest import TestingSessionLocal
+from rental_archive import archive_rentals
+from rental_stats import read_rental_stats, verify_rental_stats
+from reports import rental_summary
+
+
+@pytest.fixture(scope="module")
+def rental_history():
+    # One user with 6 rentals: 4 returned long ago, 1 returned yesterday and
+    # 1 still open
+    db = TestingSessionLocal()
+    user = User(username="historian")
+    books = [Book(title=f"History Book {i}", authors="Author H", available=True, isbn=f"HIST{i}") for i in range(6)]
+    db.add_all([user] + books)
+    db.commit()
+    now = datetime.now()
+    rentals = [
+        Rental(book_id=book.id, user_id=user.id, rental_date=now - timedelta(days=400 - i),
+               return_date=now - timedelta(days=390 - i))
+        for i, book in enumerate(books[:4])
+    ]
+    rentals.append(Rental(book_id=books[4].id, user_id=user.id, rental_date=now - timedelta(days=3),
+                          return_date=now - timedelta(days=1)))
+    rentals.append(Rental(book_id=books[5].id, user_id=user.id, rental_date=now - timedelta(days=2)))
+    db.add_all(rentals)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return user_id
+
+
+def test_archive_moves_old_returned_rentals(rental_history):
+    db = TestingSessionLocal()
+    before = read_rental_stats(db)
+
+    assert archive_rentals(TestingSessionLocal, timedelta(days=30), batch_size=3) == 4
+    assert db.query(ArchivedRental).filter(ArchivedRental.user_id == rental_history).count() == 4
+    assert db.query(Rental).filter(Rental.user_id == rental_history).count() == 2
+
+    # The live counters only cover the live table; with the archive they add
+    # up to what they were before
+    db.expire_all()
+    after = read_rental_stats(db)
+    assert after["returned"] == before["returned"] - 4
+    assert read_rental_stats(db, include_archived=True) == before
+    assert rental_summary(db, include_archived=True) == before
+    assert verify_rental_stats(db) == {}
+
+    # Nothing left to move
+    assert archive_rentals(TestingSessionLocal, timedelta(days=30)) == 0
+    db.close()
+
+
+def test_user_history_reaches_the_archive(test_client, rental_history):
+    live = test_client.get(f"/users/{rental_history}/rentals")
+    assert live.status_code == 200
+    assert [rental["archived"] for rental in live.json()] == [False, False]
+
+    first = test_client.get(f"/users/{rental_history}/rentals", params={"include_archived": True, "limit": 4})
+    assert [rental["archived"] for rental in first.json()] == [True, True, True, True]
+    ids = [rental["id"] for rental in first.json()]
+    assert ids == sorted(ids)
+
+    second = test_client.get(f"/users/{rental_history}/rentals", params={
+        "include_archived": True, "limit": 4, "after_id": first.headers["X-Next-After-Id"]
+    })
+    assert [rental["archived"] for rental in second.json()] == [False, False]
+    assert second.json()[1]["return_date"] is None
+    assert "X-Next-After-Id" not in second.headers
+
+
+def test_rental_report_summary_includes_archive_when_asked(test_client, rental_history):
+    live = test_client.get("/rental-report").json()["summary"]
+    everything = test_client.get("/rental-report", params={"include_archived": True}).json()["summary"]
+    db = TestingSessionLocal()
+    total = rental_summary(db, include_archived=True)["total"]
+    db.close()
+    assert f"Total Rentals: {total}" in everything
+    assert f"Total Rentals: {total - 4}" in live
+
+
+def test_newest_rental_is_never_archived(rental_history):
+    db = TestingSessionLocal()
+    user = db.query(User).filter_by(username="testuser").first()
+    long_ago = datetime.now() - timedelta(days=100)
+    db.add_all([Rental(book_id=1, user_id=user.id, rental_date=long_ago, return_date=long_ago) for _ in range(2)])
+    db.commit()
+    newest = db.query(Rental.id).order_by(Rental.id.desc()).first().id
+
+    assert archive_rentals(TestingSessionLocal, timedelta(days=30)) == 1
+    assert db.get(Rental, newest) is not None
+
+    # New rentals keep getting ids the archive has never seen
+    rental = Rental(book_id=1, user_id=user.id)
+    db.add(rental)
+    db.commit()
+    assert rental.id > newest
+    assert db.get(ArchivedRental, rental.id) is None
+    db.close()
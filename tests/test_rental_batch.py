@@ -0,0 +1,133 @@
+import pytest
+from models import User, Book, Rental, NotificationOutbox, Wishlist
+from conftest import TestingSessionLocal
+
+
+@pytest.fixture
+def kiosk():
+    db = TestingSessionLocal()
+    user = User(username=f"kiosk_user_{db.query(User).count()}")
+    books = [
+        Book(title=f"Batch Book {i}", authors="Author K", available=True, isbn=f"BATCH{db.query(Book).count()}-{i}")
+        for i in range(5)
+    ]
+    db.add_all([user] + books)
+    db.commit()
+    ids = (user.id, [book.id for book in books])
+    db.close()
+    return ids
+
+
+def test_batch_rental_per_item_results(test_client, kiosk):
+    user_id, book_ids = kiosk
+    db = TestingSessionLocal()
+    db.get(Book, book_ids[1]).available = False
+    db.commit()
+
+    response = test_client.post("/rentals/batch", json={"items": [
+        {"book_id": book_ids[0], "user_id": user_id},
+        {"book_id": book_ids[1], "user_id": user_id},
+        {"book_id": 99999, "user_id": user_id},
+        {"book_id": book_ids[2], "user_id": 99999},
+        {"book_id": book_ids[3], "user_id": user_id},
+        {"book_id": book_ids[3], "user_id": user_id},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["succeeded"] == 2
+    assert body["failed"] == 4
+    assert [(r["status_code"], r["detail"]) for r in body["results"]] == [
+        (200, None),
+        (400, "Book is already rented"),
+        (404, "Book not found"),
+        (404, "User not found"),
+        (200, None),
+        (400, "Book is already rented"),
+    ]
+    assert body["results"][0]["rental"]["book_id"] == book_ids[0]
+    assert body["results"][1]["rental"] is None
+
+    db = TestingSessionLocal()
+    rented = {rental.book_id for rental in db.query(Rental).filter(Rental.book_id.in_(book_ids))}
+    assert rented == {book_ids[0], book_ids[3]}
+    available = {book.id: book.available for book in db.query(Book).filter(Book.id.in_(book_ids))}
+    assert available == {book_ids[0]: False, book_ids[1]: False, book_ids[2]: True, book_ids[3]: False, book_ids[4]: True}
+
+
+def test_batch_return_stages_one_notification_per_book(test_client, kiosk):
+    user_id, book_ids = kiosk
+    db = TestingSessionLocal()
+    db.add(Wishlist(user_id=user_id, book_id=book_ids[0]))
+    db.commit()
+
+    rented = test_client.post("/rentals/batch", json={"items": [
+        {"book_id": book_id, "user_id": user_id} for book_id in book_ids[:3]
+    ]}).json()
+    rental_ids = [result["rental"]["id"] for result in rented["results"]]
+    test_client.patch(f"/rentals/{rental_ids[2]}/return")
+
+    response = test_client.post("/rentals/returns/batch", json={"rental_ids": rental_ids + [rental_ids[0], 99999]})
+    assert response.status_code == 200
+    body = response.json()
+    assert [(r["status_code"], r["detail"]) for r in body["results"]] == [
+        (200, None),
+        (200, None),
+        (400, "Book already returned"),
+        (400, "Book already returned"),
+        (404, "Rental not found"),
+    ]
+    assert body["results"][0]["rental"]["return_date"] is not None
+
+    db = TestingSessionLocal()
+    assert all(book.available for book in db.query(Book).filter(Book.id.in_(book_ids[:3])))
+    staged = db.query(NotificationOutbox.book_id).filter(NotificationOutbox.book_id.in_(book_ids[:2])).all()
+    assert sorted(row.book_id for row in staged) == book_ids[:2]
+
+
+def test_batch_size_is_validated(test_client):
+    assert test_client.post("/rentals/batch", json={"items": []}).status_code == 422
+    response = test_client.post("/rentals/returns/batch", json={"rental_ids": list(range(1, 1002))})
+    assert response.status_code == 422
+
+
+def test_batch_rental_query_count(test_client, count_queries, kiosk):
+    user_id, book_ids = kiosk
+    with count_queries() as statements:
+        response = test_client.post("/rentals/batch", json={"items": [
+            {"book_id": book_id, "user_id": user_id} for book_id in book_ids
+        ]})
+    assert response.json()["succeeded"] == 5
+    # books, users, claim copies, update the books' counts, one multi-row insert
+    assert len(statements) == 5, statements
+
+
+def test_batch_return_query_count(test_client, count_queries, kiosk):
+    user_id, book_ids = kiosk
+    rented = test_client.post("/rentals/batch", json={"items": [
+        {"book_id": book_id, "user_id": user_id} for book_id in book_ids
+    ]}).json()
+    rental_ids = [result["rental"]["id"] for result in rented["results"]]
+
+    with count_queries() as statements:
+        response = test_client.post("/rentals/returns/batch", json={"rental_ids": rental_ids})
+    assert response.json()["succeeded"] == 5
+    # rentals with books and users, close rentals, free copies, update the
+    # books' counts, stage notifications
+    assert len(statements) == 5, statements
+
+
+def test_batch_rents_as_many_copies_as_are_free(test_client, kiosk):
+    user_id, book_ids = kiosk
+    test_client.post(f"/books/{book_ids[0]}/copies", params={"count": 2})
+
+    response = test_client.post("/rentals/batch", json={"items": [
+        {"book_id": book_ids[0], "user_id": user_id} for _ in range(4)
+    ]})
+    results = response.json()["results"]
+    assert [result["status_code"] for result in results] == [200, 200, 200, 400]
+    assert len({result["rental"]["copy_id"] for result in results[:3]}) == 3
+
+    db = TestingSessionLocal()
+    book = db.get(Book, book_ids[0])
+    assert (book.available_copies, book.available) == (0, False)
+    db.close()
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from inventory import add_copies, claim_copy
+from main import app
+from models import User, Book, BookCopy, Rental
+from conftest import TestingSessionLocal
+
+ATTEMPTS = 2000
+CONCURRENCY = 64
+
+
+# Many clients racing for the last copy: the conditional update must let
+# exactly one of them through, however the requests interleave. The requests
+# share one event loop (TestClient would give each thread its own), so this
+# checks the endpoint; the claims racing on separate threads and connections
+# are checked below.
+def test_concurrent_rentals_of_one_book(test_client):
+    db = TestingSessionLocal()
+    users = [User(username=f"racer{i}") for i in range(CONCURRENCY)]
+    book = Book(title="Contended Book", authors="Author R", available=True, isbn="RACE1")
+    db.add_all(users + [book])
+    db.commit()
+    user_ids = [user.id for user in users]
+    book_id = book.id
+    db.close()
+
+    async def race():
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def attempt(i):
+                async with semaphore:
+                    response = await client.post(
+                        "/rentals", json={"book_id": book_id, "user_id": user_ids[i % CONCURRENCY]}
+                    )
+                    return response.status_code
+
+            return await asyncio.gather(*(attempt(i) for i in range(ATTEMPTS)))
+
+    statuses = Counter(asyncio.run(race()))
+
+    assert statuses == {200: 1, 400: ATTEMPTS - 1}
+
+    db = TestingSessionLocal()
+    assert db.query(Rental).filter_by(book_id=book_id).count() == 1
+    assert db.get(Book, book_id).available is False
+
+
+THREADS = 16
+COPIES = 5
+
+
+# Threads with a connection each, released together, claiming the copies of
+# one book: every copy goes to exactly one claim, and the rest find none
+def test_concurrent_copy_claims_on_separate_connections():
+    db = TestingSessionLocal()
+    book = Book(title="Threaded Copies", authors="Author T", available=True, isbn="RACE2")
+    db.add(book)
+    db.flush()
+    add_copies(db, book.id, COPIES - 1)
+    db.commit()
+    book_id = book.id
+    db.close()
+
+    barrier = threading.Barrier(THREADS)
+
+    def claim(_):
+        with TestingSessionLocal() as session:
+            barrier.wait()
+            claimed = [claim_copy(session, book_id) for _ in range(2)]
+            session.commit()
+            return [copy_id for copy_id in claimed if copy_id is not None]
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        claimed = [copy_id for copy_ids in pool.map(claim, range(THREADS)) for copy_id in copy_ids]
+
+    assert len(claimed) == len(set(claimed)) == COPIES
+    db = TestingSessionLocal()
+    assert db.get(Book, book_id).available_copies == 0
+    assert db.query(BookCopy).filter_by(book_id=book_id, available=True).count() == 0
+    db.close()
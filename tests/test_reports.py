@@ -1,7 +1,14 @@
+import csv
+import io
+import json
+import os
 import pytest
-from models import User, Book, Rental
+from models import User, Book, Rental, RentalStats
 from datetime import datetime, timedelta
 from conftest import TestingSessionLocal
+from rental_stats import read_rental_stats, verify_rental_stats, rebuild_rental_stats
+from report_file import write_rental_report
+import report_file
 
 def test_rental_report(test_client):
     response = test_client.get("/rental-report")
@@ -83,4 +90,172 @@ def test_rental_report_with_active_rentals(test_client):
 
     assert len(data["report_lines"]) == 1
     assert any("Books Currently Rented: 1" in s for s in data["summary"])
-    assert any("Returned Rentals: 0" in s for s in data["summary"])
\ No newline at end of file
+    assert any("Returned Rentals: 0" in s for s in data["summary"])
+
+def test_rental_report_average_duration(test_client):
+    db = TestingSessionLocal()
+    db.query(Rental).delete()
+    db.commit()
+
+    user = db.query(User).filter_by(username="testuser").first()
+    book = db.query(Book).filter_by(isbn="888").first()
+    now = datetime.now()
+    db.add_all([
+        Rental(book_id=book.id, user_id=user.id, rental_date=now - timedelta(days=10), return_date=now - timedelta(days=6)),
+        Rental(book_id=book.id, user_id=user.id, rental_date=now - timedelta(days=9), return_date=now - timedelta(days=2)),
+        Rental(book_id=book.id, user_id=user.id, rental_date=now - timedelta(days=2)),
+    ])
+    db.commit()
+
+    data = test_client.get("/rental-report").json()
+    assert data["summary"] == [
+        "Books Currently Rented: 1",
+        "Returned Rentals: 2",
+        "Total Rentals: 3",
+        "Average Rental Duration: 5 day(s)",
+    ]
+    assert data["report_lines"] == ["'Active Rental Book' rented by testuser for 2 day(s)."]
+
+
+def test_rental_report_paginates_active_rentals(test_client):
+    db = TestingSessionLocal()
+    db.query(Rental).delete()
+    db.commit()
+
+    user = db.query(User).filter_by(username="testuser").first()
+    book = db.query(Book).filter_by(isbn="888").first()
+    db.add_all([Rental(book_id=book.id, user_id=user.id, rental_date=datetime.now()) for _ in range(3)])
+    db.commit()
+
+    first = test_client.get("/rental-report", params={"limit": 2})
+    assert len(first.json()["report_lines"]) == 2
+    assert "Books Currently Rented: 3" in first.json()["summary"]
+
+    second = test_client.get("/rental-report", params={"limit": 2, "after_id": first.headers["X-Next-After-Id"]})
+    assert len(second.json()["report_lines"]) == 1
+    assert "X-Next-After-Id" not in second.headers
+
+
+def test_rental_stats_follow_rental_endpoints(test_client):
+    db = TestingSessionLocal()
+    db.query(Rental).delete()
+    db.commit()
+    assert read_rental_stats(db) == {"active": 0, "returned": 0, "total": 0, "returned_days": 0}
+
+    user = db.query(User).filter_by(username="testuser").first()
+    book = Book(title="Stats Book", authors="Author S", available=True, isbn="STATS1")
+    db.add(book)
+    db.commit()
+
+    rental_id = test_client.post("/rentals", json={"book_id": book.id, "user_id": user.id}).json()["id"]
+    db.expire_all()
+    assert read_rental_stats(db)["active"] == 1
+
+    test_client.patch(f"/rentals/{rental_id}/return")
+    db.expire_all()
+    assert read_rental_stats(db) == {"active": 0, "returned": 1, "total": 1, "returned_days": 0}
+    assert verify_rental_stats(db) == {}
+
+
+def test_rental_stats_verify_and_rebuild():
+    db = TestingSessionLocal()
+    stats = db.get(RentalStats, 1)
+    stats.returned_count += 5
+    db.commit()
+
+    drift = verify_rental_stats(db)
+    assert set(drift) == {"returned", "total"}
+
+    rebuild_rental_stats(db)
+    db.commit()
+    assert verify_rental_stats(db) == {}
+
+
+def open_rentals(count):
+    db = TestingSessionLocal()
+    db.query(Rental).delete()
+    db.commit()
+    user = db.query(User).filter_by(username="testuser").first()
+    book = db.query(Book).filter_by(isbn="888").first()
+    db.add_all([
+        Rental(book_id=book.id, user_id=user.id, rental_date=datetime.now() - timedelta(days=i % 7))
+        for i in range(count)
+    ])
+    db.add(Rental(book_id=book.id, user_id=user.id, rental_date=datetime.now(), return_date=datetime.now()))
+    db.commit()
+    db.close()
+    return user, book
+
+
+def test_rental_report_export_csv_streams_all_active_rentals(test_client, count_queries):
+    user, book = open_rentals(1200)
+
+    with count_queries() as statements:
+        response = test_client.get("/rental-report/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "rental-report.csv" in response.headers["content-disposition"]
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 1200
+    assert [int(row["rental_id"]) for row in rows] == sorted(int(row["rental_id"]) for row in rows)
+    assert rows[1]["title"] == "Active Rental Book"
+    assert rows[1]["username"] == "testuser"
+    assert rows[1]["days_rented"] == "1"
+    # Read in chunks of 500 rather than all at once
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 3
+
+
+def test_rental_report_export_ndjson(test_client):
+    user, book = open_rentals(3)
+
+    response = test_client.get("/rental-report/export", params={"format": "ndjson"})
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert len(records) == 3
+    assert records[0]["book_id"] == book.id
+    assert records[0]["user_id"] == user.id
+    assert datetime.fromisoformat(records[0]["rental_date"])
+
+
+def test_rental_report_export_empty(test_client):
+    open_rentals(0)
+    response = test_client.get("/rental-report/export")
+    assert response.text.strip() == "rental_id,book_id,title,user_id,username,rental_date,days_rented"
+
+
+def test_write_rental_report_replaces_file(tmp_path):
+    open_rentals(2)
+    path = tmp_path / "report.txt"
+    path.write_text("old report\n")
+
+    db = TestingSessionLocal()
+    try:
+        assert write_rental_report(db, str(path)) == 2
+    finally:
+        db.close()
+
+    lines = path.read_text().splitlines()
+    assert lines[0] == "Rental Report - Currently Rented Books"
+    assert lines.count("'Active Rental Book' rented by testuser for 0 day(s).") == 1
+    assert "Books Currently Rented: 2" in lines
+    assert os.listdir(tmp_path) == ["report.txt"]
+
+
+def test_failed_report_write_keeps_previous_file(tmp_path, monkeypatch):
+    path = tmp_path / "report.txt"
+    path.write_text("old report\n")
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("database went away")
+        yield
+
+    monkeypatch.setattr(report_file, "iter_keyset", broken)
+    db = TestingSessionLocal()
+    try:
+        with pytest.raises(RuntimeError):
+            write_rental_report(db, str(path))
+    finally:
+        db.close()
+    assert path.read_text() == "old report\n"
+    assert os.listdir(tmp_path) == ["report.txt"]
@@ -0,0 +1,87 @@
+import json
+import pytest
+from models import Book
+from conftest import TestingSessionLocal, test_engine
+from search_index import search_index_enabled, build_match_query
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed_books():
+    db = TestingSessionLocal()
+    db.add_all([
+        Book(title="Harry Potter and the Philosopher's Stone", authors="J.K. Rowling", isbn="439554934"),
+        Book(title="The Hobbit", authors="J.R.R. Tolkien", isbn="618260307"),
+        Book(title="Animal Farm", authors="George Orwell", isbn="452284244"),
+        Book(title="Nineteen Eighty-Four", authors="George Orwell", isbn="451524934"),
+    ])
+    db.commit()
+    db.close()
+
+
+def test_search_index_created_with_schema():
+    assert search_index_enabled(test_engine)
+
+
+def test_build_match_query_prefix_terms():
+    assert build_match_query(query="Harry Pot") == '"harry"* AND "pot"*'
+    assert build_match_query(title="hobbit", author="tolkien") == (
+        '{title} : ("hobbit"*) AND {authors} : ("tolkien"*)'
+    )
+    assert build_match_query(query="!!!") is None
+
+
+def test_search_prefix_match(test_client):
+    response = test_client.get("/books/search", params={"query": "harry pot"})
+    assert response.status_code == 200
+    titles = [book["title"] for book in response.json()]
+    assert titles == ["Harry Potter and the Philosopher's Stone"]
+
+
+def test_search_by_title_and_author(test_client):
+    response = test_client.get("/books/search", params={"title": "animal", "author": "orwell"})
+    assert [book["title"] for book in response.json()] == ["Animal Farm"]
+
+
+def test_search_ranks_title_matches_first(test_client):
+    db = TestingSessionLocal()
+    db.add(Book(title="Orwell: A Life", authors="Bernard Crick", isbn="0141032"))
+    db.commit()
+    db.close()
+
+    response = test_client.get("/books/search", params={"query": "orwell"})
+    titles = [book["title"] for book in response.json()]
+    assert titles[0] == "Orwell: A Life"
+    assert set(titles[1:]) == {"Animal Farm", "Nineteen Eighty-Four"}
+
+
+def test_search_index_follows_updates(test_client):
+    db = TestingSessionLocal()
+    book = db.query(Book).filter_by(isbn="618260307").first()
+    book.title = "The Hobbit, or There and Back Again"
+    db.commit()
+    db.close()
+
+    response = test_client.get("/books/search", params={"query": "there back"})
+    assert [book["title"] for book in response.json()] == ["The Hobbit, or There and Back Again"]
+
+
+def test_search_by_isbn_prefix(test_client):
+    response = test_client.get("/books/search", params={"query": "45228"})
+    assert [book["title"] for book in response.json()] == ["Animal Farm"]
+
+
+def test_search_ndjson_stream(test_client):
+    response = test_client.get("/books/search", params={"author": "orwell", "format": "ndjson"})
+    assert response.status_code == 200
+    titles = [json.loads(line)["title"] for line in response.text.splitlines()]
+    assert sorted(titles) == ["Animal Farm", "Nineteen Eighty-Four"]
+
+
+def test_search_paginated(test_client):
+    first = test_client.get("/books/search", params={"author": "orwell", "limit": 1})
+    assert len(first.json()) == 1
+    after_id = first.headers["X-Next-After-Id"]
+
+    second = test_client.get("/books/search", params={"author": "orwell", "limit": 1, "after_id": after_id})
+    assert len(second.json()) == 1
+    assert second.json()[0]["id"] > int(after_id)
@@ -0,0 +1,180 @@
+import pytest
+import suggest_index as suggest_index_module
+from suggest_index import SuggestIndex, edit_distance, tokenize
+from models import Book
+from main import suggest_index
+from conftest import TestingSessionLocal, test_engine
+
+
+def make_index(books):
+    index = SuggestIndex()
+    index.loaded = True
+    index.add_books({"id": book_id, "title": title, "authors": authors} for book_id, title, authors in books)
+    return index
+
+
+@pytest.fixture(scope="module")
+def shelf():
+    db = TestingSessionLocal()
+    books = [
+        Book(title="Harry Potter and the Philosopher's Stone", authors="J.K. Rowling", isbn="SUG1"),
+        Book(title="Harry Potter and the Chamber of Secrets", authors="J.K. Rowling", isbn="SUG2"),
+        Book(title="The Hobbit", authors="J.R.R. Tolkien", isbn="SUG3"),
+        Book(title="Pot Roast Recipes", authors="Harry Smith", isbn="SUG4"),
+        Book(title="Les Misérables", authors="Victor Hugo", isbn="SUG5"),
+    ]
+    db.add_all(books)
+    db.commit()
+    ids = [book.id for book in books]
+    db.close()
+    return ids
+
+
+@pytest.fixture
+def loaded_index(shelf):
+    suggest_index.load(test_engine)
+    yield suggest_index
+    suggest_index.clear()
+
+
+def test_tokenize_and_edit_distance():
+    assert tokenize("Les Misérables, Vol. 2") == ["les", "miserables", "vol", "2"]
+    assert edit_distance("rowlng", "rowling", 2) == 1
+    assert edit_distance("tolkein", "tolkien", 2) == 1
+    assert edit_distance("kitten", "sitting", 1) == 2
+
+
+def test_prefix_and_fuzzy_matches():
+    index = make_index([
+        (1, "Harry Potter and the Philosopher's Stone", "J.K. Rowling"),
+        (2, "The Hobbit", "J.R.R. Tolkien"),
+        (3, "Pot Roast", "Harry Smith"),
+    ])
+    assert index.find("harry pot") == [1, 3]
+    assert index.find("rowlng") == []
+    assert index.find("rowlng", fuzzy=True) == [1]
+    assert index.find("tolkein hobit", fuzzy=True) == [2]
+    # Short words and numbers only match by prefix
+    assert index.find("pit", fuzzy=True) == []
+    assert index.find("harry", after_id=1, limit=5) == [3]
+
+
+def test_suggestions_rank_whole_words_first():
+    index = make_index([
+        (1, "Harrying the Potter", "Ann Ames"),
+        (2, "Pot Roast", "Harry Smith"),
+        (3, "Harry Potter", "J.K. Rowling"),
+        (4, "Hary Potts", "Unknown"),
+    ])
+    # "harry" as a whole word first, then as a prefix or with a typo
+    assert index.suggest("harry pot", 10) == [2, 3, 1, 4]
+    assert index.suggest("harry pot", 3) == [2, 3, 1]
+    assert index.suggest("harry pot", 10, fuzzy=False) == [2, 3, 1]
+    assert index.suggest("pot roats", 10) == [2]
+
+
+def test_books_added_out_of_order_and_changed():
+    index = make_index([(5, "Winter Garden", "Ann Lee")])
+    index.add_books([{"id": 2, "title": "Winter Letters", "authors": "Tom Moss"}])
+    index.add_books([{"id": 5, "title": "Summer Garden", "authors": "Ann Lee"}])
+    # The old title no longer matches
+    assert index.find("winter") == [2]
+    assert index.find("summer garden") == [5]
+    assert not SuggestIndex.matches("winter", "Summer Garden", "Ann Lee")
+    assert SuggestIndex.matches("sumer gard", "Summer Garden", fuzzy=True)
+
+
+def test_reindexed_books_stay_in_the_flat_arrays(monkeypatch):
+    monkeypatch.setattr(suggest_index_module, "MIN_LATE_BOOKS", 1)
+    books = [(book_id, f"Volume {book_id} Saga", "Ann Lee") for book_id in range(10, 50)]
+    index = make_index(books)
+
+    # A re-import with the same or fewer words overwrites each book in place
+    index.add_books({"id": book_id, "title": f"Volume {book_id}", "authors": "Ann Lee"} for book_id, _, _ in books)
+    assert (len(index._book_ids), index._late_books) == (40, {})
+    assert index.find("saga") == []
+    assert index.find("volume 12 lee") == [12]
+
+    # Books with more words, or below the last id, are merged back in
+    index.add_books({"id": book_id, "title": f"Volume {book_id} Saga Redux", "authors": "Ann Lee"} for book_id in (5, 11, 30, 40))
+    assert index._late_books == {}
+    assert list(index._book_ids)[:3] == [5, 10, 11]
+    assert index.find("saga redux") == [5, 11, 30, 40]
+    assert index.find("volume lee", limit=3) == [5, 10, 11]
+
+
+def test_sparse_ids_take_space_per_book():
+    # Goodreads ids: a few books spread over millions of ids
+    index = make_index([(3, "Sparse Dune", "Frank Herbert"), (22557272, "Sparse Emma", "Jane Austen"),
+                        (9000000, "Sparse Ulysses", "James Joyce")])
+    assert len(index._offsets) == 3
+    assert index.find("sparse") == [3, 9000000, 22557272]
+    assert index.find("sparse emma") == [22557272]
+    assert index.find("sparse joyce") == [9000000]
+
+def test_not_loaded_ignores_updates():
+    index = SuggestIndex()
+    index.add_books([{"id": 1, "title": "Ignored", "authors": None}])
+    index.loaded = True
+    assert index.find("ignored") == []
+
+
+def test_autocomplete_endpoint(test_client, loaded_index, shelf):
+    response = test_client.get("/books/autocomplete", params={"query": "Harry Pot"})
+    assert response.status_code == 200
+    assert [book["id"] for book in response.json()] == [shelf[0], shelf[1], shelf[3]]
+    assert set(response.json()[0]) == {"id", "title", "authors", "available", "available_copies"}
+
+    typo = test_client.get("/books/autocomplete", params={"query": "Rowlng chamb"})
+    assert [book["id"] for book in typo.json()] == [shelf[1]]
+    accents = test_client.get("/books/autocomplete", params={"query": "miserab", "limit": 1})
+    assert [book["id"] for book in accents.json()] == [shelf[4]]
+
+
+def test_autocomplete_without_index_uses_search(test_client, shelf):
+    assert not suggest_index.loaded
+    response = test_client.get("/books/autocomplete", params={"query": "harry pot", "limit": 5})
+    assert response.status_code == 200
+    assert {book["id"] for book in response.json()} == {shelf[0], shelf[1], shelf[3]}
+
+
+def test_fuzzy_search(test_client, loaded_index, shelf):
+    response = test_client.get("/books/search", params={"query": "Rowlng", "fuzzy": "true"})
+    assert [book["id"] for book in response.json()] == [shelf[0], shelf[1]]
+
+    # Field filters only match their own column
+    by_author = test_client.get("/books/search", params={"author": "hary", "fuzzy": "true"})
+    assert [book["id"] for book in by_author.json()] == [shelf[3]]
+
+    first = test_client.get("/books/search", params={"query": "rowlng", "fuzzy": "true", "limit": 1})
+    assert [book["id"] for book in first.json()] == [shelf[0]]
+    second = test_client.get("/books/search", params={
+        "query": "rowlng", "fuzzy": "true", "limit": 1, "after_id": first.headers["X-Next-After-Id"]
+    })
+    assert [book["id"] for book in second.json()] == [shelf[1]]
+
+    assert test_client.get("/books/search", params={"query": "rowlng", "fuzzy": "true", "format": "ndjson"}).status_code == 400
+
+
+def test_fuzzy_search_reads_the_index_a_page_at_a_time(test_client, loaded_index, shelf, monkeypatch):
+    # Stale index entries: these books' rows don't say Rowling
+    loaded_index.add_books({"id": book_id, "title": "Rowling", "authors": None} for book_id in shelf[2:])
+    calls = []
+    find = loaded_index.find
+    monkeypatch.setattr(loaded_index, "find", lambda text, **options: calls.append(options) or find(text, **options))
+
+    page = test_client.get("/books/search", params={"query": "rowlng", "fuzzy": "true", "limit": 1, "after_id": shelf[0]})
+    assert [book["id"] for book in page.json()] == [shelf[1]]
+    assert calls == [{"fuzzy": True, "after_id": shelf[0], "limit": 2}]
+
+    calls.clear()
+    rest = test_client.get("/books/search", params={"query": "rowlng", "fuzzy": "true", "limit": 1, "after_id": shelf[1]})
+    assert rest.json() == []
+    assert [call["after_id"] for call in calls] == [shelf[1], shelf[3]]
+
+
+def test_imported_books_are_suggested(test_client, loaded_index):
+    csv_text = "Id,ISBN,Authors,Publication Year,Title,Language\n950,SUGIMP,Quentin Blake,1990,Zebra Crossing,eng\n"
+    response = test_client.post("/admin/books/import", content=csv_text, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert [book["id"] for book in test_client.get("/books/autocomplete", params={"query": "zebr"}).json()] == [950]